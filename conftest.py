@@ -0,0 +1,2 @@
+# Проверка N+1 для tests/ и yatube/posts/tests: pytest yatube/posts/tests
+pytest_plugins = ['core.pytest_plugin']
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        if settings.TEMPLATE_PROFILING:
+            from . import template_profile
+            template_profile.install()
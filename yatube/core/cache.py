@@ -0,0 +1,515 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics, timing
+
+BUSY_TIMEOUT_SEC = 5
+# Страницы отображаются в память процесса, чтение идёт без read().
+MMAP_SIZE = 64 * 1024 * 1024
+# Лимит SQLite на число параметров в запросе.
+MAX_VARIABLES = 900
+# Как часто (в записях одного потока) проверять переполнение.
+CULL_EVERY = 256
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+
+
+def _chunks(items, size=MAX_VARIABLES):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite, общий для всех процессов на машине.
+
+    LOCATION — путь к файлу. База работает в режиме WAL: читатели
+    не ждут писателей, а каждая запись атомарна. Истёкшие ключи
+    не возвращаются и удаляются при чистке, которая заодно
+    вытесняет ключи с ближайшим сроком сверх MAX_ENTRIES.
+    Значения сериализуются pickle, как в FileBasedCache.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+
+    def _connection(self):
+        """Своё соединение у каждого потока; после fork — новое."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(
+                self._path, timeout=BUSY_TIMEOUT_SEC,
+                isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            local.connection = connection
+            local.pid = os.getpid()
+            local.writes = 0
+        return local.connection
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time())).fetchone()
+        metrics.cache_lookup(key, row is not None)
+        timing.cache_operation('get', key, row is not None)
+        if row is None:
+            timing.cache_lookup(0, 1)
+            return default
+        timing.cache_lookup(1)
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys_by_made = {self._key(key, version): key for key in keys}
+        made = list(keys_by_made)
+        found = {}
+        now = time.time()
+        connection = self._connection()
+        for chunk in _chunks(made):
+            placeholders = ', '.join('?' * len(chunk))
+            rows = connection.execute(
+                f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+                f'AND (expires IS NULL OR expires > ?)', (*chunk, now))
+            for made_key, value in rows:
+                found[keys_by_made[made_key]] = pickle.loads(value)
+        timing.cache_lookup(len(found), len(made) - len(found))
+        for key in keys_by_made.values():
+            metrics.cache_lookup(key, key in found)
+            timing.cache_operation('get', key, key in found)
+        return found
+
+    def has_key(self, key, version=None):
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self._key(key, version), time.time())).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timing.cache_operation('set', key)
+        self._write(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            [(self._key(key, version), self._dumps(value),
+              self.get_backend_timeout(timeout))])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        for key in data:
+            timing.cache_operation('set', key)
+        self._write(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            [(self._key(key, version), self._dumps(value), expires)
+             for key, value in data.items()])
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Записывает, только если ключа нет или он истёк."""
+        timing.cache_operation('add', key)
+        cursor = self._write(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            [(self._key(key, version), self._dumps(value),
+              self.get_backend_timeout(timeout), time.time())])
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._write(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [(self.get_backend_timeout(timeout), self._key(key, version),
+              time.time())])
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарно: чтение и запись в одной транзакции IMMEDIATE."""
+        timing.cache_operation('incr', key)
+        key = self._key(key, version)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?',
+                               (self._dumps(value), key))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return value
+
+    def delete(self, key, version=None):
+        timing.cache_operation('delete', key)
+        cursor = self._write('DELETE FROM cache WHERE key = ?',
+                             [(self._key(key, version),)])
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            timing.cache_operation('delete', key)
+        self._write('DELETE FROM cache WHERE key = ?',
+                    [(self._key(key, version),) for key in keys])
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _write(self, statement, rows):
+        """Выполняет запись для всех rows в одной транзакции."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.executemany(statement, rows)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._local.writes += len(rows)
+        if self._local.writes >= CULL_EVERY:
+            self._local.writes = 0
+            self._cull()
+        return cursor
+
+    def _cull(self):
+        """Удаляет истёкшие ключи и, при переполнении, часть прочих."""
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires <= ?',
+                           (time.time(),))
+        count, = connection.execute('SELECT count(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        excess = count
+        if self._cull_frequency:
+            excess //= self._cull_frequency
+        connection.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+            'ORDER BY expires IS NULL, expires LIMIT ?)', (excess,))
+
+
+class CountMinSketch:
+    """Приблизительные частоты ключей для допуска в TinyLFU.
+
+    Счётчики насыщаются на 15 и делятся пополам каждые
+    10 * width обращений, так что старая популярность забывается.
+    Строки независимы: ячейка — старшие биты hash(key) * нечётная
+    константа (multiply-shift), width округляется до степени двойки.
+    """
+    DEPTH = 4
+    MAX_COUNT = 15
+    MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+                   0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    MASK = (1 << 64) - 1
+
+    def __init__(self, width):
+        self.bits = max(1, (width - 1).bit_length())
+        self.width = 1 << self.bits
+        self.rows = [bytearray(self.width) for _ in range(self.DEPTH)]
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def _cells(self, key):
+        hashed = hash(key) & self.MASK
+        shift = 64 - self.bits
+        return [(row, ((hashed * multiplier) & self.MASK) >> shift)
+                for row, multiplier in zip(self.rows, self.MULTIPLIERS)]
+
+    def add(self, key):
+        for row, cell in self._cells(key):
+            if row[cell] < self.MAX_COUNT:
+                row[cell] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.additions //= 2
+            for number, row in enumerate(self.rows):
+                self.rows[number] = bytearray(count >> 1 for count in row)
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in self._cells(key))
+
+
+class SizedLocMemCache(BaseCache):
+    """Кэш в памяти процесса с лимитом в байтах, а не в записях.
+
+    OPTIONS:
+      MAX_BYTES — лимит памяти на значения и ключи (64 МБ);
+      COMPRESS_MIN_BYTES — сжимать zlib значения не меньше этого
+      размера (1024, 0 — не сжимать);
+      SKETCH_WIDTH — ширина count-min sketch.
+
+    Вытеснение — сегментированный LRU: новое попадает в испытательный
+    сегмент, повторное обращение переводит в защищённый (80% памяти).
+    Допуск — TinyLFU: новое значение вытесняет старое, только если
+    обращались к нему не реже. Поэтому редкая большая страница
+    не вытеснит тысячи популярных мелких ключей. Как и memcached,
+    может не сохранить значение: set не гарантирует последующий get.
+    add же, как и incr, допуск проходит всегда: False от add значит,
+    что ключ уже есть, на этом держатся блокировки и версии страниц
+    (posts.caching).
+    """
+
+    PROTECTED_SHARE = 0.8
+    ENTRY_OVERHEAD = 100
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self.compress_min_bytes = int(options.get('COMPRESS_MIN_BYTES',
+                                                  1024))
+        with self._stores_lock:
+            if location not in self._stores:
+                self._stores[location] = _SizedStore(
+                    self.max_bytes,
+                    int(options.get('SKETCH_WIDTH', 16384)))
+            self._store = self._stores[location]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _encode(self, value):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.compress_min_bytes and len(blob) >= self.compress_min_bytes:
+            compressed = zlib.compress(blob)
+            if len(compressed) < len(blob):
+                return compressed, True, len(blob)
+        return blob, False, len(blob)
+
+    @staticmethod
+    def _decode(entry):
+        blob = zlib.decompress(entry.blob) if entry.compressed else entry.blob
+        return pickle.loads(blob)
+
+    def get(self, key, default=None, version=None):
+        entry = self._store.get(self._key(key, version))
+        metrics.cache_lookup(key, entry is not None)
+        timing.cache_operation('get', key, entry is not None)
+        if entry is None:
+            timing.cache_lookup(0, 1)
+            return default
+        timing.cache_lookup(1)
+        return self._decode(entry)
+
+    def has_key(self, key, version=None):
+        return self._store.peek(self._key(key, version)) is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timing.cache_operation('set', key)
+        blob, compressed, raw_size = self._encode(value)
+        self._store.put(self._key(key, version), blob, compressed, raw_size,
+                        self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timing.cache_operation('add', key)
+        key = self._key(key, version)
+        blob, compressed, raw_size = self._encode(value)
+        with self._store.lock:
+            if self._store.peek(key) is not None:
+                return False
+            return self._store.put(key, blob, compressed, raw_size,
+                                   self.get_backend_timeout(timeout),
+                                   admit=True)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store.touch(self._key(key, version),
+                                 self.get_backend_timeout(timeout))
+
+    def incr(self, key, delta=1, version=None):
+        timing.cache_operation('incr', key)
+        made_key = self._key(key, version)
+        with self._store.lock:
+            entry = self._store.peek(made_key)
+            if entry is None:
+                raise ValueError(f"Key '{made_key}' not found")
+            value = self._decode(entry) + delta
+            blob, compressed, raw_size = self._encode(value)
+            self._store.put(made_key, blob, compressed, raw_size,
+                            entry.expires, admit=True)
+        return value
+
+    def delete(self, key, version=None):
+        timing.cache_operation('delete', key)
+        return self._store.delete(self._key(key, version))
+
+    def clear(self):
+        self._store.clear()
+
+    def stats(self):
+        """Попадания, промахи, доля попаданий и занятая память."""
+        return self._store.stats()
+
+
+class _Entry:
+    __slots__ = ('blob', 'compressed', 'raw_size', 'size', 'expires')
+
+    def __init__(self, key, blob, compressed, raw_size, expires):
+        self.blob = blob
+        self.compressed = compressed
+        self.raw_size = raw_size
+        self.size = (len(blob) + len(key)
+                     + SizedLocMemCache.ENTRY_OVERHEAD)
+        self.expires = expires
+
+
+class _SizedStore:
+    """Данные одного LOCATION: два сегмента LRU, sketch и счётчики."""
+
+    def __init__(self, max_bytes, sketch_width):
+        self.max_bytes = max_bytes
+        self.max_protected = int(max_bytes * SizedLocMemCache.PROTECTED_SHARE)
+        self.sketch = CountMinSketch(sketch_width)
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.probation = OrderedDict()
+            self.protected = OrderedDict()
+            self.bytes = self.protected_bytes = self.raw_bytes = 0
+            self.hits = self.misses = self.evictions = self.rejections = 0
+
+    def _segment(self, key):
+        if key in self.protected:
+            return self.protected
+        if key in self.probation:
+            return self.probation
+        return None
+
+    def peek(self, key):
+        """Живая запись без учёта обращения."""
+        with self.lock:
+            segment = self._segment(key)
+            if segment is None:
+                return None
+            entry = segment[key]
+            if entry.expires is not None and entry.expires <= time.time():
+                self._remove(key)
+                return None
+            return entry
+
+    def get(self, key):
+        with self.lock:
+            self.sketch.add(key)
+            entry = self.peek(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self.protected:
+                self.protected.move_to_end(key)
+            else:
+                del self.probation[key]
+                self.protected[key] = entry
+                self.protected_bytes += entry.size
+                self._demote()
+            return entry
+
+    def _demote(self):
+        """Лишнее из защищённого сегмента — в начало испытательного."""
+        while self.protected_bytes > self.max_protected:
+            key, entry = self.protected.popitem(last=False)
+            self.protected_bytes -= entry.size
+            self.probation[key] = entry
+
+    def _victim(self):
+        for segment in (self.probation, self.protected):
+            if segment:
+                return next(iter(segment))
+        return None
+
+    def put(self, key, blob, compressed, raw_size, expires, admit=False):
+        with self.lock:
+            self.sketch.add(key)
+            self._remove(key)
+            entry = _Entry(key, blob, compressed, raw_size, expires)
+            if entry.size > self.max_bytes:
+                self.rejections += 1
+                return False
+            frequency = self.sketch.estimate(key)
+            while self.bytes + entry.size > self.max_bytes:
+                victim = self._victim()
+                if not admit and self.sketch.estimate(victim) > frequency:
+                    self.rejections += 1
+                    return False
+                self._remove(victim)
+                self.evictions += 1
+            self.probation[key] = entry
+            self.bytes += entry.size
+            self.raw_bytes += entry.raw_size
+            return True
+
+    def touch(self, key, expires):
+        with self.lock:
+            entry = self.peek(key)
+            if entry is None:
+                return False
+            entry.expires = expires
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        segment = self._segment(key)
+        if segment is None:
+            return False
+        entry = segment.pop(key)
+        self.bytes -= entry.size
+        self.raw_bytes -= entry.raw_size
+        if segment is self.protected:
+            self.protected_bytes -= entry.size
+        return True
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'entries': len(self.probation) + len(self.protected),
+                'bytes': self.bytes,
+                'uncompressed_bytes': self.raw_bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+            }
@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import import_module
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import seeding
+from posts.models import Comment, Group, Post, User
+
+URL_MODULES = ('posts.urls', 'posts.api_urls', 'users.urls', 'about.urls')
+# GET с побочными эффектами: замер изменил бы данные или вышел бы
+# из сессии.
+SKIP = {
+    'posts:post_delete',
+    'posts:comment_delete',
+    'posts:profile_follow',
+    'posts:profile_unfollow',
+    'users:logout',
+}
+PERCENTILES = (50, 95, 99)
+REPORT_VERSION = 1
+
+
+def percentile(values, rank):
+    """Перцентиль по ближайшему рангу; values отсортированы."""
+    index = max(0, -(-len(values) * rank // 100) - 1)
+    return values[index]
+
+
+def private_caches(folder):
+    """Тот же кэш, но в своём файле: --cold очищает только его.
+
+    Общий кэш сайта очищать нельзя: в нём страницы, блокировки
+    и версии всех процессов сервера.
+    """
+    return {'default': dict(settings.CACHES['default'],
+                            LOCATION=os.path.join(folder, 'cache.sqlite3'))}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class TestClientDriver:
+    """Запросы в этом же процессе, с подсчётом SQL-запросов."""
+
+    def __init__(self, user=None):
+        self.client = Client()
+        if user is not None:
+            self.client.force_login(user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = self.client.get(url)
+            content = (b''.join(response.streaming_content)
+                       if response.streaming else response.content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(context), len(content)
+
+
+class HTTPDriver:
+    """Запросы к запущенному серверу; SQL-запросы не видны."""
+
+    def __init__(self, base_url, user=None):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        if user is not None:
+            self.login(user)
+
+    def login(self, user):
+        url = self.base_url + reverse('users:login')
+        self.session.get(url)
+        response = self.session.post(url, allow_redirects=False, data={
+            'username': user.username,
+            'password': seeding.PASSWORD,
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken'),
+        }, headers={'Referer': url})
+        if response.status_code != 302:
+            raise CommandError(f'Не удалось войти как {user.username}')
+
+    def get(self, url):
+        started = time.perf_counter()
+        response = self.session.get(self.base_url + url,
+                                    allow_redirects=False)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, None, len(response.content)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку всех GET-адресов posts, API, users '
+            'и about: p50/p95/p99, SQL-запросы и байты на ответ, '
+            'гостем и пользователем. Базу заранее наполняет seed_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Замеров на адрес')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Запросов перед замерами')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом; кэш свой, '
+                 'во временном каталоге, только с тестовым клиентом')
+        parser.add_argument(
+            '--base-url',
+            help='Адрес запущенного сервера; без него — тестовый клиент')
+        parser.add_argument(
+            '--output', help='Сохранить отчёт в JSON для сравнения')
+
+    def handle(self, *args, **options):
+        if options['cold'] and options['base_url']:
+            raise CommandError('--cold очищал бы кэш запущенного сервера, '
+                               'он работает только без --base-url')
+        # DEBUG выключен, как на боевом сервере: иначе в замер попадает
+        # работа django-debug-toolbar.
+        overrides = {'DEBUG': False, 'ALLOWED_HOSTS': [
+            *settings.ALLOWED_HOSTS, 'testserver']}
+        with tempfile.TemporaryDirectory() as folder:
+            if options['cold']:
+                overrides['CACHES'] = private_caches(folder)
+            with override_settings(**overrides):
+                self.run(options)
+
+    def run(self, options):
+        post = self.sample_post()
+        if post is None:
+            raise CommandError('В базе нет постов, сначала seed_data')
+        samples = self.samples(post)
+        drivers = {'guest': self.driver(options)}
+        drivers['user'] = self.driver(options, post.author)
+        results = []
+        # Ответы 4xx гостю ожидаемы, предупреждения о них не нужны.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        self.stdout.write(f'{"адрес":<28} {"кто":<6} {"код":>4} '
+                          f'{"p50":>8} {"p95":>8} {"p99":>8} '
+                          f'{"SQL":>5} {"байт":>8}')
+        for name, url in self.urls(samples):
+            for who, driver in drivers.items():
+                result = self.measure(driver, url, options)
+                result.update(name=name, client=who, url=url)
+                results.append(result)
+                self.report(result)
+        if options['output']:
+            report = {
+                'version': REPORT_VERSION,
+                'commit': git_commit(),
+                'created': datetime.now(timezone.utc).isoformat(),
+                'options': {key: options[key] for key in (
+                    'requests', 'warmup', 'cold', 'base_url')},
+                'data': {
+                    'users': User.objects.count(),
+                    'groups': Group.objects.count(),
+                    'posts': Post.objects.count(),
+                    'comments': Comment.objects.count(),
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Отчёт сохранён в {options["output"]}'))
+
+    def driver(self, options, user=None):
+        if options['base_url']:
+            return HTTPDriver(options['base_url'], user)
+        return TestClientDriver(user)
+
+    def sample_post(self):
+        """Самый обсуждаемый пост автора с подписками: у его страниц
+        есть и комментарии, и лента подписок, и группа."""
+        posts = (Post.objects.select_related('author', 'group')
+                 .order_by('-comments_count'))
+        return (posts.filter(author__follower__isnull=False,
+                             group__isnull=False).first()
+                or posts.first())
+
+    def samples(self, post):
+        """Значения параметров адресов по именам конвертеров."""
+        group = post.group or Group.objects.first()
+        comment = post.comments.first()
+        return {
+            'slug': group.slug if group else None,
+            'username': post.author.username,
+            'post_id': post.pk,
+            'comment_id': comment.pk if comment else None,
+        }
+
+    def urls(self, samples):
+        for module_name in URL_MODULES:
+            module = import_module(module_name)
+            for pattern in module.urlpatterns:
+                if not pattern.name:
+                    continue
+                name = f'{module.app_name}:{pattern.name}'
+                if name in SKIP:
+                    continue
+                kwargs = {key: samples.get(key)
+                          for key in pattern.pattern.converters}
+                if None in kwargs.values():
+                    self.stderr.write(f'{name}: нет данных для {kwargs}')
+                    continue
+                yield name, reverse(name, kwargs=kwargs)
+
+    def measure(self, driver, url, options):
+        for _ in range(options['warmup']):
+            driver.get(url)
+        timings, queries, sizes = [], [], []
+        for _ in range(options['requests']):
+            if options['cold']:
+                cache.clear()
+            status, elapsed, count, size = driver.get(url)
+            timings.append(elapsed * 1000)
+            queries.append(count)
+            sizes.append(size)
+        timings.sort()
+        result = {'status': status, 'requests': len(timings),
+                  'mean_ms': round(sum(timings) / len(timings), 3)}
+        for rank in PERCENTILES:
+            result[f'p{rank}_ms'] = round(percentile(timings, rank), 3)
+        result['queries'] = (None if None in queries
+                             else sum(queries) / len(queries))
+        result['bytes'] = sum(sizes) // len(sizes)
+        return result
+
+    def report(self, result):
+        queries = ('-' if result['queries'] is None
+                   else f'{result["queries"]:.1f}')
+        self.stdout.write(
+            f'{result["name"]:<28} {result["client"]:<6} '
+            f'{result["status"]:>4} {result["p50_ms"]:>8.2f} '
+            f'{result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+            f'{queries:>5} {result["bytes"]:>8}')
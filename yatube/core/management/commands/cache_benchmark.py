@@ -0,0 +1,152 @@
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'sqlite': 'core.cache.SQLiteCache',
+    'sized': 'core.cache.SizedLocMemCache',
+}
+GET_MANY_SIZE = 10
+# Смесь для сценария zipf: мелкие ключи миниатюр и крупные страницы.
+SMALL_VALUE = 200
+PAGE_VALUE = 40 * 1024
+PAGE_SHARE = 0.1
+ZIPF_S = 1.0
+
+
+def create_cache(backend, location, **options):
+    options.setdefault('MAX_ENTRIES', 10 ** 7)
+    options.setdefault('MAX_BYTES', 10 ** 10)
+    return import_string(BACKENDS[backend])(location, {'OPTIONS': options})
+
+
+def page_like(size):
+    """Сжимаемое, как HTML, значение размера size."""
+    chunk = b'<article><p>post text</p></article>'
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def shared_worker(backend, location, number, processes, keys, value,
+                  barrier, results):
+    """Пишет свою долю ключей, потом читает все: так видно, общий ли кэш."""
+    cache = create_cache(backend, location)
+    for key in keys[number::processes]:
+        cache.set(key, value)
+    barrier.wait()
+    started = time.perf_counter()
+    hits = sum(cache.get(key) is not None for key in keys)
+    results.put((len(keys), hits, time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность кэшей LocMemCache, '
+            'core.cache.SQLiteCache и core.cache.SizedLocMemCache, '
+            'в том числе между процессами и при одном бюджете памяти.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=10000)
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--value-size', type=int, default=4096,
+                            help='Размер значения в байтах')
+        parser.add_argument(
+            '--memory', type=int, default=2 * 1024 * 1024,
+            help='Бюджет памяти кэша в сценарии zipf, байт')
+
+    def handle(self, *args, **options):
+        keys = [f'bench:{number}' for number in range(options['operations'])]
+        value = os.urandom(options['value_size'])
+        self.stdout.write(f'{"кэш":<8} {"сценарий":<10} '
+                          f'{"оп/с":>12} {"попаданий":>10}')
+        with tempfile.TemporaryDirectory() as folder:
+            for backend in BACKENDS:
+                location = os.path.join(folder, f'{backend}.sqlite3')
+                for scenario, ops, hits, seconds in self.single(
+                        backend, location, keys, value):
+                    self.report(backend, scenario, ops, hits, seconds)
+                self.report(backend, 'processes', *self.shared(
+                    backend, location + '.shared', keys, value,
+                    options['processes']))
+                self.report(backend, 'zipf', *self.zipf(
+                    backend, location + '.zipf', options['operations'],
+                    options['memory']))
+
+    def report(self, backend, scenario, ops, hits, seconds):
+        self.stdout.write(f'{backend:<8} {scenario:<10} '
+                          f'{ops / seconds:>12,.0f} {hits / ops:>10.0%}')
+
+    def single(self, backend, location, keys, value):
+        cache = create_cache(backend, location)
+        started = time.perf_counter()
+        for key in keys:
+            cache.set(key, value)
+        yield 'set', len(keys), len(keys), time.perf_counter() - started
+        started = time.perf_counter()
+        hits = sum(cache.get(key) is not None for key in keys)
+        yield 'get', len(keys), hits, time.perf_counter() - started
+        started = time.perf_counter()
+        hits = 0
+        for start in range(0, len(keys), GET_MANY_SIZE):
+            hits += len(cache.get_many(keys[start:start + GET_MANY_SIZE]))
+        yield 'get_many', len(keys), hits, time.perf_counter() - started
+
+    def zipf(self, backend, location, operations, memory):
+        """Чтение с досылкой при промахе по Zipf-распределению ключей
+        при одном бюджете памяти: LocMem и SQLite ограничены числом
+        записей по среднему размеру значения, sized — байтами."""
+        average = SMALL_VALUE * (1 - PAGE_SHARE) + PAGE_VALUE * PAGE_SHARE
+        cache = create_cache(backend, location,
+                             MAX_ENTRIES=int(memory // average),
+                             MAX_BYTES=memory)
+        generator = random.Random(0)
+        population = operations
+        weights = list(itertools.accumulate(
+            1 / rank ** ZIPF_S for rank in range(1, population + 1)))
+        sizes = [PAGE_VALUE if generator.random() < PAGE_SHARE
+                 else SMALL_VALUE for _ in range(population)]
+        requests = generator.choices(range(population), cum_weights=weights,
+                                     k=operations)
+        values = {size: page_like(size) for size in set(sizes)}
+        hits = 0
+        started = time.perf_counter()
+        for number in requests:
+            key = f'zipf:{number}'
+            if cache.get(key) is not None:
+                hits += 1
+            else:
+                cache.set(key, values[sizes[number]])
+        seconds = time.perf_counter() - started
+        stats = getattr(cache, 'stats', None)
+        if stats is not None:
+            used = stats()
+            self.stdout.write(
+                f'{backend:<8} память {used["bytes"]:,} из '
+                f'{used["max_bytes"]:,} байт, без сжатия '
+                f'{used["uncompressed_bytes"]:,}')
+        return operations, hits, seconds
+
+    def shared(self, backend, location, keys, value, processes):
+        """Чтения всех процессов: (операций, попаданий, секунд на процесс)."""
+        barrier = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=shared_worker, args=(
+                backend, location, number, processes, keys, value,
+                barrier, results))
+            for number in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        totals = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        ops = sum(ops for ops, _, _ in totals)
+        hits = sum(hits for _, hits, _ in totals)
+        seconds = max(seconds for _, _, seconds in totals)
+        return ops, hits, seconds
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from core import template_profile
+from core.management.commands import benchmark_views
+
+# Страницы не должны браться из кэша: замеряется отрисовка.
+PROFILE_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = ('Отрисовывает страницы гостем и пользователем с замером '
+            'шаблонов, тегов и фильтров и печатает их по убыванию '
+            'времени. Базу заранее наполняет seed_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Запросов на адрес')
+        parser.add_argument('--url', action='append', dest='urls',
+                            help='Адрес; по умолчанию все GET-адреса '
+                                 'benchmark_views')
+        parser.add_argument('--sort', choices=template_profile.SORT_KEYS,
+                            default='self')
+        parser.add_argument('--limit', type=int, default=30)
+
+    def handle(self, *args, **options):
+        installed = template_profile.is_installed()
+        template_profile.install()
+        template_profile.reset()
+        try:
+            self.replay(options)
+        finally:
+            if not installed:
+                template_profile.uninstall()
+        self.stdout.write(template_profile.report(options['sort'],
+                                                  options['limit']))
+
+    def replay(self, options):
+        with override_settings(DEBUG=False, CACHES=PROFILE_CACHES,
+                               ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS,
+                                              'testserver']):
+            benchmark = benchmark_views.Command(stdout=self.stdout,
+                                                stderr=self.stderr)
+            post = benchmark.sample_post()
+            if post is None:
+                raise CommandError('В базе нет постов, сначала seed_data')
+            urls = options['urls'] or [
+                url for _, url in benchmark.urls(benchmark.samples(post))]
+            user = Client()
+            user.force_login(post.author)
+            for client in (Client(), user):
+                for url in urls:
+                    for _ in range(options['requests']):
+                        client.get(url)
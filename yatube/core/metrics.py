@@ -0,0 +1,237 @@
+"""Метрики в формате Prometheus, общие для всех процессов сервера.
+
+Каждый процесс копит приращения в памяти и не реже раза
+в METRICS_FLUSH_INTERVAL секунд (и при выходе) прибавляет их к файлу
+SQLite METRICS_PATH одним UPSERT. Все значения — счётчики,
+гистограммы тоже (корзины, _sum, _count), поэтому сумма приращений
+воркеров и есть общее значение. /metrics показывает файл, а значит
+отстаёт от других воркеров не больше чем на интервал сброса.
+"""
+import atexit
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_SEC = 5
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS samples ('
+    'name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, '
+    'PRIMARY KEY (name, labels)) WITHOUT ROWID'
+)
+UPSERT = (
+    'INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+    'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value'
+)
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': 'metrics.sqlite3',
+    'FLUSH_INTERVAL': 5,
+    # Bearer-токен сборщика; без него /metrics видит только персонал.
+    'TOKEN': None,
+}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                   10)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2,
+                16 * 1024 ** 2)
+# Префиксы ключей кэша для доли попаданий; прочие — other.
+# Список закрытый: у метки должно быть мало значений.
+CACHE_PREFIXES = (
+    'views.decorators.cache.cache_page',
+    'views.decorators.cache.cache_header',
+    'page_version:',
+    'sorl-thumbnail',
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = {}
+_pending = {}
+_pending_lock = threading.Lock()
+_local = threading.local()
+_last_flush = time.monotonic()
+
+
+def get_setting(name):
+    return getattr(settings, f'METRICS_{name}', DEFAULTS[name])
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"'
+                    for name, value in zip(names, values))
+
+
+def _add(name, labels, amount):
+    key = (name, labels)
+    with _pending_lock:
+        _pending[key] = _pending.get(key, 0) + amount
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        REGISTRY[name] = self
+
+    def _label_string(self, labels):
+        return _labels(self.label_names,
+                       [labels[name] for name in self.label_names])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if get_setting('ENABLED'):
+            _add(self.name, self._label_string(labels), amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = (*buckets, math.inf)
+
+    def observe(self, value, **labels):
+        if not get_setting('ENABLED'):
+            return
+        base = self._label_string(labels)
+        prefix = f'{base},' if base else ''
+        with _pending_lock:
+            # Нули тоже пишутся: у ряда должны быть все корзины.
+            for bound in self.buckets:
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                key = (f'{self.name}_bucket', f'{prefix}le="{le}"')
+                _pending[key] = _pending.get(key, 0) + (value <= bound)
+            for suffix, amount in (('_sum', value), ('_count', 1)):
+                key = (self.name + suffix, base)
+                _pending[key] = _pending.get(key, 0) + amount
+
+
+REQUEST_LATENCY = Histogram(
+    'yatube_http_request_duration_seconds',
+    'Время ответа по имени адреса', ('view', 'method'))
+REQUESTS = Counter(
+    'yatube_http_requests_total', 'Ответы по имени адреса и коду',
+    ('view', 'status'))
+DB_QUERIES = Counter(
+    'yatube_db_queries_total', 'Запросы к БД по имени адреса', ('view',))
+DB_TIME = Counter(
+    'yatube_db_query_seconds_total', 'Время запросов к БД по имени адреса',
+    ('view',))
+CACHE_LOOKUPS = Counter(
+    'yatube_cache_lookups_total', 'Чтения кэша по префиксу ключа',
+    ('prefix', 'result'))
+THUMBNAIL_TIME = Histogram(
+    'yatube_thumbnail_generation_seconds', 'Создание одной миниатюры',
+    ('kind',))
+UPLOAD_SIZE = Histogram(
+    'yatube_upload_size_bytes', 'Размер сохранённых картинок постов',
+    buckets=SIZE_BUCKETS)
+
+
+def cache_prefix(key):
+    for prefix in CACHE_PREFIXES:
+        if key.startswith(prefix):
+            return prefix
+    return 'other'
+
+
+def cache_lookup(key, hit):
+    """Вызывают бэкенды core.cache при каждом чтении ключа."""
+    CACHE_LOOKUPS.inc(prefix=cache_prefix(key),
+                      result='hit' if hit else 'miss')
+
+
+def _connection():
+    """Своё соединение у потока; после fork или смены пути — новое."""
+    path = get_setting('PATH')
+    local = _local
+    if getattr(local, 'key', None) != (os.getpid(), path):
+        connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(SCHEMA)
+        local.connection = connection
+        local.key = (os.getpid(), path)
+    return local.connection
+
+
+def flush():
+    """Прибавляет накопленное в файл метрик.
+
+    Ошибку SQLite пишет в лог и возвращает приращения в очередь:
+    метрики не должны ломать запросы к сайту. Вернёт, удалось ли.
+    """
+    global _last_flush
+    with _pending_lock:
+        rows = [(name, labels, value)
+                for (name, labels), value in _pending.items()]
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not rows:
+        return True
+    try:
+        connection = _connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(UPSERT, rows)
+    except sqlite3.Error:
+        logger.exception('Не удалось сбросить метрики в %s',
+                         get_setting('PATH'))
+        for name, labels, value in rows:
+            _add(name, labels, value)
+        return False
+    return True
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= get_setting('FLUSH_INTERVAL'):
+        flush()
+
+
+def _sort_key(row):
+    name, labels, _ = row
+    if 'le="' not in labels:
+        return name, labels, 0
+    rest, le = labels.rsplit('le="', 1)
+    return name, rest, float(le.rstrip('"').replace('+Inf', 'inf'))
+
+
+def _format(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def exposition():
+    """Все метрики в текстовом формате Prometheus."""
+    flush()
+    rows = sorted(_connection().execute(
+        'SELECT name, labels, value FROM samples'), key=_sort_key)
+    lines = []
+    for metric in REGISTRY.values():
+        family = [row for row in rows if row[0] == metric.name
+                  or row[0].rsplit('_', 1)[0] == metric.name]
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in family:
+            sample = f'{name}{{{labels}}}' if labels else name
+            lines.append(f'{sample} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+atexit.register(flush)
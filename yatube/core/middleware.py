@@ -0,0 +1,201 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics, slowlog, timing
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для настроек SERVER_TIMING_*.
+DEFAULTS = {
+    # Доля запросов, замер которых пишется в лог: остальные идут
+    # без накладных расходов.
+    'SAMPLE_RATE': 1.0,
+    # Оборачивать ли каждый запрос к БД: самая заметная часть цены.
+    'SQL': True,
+    # Заголовок получают только персонал и адреса из INTERNAL_IPS.
+    'HEADER': True,
+    'LOG': True,
+}
+
+
+def get_setting(name):
+    return getattr(settings, f'SERVER_TIMING_{name}', DEFAULTS[name])
+
+
+def _internal(request):
+    return request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+
+
+class ServerTimingMiddleware:
+    """Замер запроса в заголовок Server-Timing и в лог core.middleware.
+
+    Стоит первым в MIDDLEWARE, чтобы total включал все остальные.
+    Заголовок выдаёт число запросов к БД и попадания в кэш, поэтому
+    уходит только персоналу и на INTERNAL_IPS, зато без выборки.
+    Сразу замеряются только выборка SAMPLE_RATE и INTERNAL_IPS:
+    пользователь известен лишь в process_view, там и начинается
+    замер для персонала (без middleware до представления), если
+    его ещё не начал MetricsMiddleware или SlowRequestMiddleware.
+    В лог попадает только выборка; запись несёт поля замера
+    в атрибуте timing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = get_setting('SAMPLE_RATE')
+        sampled = rate >= 1 or (rate > 0 and random.random() < rate)
+        internal = get_setting('HEADER') and _internal(request)
+        if not (sampled or internal):
+            with ExitStack() as stack:
+                request._server_timing_stack = stack
+                response = self.get_response(request)
+            measured = getattr(request, '_server_timing', None)
+            if measured is not None:
+                response['Server-Timing'] = measured.header()
+            return response
+        with timing.measure(sql=get_setting('SQL')) as measured:
+            response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if internal or (get_setting('HEADER')
+                        and getattr(user, 'is_staff', False)):
+            response['Server-Timing'] = measured.header()
+        if sampled and get_setting('LOG'):
+            fields = measured.as_dict()
+            fields.update(method=request.method, path=request.path,
+                          status=response.status_code)
+            logger.info('%s %s %s %sms sql=%s', request.method,
+                        request.path, response.status_code,
+                        fields['total_ms'], fields['sql_count'],
+                        extra={'timing': fields})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Замер для персонала вне выборки: пользователь уже известен."""
+        stack = getattr(request, '_server_timing_stack', None)
+        user = getattr(request, 'user', None)
+        if (stack is None or not get_setting('HEADER')
+                or not getattr(user, 'is_staff', False)):
+            return None
+        measured = timing.current()
+        if measured is None:
+            measured = stack.enter_context(
+                timing.measure(sql=get_setting('SQL')))
+        request._server_timing = measured
+        return None
+
+
+class MetricsMiddleware:
+    """Время ответа, код и запросы к БД по имени адреса в core.metrics.
+
+    Стоит сразу за ServerTimingMiddleware и берёт его замер, если
+    запрос попал в выборку; иначе меряет запросы к БД сам.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.get_setting('ENABLED'):
+            return self.get_response(request)
+        started = time.perf_counter()
+        measured = timing.current()
+        if measured is None:
+            with timing.measure() as measured:
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        metrics.REQUEST_LATENCY.observe(elapsed, view=view,
+                                        method=request.method)
+        metrics.REQUESTS.inc(view=view, status=response.status_code)
+        metrics.DB_QUERIES.inc(measured.sql_count, view=view)
+        metrics.DB_TIME.inc(measured.sql_time, view=view)
+        metrics.maybe_flush()
+        return response
+
+
+class SlowRequestMiddleware:
+    """Медленные запросы и выборку остальных — в журнал core.slowlog.
+
+    Стоит за MetricsMiddleware. SQL и операции кэша запоминаются
+    у каждого запроса: медленный он или нет, видно только в конце.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not slowlog.get_setting('ENABLED'):
+            return self.get_response(request)
+        started = time.perf_counter()
+        measured = timing.current()
+        with ExitStack() as stack:
+            if measured is None:
+                measured = stack.enter_context(timing.measure())
+            stack.enter_context(timing.recording(measured))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        if elapsed * 1000 >= slowlog.get_setting('THRESHOLD_MS'):
+            reason = 'slow'
+        elif random.random() < slowlog.get_setting('SAMPLE_RATE'):
+            reason = 'sample'
+        else:
+            return response
+        slowlog.write(self.entry(request, response, measured, elapsed,
+                                 reason))
+        return response
+
+    def entry(self, request, response, measured, elapsed, reason):
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        fields = measured.as_dict()
+        return {
+            'time': timezone.now().isoformat(),
+            'reason': reason,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match is not None else None,
+            'url_kwargs': match.kwargs if match is not None else {},
+            'status': response.status_code,
+            'user': user.pk if user is not None else None,
+            'total_ms': round(elapsed * 1000, 3),
+            'view_ms': fields['view_ms'],
+            'template_ms': fields['template_ms'],
+            'sql_count': fields['sql_count'],
+            'sql_ms': fields['sql_ms'],
+            'queries': [
+                {'sql': sql, 'ms': round(seconds * 1000, 3), 'many': many}
+                for sql, seconds, many in measured.queries],
+            'cache': [
+                {'op': operation, 'key': key, 'hit': hit}
+                for operation, key, hit in measured.cache_ops],
+        }
+
+
+class ViewTimingMiddleware:
+    """Время представления вместе с отрисовкой TemplateResponse.
+
+    Стоит последним в MIDDLEWARE: внутри остаются только
+    разбор адреса, process_view и само представление.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Замер персонала начинается в process_view, уже внутри.
+        started = time.perf_counter()
+        response = self.get_response(request)
+        measured = timing.current()
+        if measured is not None:
+            measured.view_time = time.perf_counter() - started
+        return response
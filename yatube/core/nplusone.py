@@ -0,0 +1,163 @@
+"""Поиск N+1: один и тот же запрос к БД много раз за запрос к сайту.
+
+Запросы сводятся к форме: литералы и списки IN заменяются
+заглушками. Когда форма SELECT повторяется больше порога,
+запоминается место первого лишнего повтора: строка шаблона
+(узел Django-шаблона в стеке) и кадры кода проекта.
+
+Включает проверку NPlusOneMiddleware (настройка NPLUSONE_ENABLED)
+или collect(): так тесты собирают находки, см. core.pytest_plugin.
+"""
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Сколько одинаковых запросов ещё не считается N+1.
+    'THRESHOLD': 3,
+}
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+# Сколько кадров кода проекта показывать в отчёте.
+STACK_DEPTH = 5
+# Кадры замеров самого core в отчёт не попадают.
+INSTRUMENTATION = tuple(
+    os.path.join(os.path.dirname(__file__), name)
+    for name in ('nplusone.py', 'timing.py', 'middleware.py',
+                 'template_profile.py'))
+
+_collectors = []
+
+
+def get_setting(name):
+    return getattr(settings, f'NPLUSONE_{name}', DEFAULTS[name])
+
+
+def fingerprint(sql):
+    """Форма запроса: одинакова для запросов, отличающихся значениями."""
+    return IN_LIST.sub('IN (...)', LITERALS.sub('?', sql))
+
+
+def _is_project_file(filename):
+    return (filename.startswith(settings.BASE_DIR)
+            and os.sep + 'site-packages' + os.sep not in filename
+            and filename not in INSTRUMENTATION)
+
+
+def origin():
+    """Строка шаблона и кадры кода проекта, откуда пришёл запрос."""
+    template = None
+    stack = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if template is None and isinstance(node, Node):
+            token = getattr(node, 'token', None)
+            source = getattr(node, 'origin', None)
+            if token is not None and source is not None:
+                name = source.template_name or source.name
+                template = (f'{name}:{token.lineno} '
+                            f'{token.contents[:80]!r}')
+        code = frame.f_code
+        if len(stack) < STACK_DEPTH and _is_project_file(code.co_filename):
+            path = os.path.relpath(code.co_filename, settings.BASE_DIR)
+            stack.append(f'{path}:{frame.f_lineno} в {code.co_name}')
+        frame = frame.f_back
+    return template, stack
+
+
+class Problem:
+
+    def __init__(self, shape, template, stack):
+        self.shape = shape
+        self.count = 0
+        self.template = template
+        self.stack = stack
+
+    def __str__(self):
+        lines = [f'{self.count} раз: {self.shape}']
+        if self.template:
+            lines.append(f'  шаблон {self.template}')
+        lines.extend(f'  {frame}' for frame in self.stack)
+        return '\n'.join(lines)
+
+
+class Detector:
+    """execute_wrapper, считающий формы SELECT одного запроса к сайту."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.problems = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            shape = fingerprint(sql)
+            self.counts[shape] += 1
+            count = self.counts[shape]
+            if count > self.threshold:
+                problem = self.problems.get(shape)
+                if problem is None:
+                    problem = self.problems[shape] = Problem(shape, *origin())
+                problem.count = count
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def detect(threshold=None):
+    """Считает запросы всех соединений внутри блока."""
+    detector = Detector(get_setting('THRESHOLD') if threshold is None
+                        else threshold)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(detector))
+        yield detector
+
+
+class Collector(list):
+    """Находки middleware: пары (адрес, Problem)."""
+
+    def __init__(self, threshold=None):
+        super().__init__()
+        self.threshold = threshold
+
+
+@contextmanager
+def collect(threshold=None):
+    """Собирает находки middleware внутри блока; порог свой, если задан."""
+    found = Collector(threshold)
+    _collectors.append(found)
+    try:
+        yield found
+    finally:
+        _collectors.remove(found)
+
+
+class NPlusOneMiddleware:
+    """Пишет найденные N+1 в лог core.nplusone и отдаёт collect()."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (_collectors or get_setting('ENABLED')):
+            return self.get_response(request)
+        threshold = _collectors[-1].threshold if _collectors else None
+        with detect(threshold) as detector:
+            response = self.get_response(request)
+        for problem in detector.problems.values():
+            logger.warning('N+1 на %s %s\n%s', request.method,
+                           request.get_full_path(), problem)
+            for found in _collectors:
+                found.append((request.get_full_path(), problem))
+        return response
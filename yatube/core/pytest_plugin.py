@@ -0,0 +1,48 @@
+"""Плагин pytest: тест падает, если запрос к сайту сделал N+1.
+
+Подключён в conftest.py корня репозитория и действует на tests/
+и posts/tests. Порог — --nplusone-threshold или настройка
+NPLUSONE_THRESHOLD. Тест с известным N+1 помечается
+@pytest.mark.nplusone_allowed, весь прогон без проверки —
+--no-nplusone.
+
+Ещё плагин включает на весь прогон test_environment
+(core.test_runner), как TestRunner у manage.py test.
+"""
+import pytest
+
+from core import nplusone
+from core.test_runner import test_environment
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('nplusone', 'поиск N+1 в запросах к сайту')
+    group.addoption('--no-nplusone', action='store_true',
+                    help='не проверять запросы к БД на N+1')
+    group.addoption('--nplusone-threshold', type=int,
+                    help='сколько одинаковых SELECT ещё не N+1')
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'nplusone_allowed: не проверять тест на N+1')
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    if (item.config.getoption('no_nplusone')
+            or item.get_closest_marker('nplusone_allowed')):
+        yield
+        return
+    threshold = item.config.getoption('nplusone_threshold')
+    with nplusone.collect(threshold) as found:
+        outcome = yield
+    if found and outcome.excinfo is None:
+        pytest.fail('\n'.join(f'N+1 на {url}\n{problem}'
+                              for url, problem in found), pytrace=False)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def test_settings():
+    with test_environment():
+        yield
@@ -0,0 +1,109 @@
+"""Журнал медленных запросов в файле JSON Lines.
+
+SlowRequestMiddleware (core.middleware) пишет сюда каждый запрос
+дольше SLOW_REQUEST_THRESHOLD_MS и долю SLOW_REQUEST_SAMPLE_RATE
+остальных: адрес, каждый запрос к БД с временем, операции кэша
+и время шаблонов. Запрос только ставит запись в очередь; в JSON её
+превращает и дописывает в файл фоновый поток. Файл у каждого
+процесса свой, с pid в имени (slow_requests.1234.jsonl):
+RotatingFileHandler ротирует по размеру только файл своего процесса.
+
+Параметры SQL в журнал не попадают: только текст с заглушками.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueListener, RotatingFileHandler
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 500,
+    'SAMPLE_RATE': 0.0,
+    'PATH': 'slow_requests.jsonl',
+    'MAX_BYTES': 10 * 1024 ** 2,
+    'BACKUP_COUNT': 5,
+}
+# Записей в очереди; сверх этого новые отбрасываются.
+QUEUE_SIZE = 1000
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, f'SLOW_REQUEST_{name}', DEFAULTS[name])
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Запись — словарь в msg, строка файла — его JSON."""
+
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+def process_path(path, pid):
+    """Файл журнала процесса pid: pid перед расширением."""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{pid}{ext}'
+
+
+class Writer:
+    """Очередь и поток, дописывающий файл; свой у каждого процесса."""
+
+    def __init__(self, path, pid):
+        self.pid = pid
+        self.path = path
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.handler = RotatingFileHandler(
+            process_path(path, pid), maxBytes=get_setting('MAX_BYTES'),
+            backupCount=get_setting('BACKUP_COUNT'), encoding='utf-8',
+            delay=True)
+        self.handler.setFormatter(JSONLinesFormatter())
+        self.listener = QueueListener(self.queue, self.handler)
+        self.listener.start()
+
+    def close(self):
+        self.listener.stop()
+        self.handler.close()
+
+
+def _get_writer():
+    global _writer
+    path = get_setting('PATH')
+    with _writer_lock:
+        writer = _writer
+        if writer is None or (writer.pid, writer.path) != (os.getpid(),
+                                                           path):
+            if writer is not None and writer.pid == os.getpid():
+                writer.close()
+            writer = _writer = Writer(path, os.getpid())
+        return writer
+
+
+def write(entry):
+    """Ставит запись в очередь; если очередь полна — отбрасывает."""
+    writer = _get_writer()
+    try:
+        writer.queue.put_nowait(logging.makeLogRecord({'msg': entry}))
+    except queue.Full:
+        logger.warning('Очередь журнала %s полна, запись %s %s отброшена',
+                       writer.path, entry['method'], entry['path'])
+
+
+def close():
+    """Дописывает очередь и закрывает файл; сам вызывается при выходе."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.pid == os.getpid():
+        writer.close()
+
+
+atexit.register(close)
@@ -0,0 +1,146 @@
+"""Профиль отрисовки шаблонов Django: шаблоны, теги и фильтры.
+
+Включается настройкой TEMPLATE_PROFILING или командой
+profile_templates: install() подменяет Template.render,
+Node.render_annotated и функции фильтров при разборе шаблона.
+uninstall() возвращает всё как было.
+
+Числа копятся в памяти процесса, пока их не сбросит reset().
+Время total включает вложенные шаблоны и теги, self — нет:
+у {% for %} self — это цикл без тегов и include внутри.
+"""
+import functools
+import threading
+import time
+
+from django.template import engines
+from django.template.base import FilterExpression, Node, Template, TokenType
+
+TEMPLATE = 'template'
+TAG = 'tag'
+FILTER = 'filter'
+# Колонки строк stats() для сортировки.
+SORT_KEYS = {'count': 2, 'total': 3, 'self': 4}
+
+_stats = {}
+_stats_lock = threading.Lock()
+_local = threading.local()
+_filters = {}
+# Подменённые методы: (класс, имя) -> исходный метод.
+_originals = {}
+
+
+def measure(kind, name, func, *args, **kwargs):
+    """Вызывает func и записывает время в строку (kind, name)."""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with _stats_lock:
+            row = _stats.get((kind, name))
+            if row is None:
+                row = _stats[kind, name] = [0, 0.0, 0.0]
+            row[0] += 1
+            row[1] += elapsed
+            row[2] += elapsed - children
+
+
+def _wrap_filter(func):
+    """Обёртка сохраняет is_safe, needs_autoescape и прочие флаги."""
+    wrapper = _filters.get(func)
+    if wrapper is None:
+        name = getattr(func, '_filter_name', func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return measure(FILTER, name, func, *args, **kwargs)
+        _filters[func] = wrapper
+    return wrapper
+
+
+def _reset_loaders():
+    """Шаблоны разбираются заново: фильтры обёртываются при разборе."""
+    for backend in engines.all():
+        # У Jinja2 своё окружение, профиль его не касается.
+        engine = getattr(backend, 'engine', None)
+        for loader in getattr(engine, 'template_loaders', ()):
+            if hasattr(loader, 'reset'):
+                loader.reset()
+
+
+def install():
+    """Включает замеры в этом процессе; повторный вызов ничего не делает."""
+    if _originals:
+        return
+    _originals.update({
+        (Template, 'render'): Template.render,
+        (Node, 'render_annotated'): Node.render_annotated,
+        (FilterExpression, '__init__'): FilterExpression.__init__,
+    })
+    template_render = Template.render
+    render_annotated = Node.render_annotated
+    filter_init = FilterExpression.__init__
+
+    def render(self, context):
+        return measure(TEMPLATE, self.name or '<string>', template_render,
+                       self, context)
+
+    def annotated(self, context):
+        token = getattr(self, 'token', None)
+        if token is None or token.token_type != TokenType.BLOCK:
+            return render_annotated(self, context)
+        return measure(TAG, token.contents.split()[0], render_annotated,
+                       self, context)
+
+    def init(self, token, parser):
+        filter_init(self, token, parser)
+        self.filters = [(_wrap_filter(func), args)
+                        for func, args in self.filters]
+
+    Template.render = render
+    Node.render_annotated = annotated
+    FilterExpression.__init__ = init
+    _reset_loaders()
+
+
+def uninstall():
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+    _reset_loaders()
+
+
+def is_installed():
+    return bool(_originals)
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def stats(sort='self', limit=None):
+    """Строки (вид, имя, вызовов, total, self) по убыванию sort."""
+    with _stats_lock:
+        rows = [(kind, name, *row) for (kind, name), row in _stats.items()]
+    rows.sort(key=lambda row: row[SORT_KEYS[sort]], reverse=True)
+    return rows[:limit]
+
+
+def report(sort='self', limit=None):
+    """Таблица для консоли и страницы /__templates__/."""
+    lines = [f'{"вид":<8} {"имя":<40} {"вызовов":>8} {"total, мс":>10} '
+             f'{"self, мс":>10} {"self/вызов, мкс":>15}']
+    for kind, name, count, total, own in stats(sort, limit):
+        lines.append(f'{kind:<8} {name[:40]:<40} {count:>8} '
+                     f'{total * 1000:>10.2f} {own * 1000:>10.2f} '
+                     f'{own * 1e6 / count:>15.1f}')
+    return '\n'.join(lines)
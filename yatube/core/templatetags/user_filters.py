@@ -6,3 +6,17 @@ register = template.Library()
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    """Текущая строка запроса с заменёнными параметрами.
+
+    Параметр со значением None удаляется.
+    """
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        query.pop(key, None)
+        if value is not None:
+            query[key] = value
+    return query.urlencode()
@@ -0,0 +1,50 @@
+"""Настройки на время тестов: без файлов метрик, журнала медленных
+запросов и кэша в каталоге проекта.
+
+Тесты, которым эти части нужны, включают их сами на временных путях.
+Кэш — свой файл во временном каталоге на каждый прогон:
+cache.clear() в тестах не стирает кэш запущенного рядом сервера,
+а прогоны не видят ключей друг друга.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_SETTINGS = {
+    'METRICS_ENABLED': False,
+    'SLOW_REQUEST_ENABLED': False,
+}
+
+
+@contextmanager
+def test_environment():
+    """TEST_SETTINGS и кэш во временном каталоге прогона."""
+    folder = tempfile.mkdtemp(prefix='yatube-tests-')
+    caches = {
+        'default': {
+            'BACKEND': 'core.cache.SQLiteCache',
+            'LOCATION': os.path.join(folder, 'cache.sqlite3'),
+        }
+    }
+    try:
+        with override_settings(CACHES=caches, **TEST_SETTINGS):
+            yield
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """manage.py test с test_environment на весь прогон."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_environment = ExitStack()
+        self.test_environment.enter_context(test_environment())
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_environment.close()
+        super().teardown_test_environment(**kwargs)
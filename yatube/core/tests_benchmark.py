@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from core.management.commands.benchmark_views import SKIP, percentile
+from posts import seeding
+
+
+class BenchmarkViewsTest(TestCase):
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, rank) for rank in (50, 95, 99)],
+                         [50, 95, 99])
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_report_covers_every_url(self):
+        """Отчёт в JSON: каждый адрес гостем и пользователем"""
+        seeding.seed(users=5, groups=2, posts=20, follows=2, images=0)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'report.json')
+            call_command('benchmark_views', '--requests', '2',
+                         '--warmup', '0', '--output', path,
+                         stdout=StringIO(), stderr=StringIO())
+            with open(path, encoding='utf-8') as report_file:
+                report = json.load(report_file)
+        names = {result['name'] for result in report['results']}
+        self.assertIn('posts:index', names)
+        self.assertIn('api:follow_posts', names)
+        self.assertIn('about:tech', names)
+        self.assertFalse(names & SKIP)
+        self.assertEqual(report['data']['posts'], 20)
+        for result in report['results']:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertIsNotNone(result['queries'])
+        feed = [result for result in report['results']
+                if result['name'] == 'posts:follow_index']
+        self.assertEqual([result['status'] for result in feed], [302, 200])
+
+    def test_cold_run_keeps_site_cache(self):
+        """--cold очищает свой кэш, а не кэш сайта"""
+        seeding.seed(users=2, groups=1, posts=3, follows=1, images=0)
+        cache.set('site-page', 'страница')
+        call_command('benchmark_views', '--requests', '1', '--warmup', '0',
+                     '--cold', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(cache.get('site-page'), 'страница')
+        with self.assertRaises(CommandError):
+            call_command('benchmark_views', '--cold',
+                         '--base-url', 'http://localhost:8000')
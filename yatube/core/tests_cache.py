@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from core import cache as sqlite_cache
+from core.cache import SizedLocMemCache, SQLiteCache
+
+
+class SQLiteCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, 'cache.sqlite3')
+        self.cache = self.create_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def create_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_basic_operations(self):
+        """set/get/get_many/delete работают как у стандартных кэшей"""
+        self.cache.set('page', {'html': '<p>'})
+        self.assertEqual(self.cache.get('page'), {'html': '<p>'})
+        self.assertIsNone(self.cache.get('missing'))
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 2})
+        self.cache.delete_many(['a', 'page'])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'page']), {'b': 2})
+        self.assertEqual(self.cache.incr('b', 3), 5)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.clear()
+        self.assertFalse(self.cache.has_key('b'))
+
+    def test_add_and_expiry(self):
+        """add не перезаписывает живой ключ, истёкший ключ не виден"""
+        self.assertTrue(self.cache.add('version', 1, 10))
+        self.assertFalse(self.cache.add('version', 2, 10))
+        self.assertEqual(self.cache.get('version'), 1)
+        now = time.time()
+        with mock.patch('core.cache.time.time', return_value=now + 60):
+            self.assertIsNone(self.cache.get('version'))
+            self.assertTrue(self.cache.add('version', 3, 10))
+            self.assertEqual(self.cache.get('version'), 3)
+
+    def test_shared_between_instances(self):
+        """Запись одного экземпляра видна другому на том же файле"""
+        self.cache.set('shared', 'value')
+        self.assertEqual(self.create_cache().get('shared'), 'value')
+
+    def test_cull_over_max_entries(self):
+        """При переполнении удаляются ключи с ближайшим сроком"""
+        cache = self.create_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2)
+        with mock.patch.object(sqlite_cache, 'CULL_EVERY', 1):
+            for number in range(12):
+                cache.set(f'key{number}', number, 100 + number)
+        self.assertLessEqual(len(cache.get_many(
+            [f'key{number}' for number in range(12)])), 10)
+        self.assertEqual(cache.get('key11'), 11)
+
+
+class SizedLocMemCacheTest(SimpleTestCase):
+
+    def create_cache(self, **options):
+        options.setdefault('MAX_BYTES', 64 * 1024)
+        return SizedLocMemCache(f'test-{self.id()}', {'OPTIONS': options})
+
+    def test_byte_limit_and_stats(self):
+        """Кэш держит лимит в байтах и считает попадания"""
+        cache = self.create_cache(COMPRESS_MIN_BYTES=0)
+        for number in range(100):
+            cache.set(f'key{number}', os.urandom(1000))
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        self.assertLess(stats['entries'], 100)
+        self.assertIsNotNone(cache.get('key99'))
+        cache.get('missing')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_large_values_compressed(self):
+        """Большие значения хранятся сжатыми"""
+        cache = self.create_cache()
+        page = '<p>Пост</p>' * 1000
+        cache.set('page', page)
+        self.assertEqual(cache.get('page'), page)
+        stats = cache.stats()
+        self.assertLess(stats['bytes'], stats['uncompressed_bytes'] / 10)
+
+    def test_rare_large_value_does_not_flush_popular_keys(self):
+        """Редкое большое значение не вытесняет частые мелкие"""
+        cache = self.create_cache(COMPRESS_MIN_BYTES=0)
+        for number in range(50):
+            cache.set(f'thumb{number}', 'x' * 100)
+        for _ in range(3):
+            for number in range(50):
+                cache.get(f'thumb{number}')
+        cache.set('page', os.urandom(60 * 1024))
+        self.assertIsNone(cache.get('page'))
+        self.assertEqual(cache.stats()['rejections'], 1)
+        self.assertEqual(
+            len([number for number in range(50)
+                 if cache.get(f'thumb{number}') is not None]), 50)
+
+    def test_add_incr_expiry(self):
+        """add, incr и истечение срока как у LocMemCache"""
+        cache = self.create_cache()
+        self.assertTrue(cache.add('version', 1, 10))
+        self.assertFalse(cache.add('version', 2, 10))
+        self.assertEqual(cache.incr('version'), 2)
+        with mock.patch('core.cache.time.time',
+                        return_value=time.time() + 60):
+            self.assertIsNone(cache.get('version'))
+
+    def test_add_absent_key_under_pressure(self):
+        """add отсутствующего ключа удаётся и в заполненном кэше"""
+        cache = self.create_cache(COMPRESS_MIN_BYTES=0)
+        for number in range(100):
+            cache.set(f'thumb{number}', 'x' * 1000)
+            cache.get(f'thumb{number}')
+        self.assertTrue(cache.add('page_version:index', 'v' * 500, 10))
+        self.assertEqual(cache.get('page_version:index'), 'v' * 500)
+        self.assertFalse(cache.add('page_version:index', 2, 10))
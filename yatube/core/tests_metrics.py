@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+from posts.models import User
+
+
+class MetricsTestMixin:
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        settings = override_settings(
+            METRICS_ENABLED=True,
+            METRICS_PATH=os.path.join(self.folder, 'metrics.sqlite3'),
+            METRICS_FLUSH_INTERVAL=3600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        with metrics._pending_lock:
+            metrics._pending.clear()
+
+    def tearDown(self):
+        with metrics._pending_lock:
+            metrics._pending.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def samples(self):
+        return dict(line.rsplit(' ', 1)
+                    for line in metrics.exposition().splitlines()
+                    if not line.startswith('#'))
+
+
+class RegistryTest(MetricsTestMixin, TestCase):
+
+    def test_histogram_buckets(self):
+        """Наблюдение попадает в свою корзину и во все следующие"""
+        metrics.THUMBNAIL_TIME.observe(0.03, kind='small')
+        samples = self.samples()
+        name = 'yatube_thumbnail_generation_seconds'
+        self.assertEqual(samples[f'{name}_bucket{{kind="small",le="0.025"}}'],
+                         '0')
+        self.assertEqual(samples[f'{name}_bucket{{kind="small",le="0.05"}}'],
+                         '1')
+        self.assertEqual(samples[f'{name}_bucket{{kind="small",le="+Inf"}}'],
+                         '1')
+        self.assertEqual(samples[f'{name}_count{{kind="small"}}'], '1')
+        self.assertEqual(samples[f'{name}_sum{{kind="small"}}'], '0.03')
+
+    def test_flushes_are_summed(self):
+        """Сбросы нескольких процессов складываются в файле"""
+        metrics.REQUESTS.inc(view='posts:index', status=200)
+        metrics.flush()
+        metrics.REQUESTS.inc(2, view='posts:index', status=200)
+        metrics.flush()
+        self.assertEqual(self.samples()[
+            'yatube_http_requests_total{view="posts:index",status="200"}'],
+            '3')
+
+    def test_failed_flush_keeps_deltas(self):
+        """Ошибка записи пишется в лог, приращения ждут следующего сброса"""
+        metrics.REQUESTS.inc(view='posts:index', status=200)
+        broken = os.path.join(self.folder, 'missing', 'metrics.sqlite3')
+        with override_settings(METRICS_PATH=broken):
+            with self.assertLogs('core.metrics', 'ERROR'):
+                self.assertFalse(metrics.flush())
+        self.assertEqual(self.samples()[
+            'yatube_http_requests_total{view="posts:index",status="200"}'],
+            '1')
+
+    def test_disabled(self):
+        """Без METRICS_ENABLED ничего не копится"""
+        with override_settings(METRICS_ENABLED=False):
+            metrics.REQUESTS.inc(view='posts:index', status=200)
+        self.assertEqual(metrics._pending, {})
+
+    def test_help_and_type(self):
+        """У каждой метрики есть HELP и TYPE, даже без значений"""
+        text = metrics.exposition()
+        self.assertIn('# TYPE yatube_upload_size_bytes histogram', text)
+        self.assertIn('# TYPE yatube_cache_lookups_total counter', text)
+
+    def test_cache_prefix(self):
+        """Ключи сводятся к закрытому списку префиксов"""
+        self.assertEqual(metrics.cache_prefix('page_version:index'),
+                         'page_version:')
+        self.assertEqual(metrics.cache_prefix('random-key'), 'other')
+
+
+class MetricsViewTest(MetricsTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_requires_token_or_staff(self):
+        """Без токена 401, с токеном или персоналу — метрики"""
+        url = reverse('metrics')
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+            response = self.client.get(
+                url, HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get(
+                url, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_broken_file_does_not_break_requests(self):
+        """Недоступный файл метрик не ломает страницы сайта"""
+        broken = os.path.join(self.folder, 'missing', 'metrics.sqlite3')
+        with override_settings(METRICS_PATH=broken,
+                               METRICS_FLUSH_INTERVAL=0):
+            with self.assertLogs('core.metrics', 'ERROR'):
+                response = self.client.get(reverse('about:author'))
+            self.assertEqual(response.status_code, 200)
+            self.client.force_login(self.staff)
+            with self.assertLogs('core.views', 'ERROR'):
+                response = self.client.get(reverse('metrics'))
+            self.assertEqual(response.status_code, 503)
+
+    def test_request_metrics(self):
+        """Запрос к сайту пишет время, код, SQL и чтения кэша"""
+        self.client.get(reverse('posts:index'))
+        samples = self.samples()
+        view = 'view="posts:index"'
+        self.assertEqual(samples[f'yatube_http_requests_total{{{view},'
+                                 f'status="200"}}'], '1')
+        self.assertEqual(samples[f'yatube_http_request_duration_seconds_'
+                                 f'count{{{view},method="GET"}}'], '1')
+        self.assertGreater(float(samples[
+            f'yatube_db_queries_total{{{view}}}']), 0)
+        self.assertIn('yatube_cache_lookups_total{prefix="page_version:",'
+                      'result="miss"}', samples)
@@ -0,0 +1,66 @@
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory, TestCase, override_settings
+
+from core import nplusone
+from posts.models import Post, User
+
+FEED = engines['django'].from_string(
+    '<ul>\n'
+    '{% for post in posts %}\n'
+    '<li>{{ post.author.username }}</li>\n'
+    '{% endfor %}\n'
+    '</ul>')
+
+
+def feed(request):
+    posts = Post.objects.all()
+    if request.GET.get('join'):
+        posts = posts.select_related('author')
+    return HttpResponse(FEED.render({'posts': posts}))
+
+
+class NPlusOneTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(5):
+            author = User.objects.create_user(username=f'author{number}')
+            Post.objects.create(author=author, text='Текст')
+
+    def get(self, path):
+        middleware = nplusone.NPlusOneMiddleware(feed)
+        return middleware(RequestFactory().get(path))
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            nplusone.fingerprint('SELECT * FROM t WHERE id = 7 AND '
+                                 "name = 'O''Brien' AND pk IN (%s, %s)"),
+            nplusone.fingerprint('SELECT * FROM t WHERE id = 8 AND '
+                                 "name = 'x' AND pk IN (%s)"))
+
+    def test_reports_template_line(self):
+        with nplusone.collect() as found:
+            with self.assertLogs('core.nplusone', 'WARNING'):
+                self.get('/feed/')
+        self.assertEqual(len(found), 1)
+        url, problem = found[0]
+        self.assertEqual(url, '/feed/')
+        self.assertEqual(problem.count, 5)
+        self.assertIn('auth_user', problem.shape)
+        self.assertIn(":3 'post.author.username'", problem.template)
+        self.assertTrue(any(frame.startswith('core/tests_nplusone.py')
+                            for frame in problem.stack))
+
+    def test_threshold_and_joined_query(self):
+        with nplusone.collect(threshold=5) as found:
+            self.get('/feed/')
+        self.assertEqual(found, [])
+        with nplusone.collect() as found:
+            self.get('/feed/?join=1')
+        self.assertEqual(found, [])
+
+    @override_settings(NPLUSONE_ENABLED=False)
+    def test_disabled_without_collector(self):
+        with self.assertNoLogs('core.nplusone'):
+            self.get('/feed/')
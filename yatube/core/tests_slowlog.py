@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import slowlog
+from posts.models import Group, Post, User
+
+
+class SlowRequestLogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        Post.objects.create(author=cls.author, group=group, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'slow.jsonl')
+        settings = override_settings(
+            SLOW_REQUEST_ENABLED=True, SLOW_REQUEST_PATH=self.path,
+            SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_SAMPLE_RATE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def tearDown(self):
+        slowlog.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def entries(self, path=None):
+        slowlog.close()
+        path = path or slowlog.process_path(self.path, os.getpid())
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_slow_request(self):
+        """Медленный запрос пишется с адресом, SQL, кэшем и шаблонами"""
+        self.client.force_login(self.author)
+        self.client.get(reverse('posts:profile', args=['author']))
+        entry, = self.entries()
+        self.assertEqual(entry['reason'], 'slow')
+        self.assertEqual(entry['view'], 'posts:profile')
+        self.assertEqual(entry['url_kwargs'], {'username': 'author'})
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['user'], self.author.pk)
+        self.assertEqual(len(entry['queries']), entry['sql_count'])
+        self.assertTrue(all(query['sql'] and query['ms'] >= 0
+                            for query in entry['queries']))
+        self.assertIn({'op': 'set', 'hit': None},
+                      [{'op': op['op'], 'hit': op['hit']}
+                       for op in entry['cache']
+                       if op['key'].startswith('views.decorators.cache')])
+        self.assertEqual(entry['cache'][0]['op'], 'get')
+        self.assertGreater(entry['template_ms'], 0)
+        self.assertGreaterEqual(entry['total_ms'], entry['view_ms'])
+
+    def test_fast_request_skipped(self):
+        """Быстрый запрос вне выборки не пишется"""
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=60000):
+            self.client.get(reverse('posts:index'))
+        self.assertEqual(self.entries(), [])
+
+    def test_sample(self):
+        """Выборка пишет и быстрые запросы"""
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=60000,
+                               SLOW_REQUEST_SAMPLE_RATE=1):
+            self.client.get(reverse('posts:index'))
+        entry, = self.entries()
+        self.assertEqual(entry['reason'], 'sample')
+        self.assertEqual(entry['view'], 'posts:index')
+
+    def test_rotation(self):
+        """Файл ротируется по размеру"""
+        with override_settings(SLOW_REQUEST_MAX_BYTES=1024):
+            for _ in range(3):
+                self.client.get(reverse('posts:index'))
+            slowlog.close()
+        self.assertTrue(os.path.exists(
+            slowlog.process_path(self.path, os.getpid()) + '.1'))
+
+    def test_processes_rotate_own_files(self):
+        """Процессы с одним путём пишут и ротируют каждый свой файл"""
+        with override_settings(SLOW_REQUEST_MAX_BYTES=200,
+                               SLOW_REQUEST_BACKUP_COUNT=100):
+            writers = [slowlog.Writer(self.path, pid) for pid in (1, 2)]
+            for number in range(20):
+                for writer in writers:
+                    writer.queue.put(logging.makeLogRecord(
+                        {'msg': {'pid': writer.pid, 'number': number}}))
+            for writer in writers:
+                writer.close()
+        for pid in (1, 2):
+            with self.subTest(pid=pid):
+                path = slowlog.process_path(self.path, pid)
+                entries = [entry for backup in range(100, 0, -1)
+                           for entry in self.entries(f'{path}.{backup}')]
+                entries += self.entries(path)
+                self.assertEqual(entries, [{'pid': pid, 'number': number}
+                                           for number in range(20)])
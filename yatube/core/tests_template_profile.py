@@ -0,0 +1,65 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.template import engines
+from django.test import RequestFactory, TestCase
+
+from core import template_profile
+from core.views import template_profile as profile_view
+from posts import seeding
+from posts.models import User
+
+
+class TemplateProfileTest(TestCase):
+
+    def setUp(self):
+        template_profile.install()
+        template_profile.reset()
+        self.addCleanup(template_profile.uninstall)
+
+    def rows(self):
+        return {(kind, name): (count, total, own)
+                for kind, name, count, total, own in template_profile.stats()}
+
+    def test_tags_filters_and_self_time(self):
+        template = engines['django'].from_string(
+            '{% load user_filters %}{% for i in items %}'
+            '{% url "posts:index" %}{{ i|linebreaksbr }}{% endfor %}')
+        template.render({'items': ['a', 'b', 'c']})
+        rows = self.rows()
+        self.assertEqual(rows['tag', 'for'][0], 1)
+        self.assertEqual(rows['tag', 'url'][0], 3)
+        self.assertEqual(rows['filter', 'linebreaksbr'][0], 3)
+        self.assertEqual(rows['template', '<string>'][0], 1)
+        count, total, own = rows['tag', 'for']
+        self.assertLess(own, total)
+
+    def test_uninstall_restores_engine(self):
+        template_profile.uninstall()
+        engines['django'].from_string('{% url "posts:index" %}').render()
+        self.assertEqual(template_profile.stats(), [])
+
+    def test_staff_only_view(self):
+        factory = RequestFactory()
+        request = factory.get('/__templates__/')
+        request.user = User.objects.create_user(username='user')
+        self.assertEqual(profile_view(request).status_code, 302)
+        request.user = User.objects.create_user(username='staff',
+                                                is_staff=True)
+        response = profile_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('self, мс', response.content.decode())
+
+
+class ProfileTemplatesCommandTest(TestCase):
+
+    def test_report_ranks_feed_templates(self):
+        seeding.seed(users=5, groups=2, posts=20, follows=2, images=0)
+        output = StringIO()
+        call_command('profile_templates', '--requests', '1',
+                     '--limit', '1000', stdout=output, stderr=StringIO())
+        report = output.getvalue()
+        for name in ('includes/article.html', 'addclass', 'thumbnail',
+                     'linebreaksbr'):
+            self.assertIn(name, report)
+        self.assertFalse(template_profile.is_installed())
@@ -0,0 +1,114 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import timing
+from posts.models import Group, Post, User
+
+# Адрес не из INTERNAL_IPS (TEST-NET-3).
+EXTERNAL_ADDR = '203.0.113.5'
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+class ServerTimingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.staff = User.objects.create_user(username='staff',
+                                             is_staff=True)
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        Post.objects.create(author=cls.author, group=group, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+
+    def metrics(self, response):
+        return {item.split(';')[0]: item
+                for item in response['Server-Timing'].split(', ')}
+
+    def test_header_and_log(self):
+        """Заголовок и запись лога несут SQL, кэш, шаблоны и время"""
+        with self.assertLogs('core.middleware', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('posts:index'))
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {'db', 'cache', 'tpl', 'view',
+                                        'total'})
+        fields = logs.records[0].timing
+        self.assertEqual(fields['sql_count'], len(queries))
+        self.assertIn(f'desc="{len(queries)} queries"', metrics['db'])
+        self.assertGreater(fields['cache_misses'], 0)
+        self.assertGreater(fields['template_ms'], 0)
+        self.assertLessEqual(fields['view_ms'], fields['total_ms'])
+        self.assertEqual((fields['path'], fields['status']),
+                         ('/', 200))
+
+    def test_cached_page_counts_hits(self):
+        self.client.get(reverse('posts:index'))
+        with self.assertLogs('core.middleware', 'INFO') as logs:
+            self.client.get(reverse('posts:index'))
+        self.assertGreater(logs.records[0].timing['cache_hits'], 0)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request(self):
+        """Вне выборки замер не пишется в лог и не нужен посторонним"""
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('core.middleware', 'INFO'):
+                response = self.client.get(reverse('posts:index'))
+        self.assertIn('Server-Timing', response)
+        response = self.client.get(reverse('posts:index'),
+                                   REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_header_only_for_staff_and_internal_ips(self):
+        """Посторонним заголовок не уходит, персоналу — уходит"""
+        url = reverse('posts:index')
+        response = self.client.get(url, REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_login(self.author)
+        response = self.client.get(url, REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_session_measured_only_for_staff(self):
+        """Вне выборки сессия сама по себе замера не включает"""
+        url = reverse('posts:index')
+        self.client.force_login(self.author)
+        with mock.patch.object(timing, 'measure',
+                               wraps=timing.measure) as measure:
+            response = self.client.get(url, REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertNotIn('Server-Timing', response)
+        measure.assert_not_called()
+        self.client.force_login(self.staff)
+        response = self.client.get(url, REMOTE_ADDR=EXTERNAL_ADDR)
+        self.assertEqual(set(self.metrics(response)),
+                         {'db', 'cache', 'tpl', 'view', 'total'})
+
+    @override_settings(SERVER_TIMING_SQL=False, SERVER_TIMING_LOG=False,
+                       SLOW_REQUEST_ENABLED=False)
+    def test_sql_wrapper_disabled(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertIn('desc="0 queries"', self.metrics(response)['db'])
+
+    def test_nested_render_counted_once(self):
+        """render_to_string внутри отрисовки не удваивает время"""
+        measured, token = timing.start()
+        try:
+            with timing.template_render():
+                with timing.template_render():
+                    render_to_string('includes/header.html')
+                inner = measured.template_time
+        finally:
+            timing.stop(token)
+        self.assertEqual(inner, 0)
+        self.assertGreater(measured.template_time, 0)
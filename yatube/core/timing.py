@@ -0,0 +1,220 @@
+"""Замеры одного запроса: SQL, кэш, шаблоны и представление.
+
+Замер живёт в contextvar, пока его держит core.middleware.
+Источники пишут в него сами: SQL — через execute_wrapper
+соединения, кэши core.cache — через cache_lookup, шаблоны —
+через бэкенды DjangoTemplates и Jinja2 этого модуля. Вне замера каждый
+источник обходится одним чтением contextvar.
+
+Внутри recording() замер ещё и запоминает сами запросы к БД
+и операции кэша: их пишет журнал медленных запросов core.slowlog.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.template.backends import django as django_backend
+from django.template.backends import jinja2 as jinja2_backend
+from django.template.exceptions import TemplateDoesNotExist
+
+_current = ContextVar('request_timing', default=None)
+# Сколько запросов к БД запоминает recording(); счёт идёт дальше.
+QUERY_LOG_LIMIT = 1000
+
+
+class RequestTiming:
+    """Счётчики запроса; время — в секундах perf_counter."""
+
+    __slots__ = ('started', 'sql_count', 'sql_time', 'cache_hits',
+                 'cache_misses', 'template_time', 'template_depth',
+                 'view_time', 'total_time', 'sql_wrapped', 'queries',
+                 'cache_ops')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.view_time = None
+        self.total_time = None
+        self.sql_wrapped = False
+        # Списки заводит recording(): (sql, секунды, many)
+        # и (операция, ключ, попадание или None).
+        self.queries = None
+        self.cache_ops = None
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Поля для структурного лога, время в миллисекундах."""
+        return {
+            'sql_count': self.sql_count,
+            'sql_ms': _ms(self.sql_time),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'template_ms': _ms(self.template_time),
+            'view_ms': _ms(self.view_time),
+            'total_ms': _ms(self.total_time),
+        }
+
+    def header(self):
+        """Значение заголовка Server-Timing.
+
+        Время view включает db и tpl: метрики пересекаются.
+        """
+        metrics = [
+            f'db;dur={_ms(self.sql_time)};desc="{self.sql_count} queries"',
+            f'cache;desc="{self.cache_hits} hits / '
+            f'{self.cache_misses} misses"',
+            f'tpl;dur={_ms(self.template_time)}',
+        ]
+        if self.view_time is not None:
+            metrics.append(f'view;dur={_ms(self.view_time)}')
+        if self.total_time is not None:
+            metrics.append(f'total;dur={_ms(self.total_time)}')
+        return ', '.join(metrics)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def start():
+    """Начинает замер; вернёт токен для stop."""
+    timing = RequestTiming()
+    return timing, _current.set(timing)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def measure(sql=True):
+    """Замер блока; sql=False — без обёртки запросов к БД."""
+    measured, token = start()
+    try:
+        with ExitStack() as stack:
+            if sql:
+                _wrap_sql(stack, measured)
+            yield measured
+        measured.finish()
+    finally:
+        stop(token)
+
+
+@contextmanager
+def recording(measured):
+    """Замер запоминает запросы к БД и операции кэша внутри блока.
+
+    Запросы оборачиваются, даже если замер начат с sql=False.
+    """
+    measured.queries = []
+    measured.cache_ops = []
+    with ExitStack() as stack:
+        if not measured.sql_wrapped:
+            _wrap_sql(stack, measured)
+            stack.callback(setattr, measured, 'sql_wrapped', False)
+        yield measured
+
+
+def _wrap_sql(stack, measured):
+    measured.sql_wrapped = True
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(sql_wrapper))
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """execute_wrapper: время и число запросов к БД."""
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        timing.sql_time += elapsed
+        timing.sql_count += 1
+        queries = timing.queries
+        if queries is not None and len(queries) < QUERY_LOG_LIMIT:
+            queries.append((sql, elapsed, many))
+
+
+def cache_lookup(hits, misses=0):
+    """Вызывают бэкенды core.cache при каждом чтении."""
+    timing = _current.get()
+    if timing is not None:
+        timing.cache_hits += hits
+        timing.cache_misses += misses
+
+
+def cache_operation(operation, key, hit=None):
+    """Вызывают бэкенды core.cache; пишется только внутри recording()."""
+    timing = _current.get()
+    if timing is not None and timing.cache_ops is not None:
+        timing.cache_ops.append((operation, key, hit))
+
+
+@contextmanager
+def template_render():
+    """Время отрисовки; вложенный render_to_string не считается дважды."""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    timing.template_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.template_depth -= 1
+        if not timing.template_depth:
+            timing.template_time += time.perf_counter() - started
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        with template_render():
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Обычный бэкенд Django, отрисовка которого попадает в замер."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class Jinja2Template(jinja2_backend.Template):
+
+    def render(self, context=None, request=None):
+        with template_render():
+            return super().render(context, request)
+
+
+class Jinja2(jinja2_backend.Jinja2):
+    """Обычный бэкенд Jinja2, отрисовка которого попадает в замер."""
+
+    def from_string(self, template_code):
+        return Jinja2Template(self.env.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return Jinja2Template(template.template, self)
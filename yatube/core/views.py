@@ -1,4 +1,16 @@
+import logging
+import sqlite3
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+
+from . import metrics as registry
+from . import template_profile as profile
+
+logger = logging.getLogger(__name__)
 
 
 def page_not_found(request, exception):
@@ -15,3 +27,34 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def template_profile(request):
+    """Профиль шаблонов этого процесса, при TEMPLATE_PROFILING."""
+    sort = request.GET.get('sort')
+    if sort not in profile.SORT_KEYS:
+        sort = 'self'
+    return HttpResponse(profile.report(sort),
+                        content_type='text/plain; charset=utf-8')
+
+
+@require_safe
+def metrics(request):
+    """Метрики для Prometheus: по Bearer-токену METRICS_TOKEN
+    или персоналу сайта."""
+    token = registry.get_setting('TOKEN')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (request.user.is_staff or token and constant_time_compare(
+            authorization, f'Bearer {token}')):
+        response = HttpResponse('Нужен токен сборщика метрик.', status=401,
+                                content_type='text/plain; charset=utf-8')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    try:
+        text = registry.exposition()
+    except sqlite3.Error:
+        logger.exception('Не удалось прочитать метрики')
+        return HttpResponse('Файл метрик недоступен.', status=503,
+                            content_type='text/plain; charset=utf-8')
+    return HttpResponse(text, content_type=registry.CONTENT_TYPE)
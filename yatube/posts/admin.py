@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Comment, Follow, Group, Post
 
 
@@ -16,6 +17,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        match = search.build_match(search_term)
+        if not match or not search.is_available():
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return search.only_matching(queryset, match), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
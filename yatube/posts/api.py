@@ -0,0 +1,180 @@
+"""JSON API для мобильных клиентов: ленты, пост и комментарии.
+
+Только чтение. Ленты листаются курсорами по (pub_date, id),
+комментарии — по (created, id). Число запросов к БД на ответ
+не зависит от размера страницы. ETag лент, поста и комментариев
+считается по версии области кэша страниц (posts.caching), поэтому
+304 отдаётся без запросов к БД.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import condition, require_safe
+
+from . import caching, timeline
+from .models import Comment, Group, Post
+from .pagination import CursorPaginator
+
+User = get_user_model()
+
+API_VERSION = 1
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+def serialize_post(post):
+    return {
+        'id': post.pk,
+        'theme': post.theme,
+        'text': post.text,
+        'pub_date': post.pub_date.isoformat(),
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'image': post.image.url if post.image else None,
+        'comments_count': post.comments_count,
+    }
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+    }
+
+
+def serialize_group(group):
+    return {
+        'slug': group.slug,
+        'title': group.title,
+        'description': group.description,
+    }
+
+
+def get_limit(request):
+    """Размер страницы из ?limit=, в пределах 1..MAX_LIMIT."""
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return DEFAULT_LIMIT
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def paginate(request, queryset, serialize, **kwargs):
+    """Страница по курсору из ?cursor=: один запрос к БД."""
+    return paginate_with(
+        request, CursorPaginator(queryset, get_limit(request), **kwargs),
+        serialize)
+
+
+def paginate_with(request, paginator, serialize):
+    page = paginator.get_page(request.GET.get('cursor'))
+    return {
+        'results': [serialize(obj) for obj in page.object_list],
+        'next': paginator.next_cursor,
+        'previous': paginator.previous_cursor,
+    }
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params=JSON_PARAMS)
+
+
+def not_found():
+    return json_response({'detail': 'Не найдено.'}, status=404)
+
+
+def scope_condition(scope):
+    """condition с ETag по версии области и адресу с параметрами."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, **kwargs):
+            name = scope.format(**kwargs)
+            (version,), created = caching.get_versions([name])
+
+            def etag(request, **kwargs):
+                raw = (f'{API_VERSION}|{name}|{version}|'
+                       f'{request.get_full_path()}')
+                return hashlib.blake2b(raw.encode(),
+                                       digest_size=16).hexdigest()
+
+            response = None
+            try:
+                response = condition(etag_func=etag)(view)(request,
+                                                           **kwargs)
+            finally:
+                caching.forget_created(created, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def feed_posts():
+    return Post.objects.select_related('author', 'group')
+
+
+@require_safe
+@scope_condition(caching.INDEX)
+def posts_list(request):
+    return json_response(paginate(request, feed_posts(), serialize_post))
+
+
+@require_safe
+@scope_condition(caching.GROUP)
+def group_posts(request, slug):
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return not_found()
+    data = paginate(request, feed_posts().filter(group=group),
+                    serialize_post)
+    data['group'] = serialize_group(group)
+    return json_response(data)
+
+
+@require_safe
+@scope_condition(caching.PROFILE)
+def author_posts(request, username):
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return not_found()
+    return json_response(paginate(
+        request, feed_posts().filter(author=author), serialize_post))
+
+
+@require_safe
+def follow_posts(request):
+    """Лента подписок зависит от пользователя, ETag — по содержимому."""
+    if not request.user.is_authenticated:
+        return json_response({'detail': 'Нужна авторизация.'}, status=401)
+    response = json_response(paginate_with(
+        request, timeline.FeedPaginator(request.user, get_limit(request)),
+        serialize_post))
+    etag = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+    response['ETag'] = f'"{etag}"'
+    return get_conditional_response(request, etag=response['ETag'],
+                                    response=response)
+
+
+@require_safe
+@scope_condition(caching.POST)
+def post_detail(request, post_id):
+    post = feed_posts().filter(pk=post_id).first()
+    if post is None:
+        return not_found()
+    return json_response(serialize_post(post))
+
+
+@require_safe
+@scope_condition(caching.POST)
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return not_found()
+    return json_response(paginate(
+        request,
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        serialize_comment, field='created', descending=False))
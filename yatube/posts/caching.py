@@ -0,0 +1,318 @@
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (get_cache_key, get_conditional_response,
+                                has_vary_header, learn_cache_key,
+                                patch_response_headers, patch_vary_headers)
+
+from . import fragments
+from .models import Comment, Post
+
+VERSION_KEY = 'page_version:{}'
+LOCK_KEY = '{}:lock'
+POST_AUTHOR_KEY = 'post_author:{}'
+
+# Сколько секунд после срока свежести страницу ещё можно отдавать,
+# пока один запрос её перестраивает.
+GRACE_SEC = 60
+# Срок свежести случайно укорачивается до этой доли, чтобы страницы,
+# закэшированные одновременно, не истекали одновременно.
+JITTER = 0.2
+# Вероятностное раннее обновление (XFetch): чем дольше строится
+# страница, тем раньше срока её начинают перестраивать.
+XFETCH_BETA = 1.0
+LOCK_TIMEOUT_SEC = 10
+# Сколько ждать чужого построения страницы, которой нет в кэше.
+LOCK_WAIT_SEC = 2
+LOCK_POLL_SEC = 0.05
+# Срок версии области: много дольше жизни страницы (timeout
+# + GRACE_SEC), чтобы версия не истекала раньше страниц, но конечный,
+# чтобы ключи областей, которых больше нет, не копились в кэше.
+VERSION_TIMEOUT_SEC = 24 * 60 * 60
+
+INDEX = 'index'
+GROUP = 'group:{slug}'
+PROFILE = 'profile:{username}'
+POST = 'post:{post_id}'
+
+
+def _version_key(scope):
+    return VERSION_KEY.format(quote(scope))
+
+
+def get_versions(scopes):
+    """Текущие версии областей кэша и области, чьи версии заведены сейчас.
+
+    Если версии нет (сброшена, вытеснена или истекла), заводится
+    новая, заведомо не совпадающая ни с одной из прежних. Если кэш
+    не принял и её, версия одноразовая: страница просто не попадёт
+    в кэш. Заведённые версии надо отдать forget_created вместе
+    с ответом.
+    """
+    versions, created = [], []
+    for scope in scopes:
+        key = _version_key(scope)
+        version = cache.get(key)
+        if version is None:
+            version = time.time_ns()
+            if cache.add(key, version, VERSION_TIMEOUT_SEC):
+                created.append(scope)
+            else:
+                version = cache.get(key) or version
+        versions.append(version)
+    return versions, created
+
+
+def forget_created(created, response):
+    """Удаляет версии, заведённые для адреса, которого нет.
+
+    Области берутся из URL до того, как view найдёт объект: иначе
+    обход случайных адресов оставлял бы в кэше по версии на каждый.
+    """
+    if created and (response is None or response.status_code != 200):
+        bump(*created)
+
+
+def bump(*scopes):
+    """Инвалидирует страницы перечисленных областей."""
+    cache.delete_many([_version_key(scope) for scope in scopes])
+
+
+def _needs_refresh(fresh_until, build_time):
+    """Пора ли перестраивать страницу (XFetch, Vattani et al.)."""
+    early = -build_time * XFETCH_BETA * math.log(1.0 - random.random())
+    return time.time() + early >= fresh_until
+
+
+def _cacheable(request, response):
+    """Те же условия, что у UpdateCacheMiddleware."""
+    if response.streaming or response.status_code != 200:
+        return False
+    if (not request.COOKIES and response.cookies
+            and has_vary_header(response, 'Cookie')):
+        return False
+    return 'private' not in response.get('Cache-Control', ())
+
+
+class PageCache:
+    """Кэш страниц одного view с защитой от набега запросов.
+
+    В кэше лежит (ответ, срок свежести, время построения) и живёт
+    timeout + GRACE_SEC. Свежая страница отдаётся сразу. Устаревшую
+    перестраивает только запрос, взявший блокировку (cache.add),
+    остальные до конца GRACE_SEC получают устаревшую. Страницу,
+    которой нет в кэше, прочие запросы ждут до LOCK_WAIT_SEC.
+    """
+
+    def __init__(self, view, timeout):
+        self.view = view
+        self.timeout = timeout
+
+    def __call__(self, request, key_prefix, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return self.view(request, *args, **kwargs)
+        key = get_cache_key(request, key_prefix, 'GET', cache=cache)
+        entry = cache.get(key) if key is not None else None
+        if entry is not None:
+            response, fresh_until, build_time = entry
+            if not _needs_refresh(fresh_until, build_time):
+                return response
+            if not cache.add(LOCK_KEY.format(key), 1, LOCK_TIMEOUT_SEC):
+                return response
+        elif key is not None and not cache.add(LOCK_KEY.format(key), 1,
+                                               LOCK_TIMEOUT_SEC):
+            response = self.wait(key)
+            if response is not None:
+                return response
+            return self.build(request, key_prefix, *args, **kwargs)
+        try:
+            return self.build(request, key_prefix, *args, **kwargs)
+        finally:
+            if key is not None:
+                cache.delete(LOCK_KEY.format(key))
+
+    def wait(self, key):
+        deadline = time.monotonic() + LOCK_WAIT_SEC
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_SEC)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        return None
+
+    def build(self, request, key_prefix, *args, **kwargs):
+        started = time.monotonic()
+        response = self.view(request, *args, **kwargs)
+        if not _cacheable(request, response):
+            return response
+        patch_response_headers(response, self.timeout)
+        lifetime = self.timeout + GRACE_SEC
+        key = learn_cache_key(request, response, lifetime, key_prefix,
+                              cache=cache)
+        fresh_for = self.timeout * random.uniform(1 - JITTER, 1)
+        build_time = time.monotonic() - started
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(lambda rendered: cache.set(
+                key, (rendered, time.time() + fresh_for, build_time),
+                lifetime))
+        else:
+            cache.set(key, (response, time.time() + fresh_for, build_time),
+                      lifetime)
+        return response
+
+
+def validators(request, name, versions, timeout):
+    """ETag страницы области name, без запросов к БД.
+
+    versions — версии области и тех, от которых зависит страница.
+    Версия заводится заново после каждой правки, видной на страницах
+    области (см. signals). Правки, которые версии не сменили, ETag
+    переживёт не дольше timeout: в него входит номер интервала
+    в timeout секунд, как и страница в кэше. Личные фрагменты зависят
+    от сессии и CSRF-куки, они входят в ETag; куку, которую выставит
+    этот ответ, CsrfViewMiddleware кладёт в META. ETag слабый: токен
+    CSRF в форме при каждом рендере свой. Last-Modified не отдаётся:
+    с точностью до секунды он пропустил бы вторую правку за секунду.
+    """
+    csrf_cookie = (request.META.get('CSRF_COOKIE')
+                   or request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (name, *map(str, versions), str(int(time.time() // timeout)),
+                 request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+                 csrf_cookie):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return f'W/"{digest.hexdigest()}"'
+
+
+def versioned_cache_page(timeout, scope, depends=None):
+    """Кэш страницы, чей key_prefix включает версию области.
+
+    scope — шаблон имени области, подставляются аргументы из URL:
+    'group:{slug}', 'post:{post_id}'. Страница в кэше одна на всех
+    пользователей, личные части подставляются в неё при каждом
+    запросе, см. posts.fragments. Смена версии — жёсткая
+    инвалидация: старую версию страницы никто больше не увидит.
+    Истечение срока — мягкое, см. PageCache. По версии же отвечается
+    304 на условный GET, даже не доставая страницу из кэша.
+    depends(**kwargs) — области, чьи правки тоже видны на странице:
+    их версии входят и в ключ, и в ETag. Версии
+    областей адресов, которых нет (404), в кэше не остаются.
+    """
+    def decorator(view):
+        page_cache = PageCache(fragments.render_shared(view), timeout)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            name = scope.format(**kwargs)
+            scopes = [name, *(depends(**kwargs) if depends else ())]
+            versions, created = get_versions(scopes)
+            response = None
+            try:
+                response = cached_view(request, name, versions,
+                                       *args, **kwargs)
+            finally:
+                forget_created(created, response)
+            return response
+
+        def cached_view(request, name, versions, *args, **kwargs):
+            conditional = request.method in ('GET', 'HEAD')
+            if conditional:
+                response = get_conditional_response(
+                    request, etag=validators(request, name, versions,
+                                             timeout))
+                if response is not None:
+                    patch_vary_headers(response, ('Cookie',))
+                    return response
+            key_prefix = '.'.join([quote(name), *map(str, versions)])
+            response = page_cache(request, key_prefix, *args, **kwargs)
+            response = fragments.fill(request, response)
+            if conditional and response.status_code == 200:
+                # Фрагменты могли завести CSRF-куку.
+                response['ETag'] = validators(request, name, versions,
+                                              timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def post_scopes(post):
+    """Области, на страницах которых виден пост."""
+    scopes = [
+        INDEX,
+        POST.format(post_id=post.pk),
+        PROFILE.format(username=post.author.username),
+    ]
+    if post.group_id is not None:
+        scopes.append(GROUP.format(slug=post.group.slug))
+    return scopes
+
+
+def group_scopes(group):
+    """Области, на страницах которых видно название группы.
+
+    Сама группа, главная, профили авторов её постов и страницы
+    этих постов.
+    """
+    scopes = {INDEX, GROUP.format(slug=group.slug)}
+    for post_id, username in (Post.objects.filter(group=group).order_by()
+                              .values_list('pk', 'author__username')):
+        scopes.add(POST.format(post_id=post_id))
+        scopes.add(PROFILE.format(username=username))
+    return list(scopes)
+
+
+def user_scopes(user):
+    """Области, на страницах которых видно имя пользователя.
+
+    Его профиль, главная, страницы его постов и их групп, страницы
+    постов с его комментариями.
+    """
+    scopes = {INDEX, PROFILE.format(username=user.username)}
+    for post_id, slug in (Post.objects.filter(author=user).order_by()
+                          .values_list('pk', 'group__slug')):
+        scopes.add(POST.format(post_id=post_id))
+        if slug is not None:
+            scopes.add(GROUP.format(slug=slug))
+    for post_id in (Comment.objects.filter(author=user).order_by()
+                    .values_list('post_id', flat=True).distinct()):
+        scopes.add(POST.format(post_id=post_id))
+    return list(scopes)
+
+
+def image_scopes(name):
+    """Области, на страницах которых видна картинка name."""
+    scopes = set()
+    for post in (Post.objects.filter(image=name)
+                 .select_related('author', 'group')):
+        scopes.update(post_scopes(post))
+    return list(scopes)
+
+
+def post_author_scopes(post_id):
+    """Профиль автора: на странице поста видно число его постов.
+
+    Имя автора запоминается в кэше на срок версии и обычно не стоит
+    запроса к БД. При переименовании автора и удалении поста запись
+    удаляется, см. forget_post_authors.
+    """
+    key = POST_AUTHOR_KEY.format(post_id)
+    username = cache.get(key)
+    if username is None:
+        username = (Post.objects.filter(pk=post_id).order_by()
+                    .values_list('author__username', flat=True).first())
+        if username is None:
+            return []
+        cache.set(key, username, VERSION_TIMEOUT_SEC)
+    return [PROFILE.format(username=username)]
+
+
+def forget_post_authors(post_ids):
+    cache.delete_many([POST_AUTHOR_KEY.format(post_id)
+                       for post_id in post_ids])
@@ -0,0 +1,102 @@
+"""Персональные фрагменты страниц из общего кэша.
+
+Кэшированная страница одна на всех: view рендерит её как для
+анонимного пользователя, а на месте частей, зависящих от
+пользователя (шапка, кнопки автора, форма комментария с CSRF,
+подписка), тег {% fragment %} оставляет метку
+<!--fragment:имя?аргументы-->. После выборки из кэша fill()
+рендерит фрагменты для текущего запроса и подставляет их.
+Пользовательский текст в шаблонах экранируется, поэтому подделать
+метку в посте или комментарии нельзя.
+"""
+import re
+from functools import wraps
+from urllib.parse import parse_qsl, urlencode
+
+from django.contrib.auth.models import AnonymousUser
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+
+from .forms import CommentForm
+from .models import Follow
+
+MARKER = '<!--fragment:{}?{}-->'
+MARKER_PREFIX = b'<!--fragment:'
+MARKER_PATTERN = re.compile(r'<!--fragment:(\w+)\?([^<>]*?)-->')
+# Атрибут запроса: рендер идёт в общий кэш, фрагменты — метками.
+SHARED_ATTR = '_shared_page'
+
+
+def _comment_form(request, **kwargs):
+    return {'form': CommentForm()}
+
+
+def _follow_button(request, author):
+    following = (request.user.is_authenticated
+                 and Follow.objects.filter(user=request.user,
+                                           author__username=author).exists())
+    return {'following': following}
+
+
+# Имя фрагмента: (шаблон, функция дополнительного контекста).
+FRAGMENTS = {
+    'header': ('includes/header.html', None),
+    'switcher': ('posts/includes/switcher.html', None),
+    'post_delete': ('includes/post_delete.html', None),
+    'post_edit': ('posts/includes/post_edit.html', None),
+    'comment_form': ('includes/comment_form.html', _comment_form),
+    'comment_delete': ('includes/comment_delete.html', None),
+    'follow_button': ('posts/includes/follow_button.html', _follow_button),
+}
+
+
+def is_shared(request):
+    return getattr(request, SHARED_ATTR, False)
+
+
+def marker(name, **kwargs):
+    return MARKER.format(name, urlencode(kwargs))
+
+
+def render(request, name, **kwargs):
+    """Фрагмент для пользователя этого запроса.
+
+    Аргументы приходят строками: из метки они читаются так же.
+    """
+    template, extra = FRAGMENTS[name]
+    context = {key: str(value) for key, value in kwargs.items()}
+    if extra is not None:
+        context.update(extra(request, **context))
+    return render_to_string(template, context, request)
+
+
+def fill(request, response):
+    """Подставляет в ответ фрагменты текущего пользователя."""
+    if response.streaming or MARKER_PREFIX not in response.content:
+        return response
+    content = response.content.decode(response.charset)
+    response.content = MARKER_PATTERN.sub(
+        lambda match: render(request, match[1], **dict(parse_qsl(match[2]))),
+        content)
+    # Итоговая страница у каждого своя.
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def render_shared(view):
+    """view рендерит общую страницу: анонимно и с метками.
+
+    Пользователь подменяется, чтобы в общий кэш не попало ничего
+    личного, даже если шаблон обратится к user мимо фрагмента.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user = request.user
+        request.user = AnonymousUser()
+        setattr(request, SHARED_ATTR, True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            request.user = user
+            setattr(request, SHARED_ATTR, False)
+    return wrapper
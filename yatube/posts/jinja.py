@@ -0,0 +1,76 @@
+"""Окружение Jinja2 для шаблонов лент и поста (каталог jinja2/).
+
+Шаблоны повторяют Django-шаблоны строка в строку, а помощники
+ведут себя как теги и фильтры Django, поэтому HTML совпадает:
+finalize выводит {{ }} так же, как Django (местное время,
+локализация, conditional_escape), пустая переменная — пустая
+строка, завершающий перевод строки файла сохраняется.
+Персональные фрагменты рендерятся Django-шаблонами из
+posts.fragments.
+"""
+from django.template import defaultfilters
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+from django.utils.timezone import template_localtime
+from jinja2 import Environment, Undefined, pass_context
+from markupsafe import Markup
+
+from core.templatetags import user_filters
+
+from .templatetags import fragments as fragment_tags
+from .templatetags import post_images
+
+
+def render_value(value):
+    """Вывод переменной, как его делает render_value_in_context."""
+    return conditional_escape(localize(template_localtime(value)))
+
+
+def url(view_name, *args, **kwargs):
+    return reverse(view_name, args=args, kwargs=kwargs)
+
+
+@pass_context
+def fragment(context, name, **kwargs):
+    return fragment_tags.fragment(context, name, **kwargs)
+
+
+@pass_context
+def url_replace(context, **kwargs):
+    return user_filters.url_replace(context, **kwargs)
+
+
+@pass_context
+def picture(context, image):
+    template = context.environment.get_template('includes/picture.html')
+    return Markup(template.render(post_images.picture(image)))
+
+
+def date(value, arg=None):
+    return defaultfilters.date(template_localtime(value), arg)
+
+
+def linebreaksbr(value):
+    return defaultfilters.linebreaksbr(value, autoescape=True)
+
+
+def environment(**options):
+    options.update(finalize=render_value, undefined=Undefined,
+                   keep_trailing_newline=True)
+    env = Environment(**options)
+    env.globals.update({
+        'url': url,
+        'static': static,
+        'fragment': fragment,
+        'url_replace': url_replace,
+        'ready_thumbnail': post_images.ready_thumbnail,
+        'picture': picture,
+    })
+    env.filters.update({
+        'date': date,
+        'linebreaksbr': linebreaksbr,
+        'truncatechars': defaultfilters.truncatechars,
+    })
+    return env
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+LRU_SIZE = 5000
+# Сколько секунд процесс верит записи из LRU. Удаление (reclaim,
+# clear) чистит только LRU своего процесса, остальные увидят его
+# не позже этого срока.
+LRU_TIMEOUT = 30
+# Отсутствие миниатюры помнится недолго: её может дописать
+# воркер другого процесса, и этот процесс должен её увидеть.
+MISS_TIMEOUT = 60
+
+
+class LRUCache:
+    """Словарь на maxsize записей, вытесняющий самые старые.
+
+    timeout — срок записи в секундах, None — без срока.
+    Потокобезопасен и считает попадания и промахи.
+    """
+
+    def __init__(self, maxsize, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            value, expires = self._data[key]
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.timeout is not None:
+            expires = time.monotonic() + self.timeout
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """cached_db-хранилище sorl с LRU в памяти процесса перед кэшем.
+
+    В LRU попадают только найденные записи о самих файлах: они
+    не меняются, а удаление идёт через _delete_raw. Удаление в другом
+    процессе сюда не доходит, поэтому записи живут LRU_TIMEOUT.
+    Списки миниатюр
+    источника дописываются из разных процессов и в LRU не кладутся.
+    get_many достаёт миниатюры целой страницы за один поход
+    в кэш и не более чем один запрос к БД.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lru = LRUCache(LRU_SIZE, LRU_TIMEOUT)
+        self._image_prefix = add_prefix('')
+
+    def _remember(self, key, value):
+        if key.startswith(self._image_prefix):
+            self.lru.set(key, value)
+
+    def get_many(self, image_files):
+        """Как get, но для списка файлов; порядок сохраняется."""
+        keys = [add_prefix(image_file.key) for image_file in image_files]
+        found = self._get_many_raw(keys)
+        return [deserialize_image_file(found[key]) if key in found else None
+                for key in keys]
+
+    def _get_many_raw(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            value = None
+            if key.startswith(self._image_prefix):
+                value = self.lru.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if not missing:
+            return found
+        cached = self.cache.get_many(missing)
+        absent = [key for key in missing if key not in cached]
+        if absent:
+            rows = dict(KVStoreModel.objects.filter(key__in=absent)
+                        .values_list('key', 'value'))
+            if rows:
+                self.cache.set_many(rows, settings.THUMBNAIL_CACHE_TIMEOUT)
+            empty = {key: EMPTY_VALUE for key in absent if key not in rows}
+            if empty:
+                self.cache.set_many(empty, MISS_TIMEOUT)
+            cached.update(rows)
+        for key, value in cached.items():
+            if value != EMPTY_VALUE:
+                self._remember(key, value)
+                found[key] = value
+        return found
+
+    def _get_raw(self, key):
+        return self._get_many_raw([key]).get(key)
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.lru.delete(*keys)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.lru.clear()
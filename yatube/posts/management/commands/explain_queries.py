@@ -0,0 +1,150 @@
+import re
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (CaptureQueriesContext, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+from django.urls import reverse
+
+from posts import seeding
+from posts.models import Follow, Post
+from posts.pagination import NEXT, encode_cursor
+
+# Полный проход таблицы: «SCAN t» без USING INDEX (SQLite 3.36+
+# пишет SCAN t, старые версии — SCAN TABLE t).
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$')
+TEMP_SORT = 'USE TEMP B-TREE'
+# Отдельный кэш: страницы должны строиться, а общий кэш сайта
+# трогать нельзя.
+REPLAY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'explain-queries',
+    }
+}
+SQL_PREVIEW = 300
+
+
+def problems(plan):
+    """Строки плана с полным проходом таблицы или сортировкой."""
+    return [detail for detail in plan
+            if FULL_SCAN.match(detail) or TEMP_SORT in detail]
+
+
+class Command(BaseCommand):
+    help = ('Наполняет временную базу данными, повторяет запросы '
+            'страниц и API и показывает EXPLAIN QUERY PLAN для тех, '
+            'что проходят таблицу целиком или сортируют во временном '
+            'B-дереве.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=3,
+                            help='Комментариев на пост в среднем')
+        parser.add_argument('--follows', type=int, default=5,
+                            help='Подписок на пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если найдены проблемы')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Разбор планов написан для SQLite')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(CACHES=REPLAY_CACHES):
+                # Картинки не нужны планам, а писать файлы незачем.
+                seeding.seed(users=options['users'],
+                             groups=options['groups'],
+                             posts=options['posts'],
+                             comments=options['comments'],
+                             follows=options['follows'], images=0,
+                             seed=options['seed'])
+                found = self.replay(options['verbosity'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        if found and options['strict']:
+            raise CommandError(f'Проблемных запросов: {found}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проблемных запросов: {found}'))
+
+    def targets(self):
+        """(подпись, адрес, параметры, авторизован ли клиент)."""
+        post = Post.objects.select_related('author', 'group').filter(
+            group__isnull=False).order_by('-comments_count').first()
+        middle = Post.objects.order_by('-pub_date')[Post.objects.count() // 2]
+        cursor = encode_cursor(NEXT, middle.pub_date, middle.pk)
+        group = {'slug': post.group.slug}
+        author = {'username': post.author.username}
+        post_id = {'post_id': post.pk}
+        return [
+            ('posts:index', reverse('posts:index'), {}, False),
+            ('posts:index по курсору', reverse('posts:index'),
+             {'cursor': cursor}, False),
+            ('posts:index по номеру', reverse('posts:index'),
+             {'page': 5}, False),
+            ('posts:group_list', reverse('posts:group_list', kwargs=group),
+             {}, False),
+            ('posts:profile', reverse('posts:profile', kwargs=author),
+             {}, False),
+            ('posts:post_detail', reverse('posts:post_detail',
+                                          kwargs=post_id), {}, False),
+            ('posts:follow_index', reverse('posts:follow_index'), {}, True),
+            ('posts:search', reverse('posts:search'), {'q': 'котик'},
+             False),
+            ('api:posts', reverse('api:posts'), {'cursor': cursor}, False),
+            ('api:group_posts', reverse('api:group_posts', kwargs=group),
+             {}, False),
+            ('api:author_posts', reverse('api:author_posts',
+                                         kwargs=author), {}, False),
+            ('api:comments', reverse('api:comments', kwargs=post_id), {},
+             False),
+            ('api:follow_posts', reverse('api:follow_posts'), {}, True),
+        ]
+
+    def replay(self, verbosity):
+        guest = Client()
+        reader = Client()
+        reader.force_login(Follow.objects.first().user)
+        seen = set()
+        found = 0
+        for label, url, params, authorized in self.targets():
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = (reader if authorized else guest).get(url, params)
+            queries = [query['sql'] for query in context.captured_queries
+                       if query['sql'].startswith('SELECT')]
+            self.stdout.write(f'{label}: {response.status_code}, '
+                              f'запросов {len(context)}')
+            for sql in queries:
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                plan = self.explain(sql)
+                flagged = problems(plan)
+                found += bool(flagged)
+                if flagged or verbosity > 1:
+                    self.report(sql, plan, flagged)
+        return found
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def report(self, sql, plan, flagged):
+        preview = sql if len(sql) <= SQL_PREVIEW else (
+            sql[:SQL_PREVIEW] + '…')
+        self.stdout.write(f'    {preview}')
+        for detail in plan:
+            line = f'      {detail}'
+            self.stdout.write(self.style.WARNING(line)
+                              if detail in flagged else line)
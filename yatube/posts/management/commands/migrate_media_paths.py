@@ -0,0 +1,82 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import caching, media, variants
+from posts.models import Post
+from posts.storage import is_hashed, post_images
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище с адресацией '
+            'по содержимому пачками. Перенесённые файлы пропускаются, '
+            'поэтому прерванный запуск можно повторить.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, какие файлы будут перенесены')
+
+    def handle(self, *args, **options):
+        last_name = ''
+        moved = missing = 0
+        while True:
+            names = list(
+                Post.objects.exclude(image='').filter(image__gt=last_name)
+                .order_by('image').values_list('image', flat=True)
+                .distinct()[:options['batch_size']])
+            if not names:
+                break
+            last_name = names[-1]
+            for name in names:
+                if is_hashed(name):
+                    continue
+                if not post_images.exists(name):
+                    missing += 1
+                    self.stderr.write(f'Нет файла {name}')
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'{name} будет перенесён')
+                else:
+                    self.stdout.write(f'{name} -> {self.move(name)}')
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, не найдено: {missing}'))
+
+    def move(self, name):
+        """Переносит файл и его варианты, переписывает ссылки постов."""
+        with post_images.open(name) as source:
+            new_name = post_images.save(name, source)
+        posts = Post.objects.filter(image=name)
+        variants_value = (posts.exclude(image_variants='')
+                          .values_list('image_variants', flat=True).first())
+        if variants_value:
+            self.copy_variants(name, new_name, variants_value)
+        with transaction.atomic():
+            count = posts.update(image=new_name)
+            # Одну ссылку уже взяло хранилище при сохранении.
+            if count:
+                media.acquire(new_name, count - 1)
+            else:
+                media.release(new_name)
+        for post in (Post.objects.filter(image=new_name)
+                     .select_related('author', 'group')):
+            caching.bump(*caching.post_scopes(post))
+        default.kvstore.delete(ImageFile(name, default.storage))
+        variants.delete(name)
+        post_images.delete(name)
+        return new_name
+
+    def copy_variants(self, name, new_name, value):
+        exts, widths = variants.parse(value)
+        for ext in exts:
+            for width in widths:
+                old = variants.variant_name(name, width, ext)
+                new = variants.variant_name(new_name, width, ext)
+                if default_storage.exists(new):
+                    continue
+                with default_storage.open(old) as source:
+                    default_storage.save(new, source)
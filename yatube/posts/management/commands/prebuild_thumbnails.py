@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры для уже загруженных картинок постов. '
+            'Готовые пропускает, поэтому прерванный запуск можно повторить.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=thumbnails.PREBUILD_WORKERS,
+            help='Число потоков; 0 — создавать в текущем потоке.')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').filter(image_variants='')
+                 .order_by('image')
+                 .values_list('image', flat=True).distinct().iterator())
+        missing = (name for name in names
+                   if not thumbnails.is_built(name))
+        built = failed = 0
+        pool = None
+        if options['workers'] > 0:
+            pool = ThreadPoolExecutor(max_workers=options['workers'])
+        try:
+            while True:
+                batch = list(islice(missing, options['batch_size']))
+                if not batch:
+                    break
+                if pool is None:
+                    results = map(thumbnails.build, batch)
+                else:
+                    results = pool.map(thumbnails.build_in_worker, batch)
+                for done in results:
+                    if done:
+                        built += 1
+                    else:
+                        failed += 1
+                self.stdout.write(f'Готово {built}, с ошибками {failed}, '
+                                  f'последний файл {batch[-1]}')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {built}, с ошибками: {failed}'))
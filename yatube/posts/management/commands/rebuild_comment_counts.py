@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Post
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает Post.comments_count и сообщает о расхождениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправлять')
+
+    def handle(self, *args, **options):
+        counts = (Comment.objects.filter(post=OuterRef('pk'))
+                  .order_by().values('post')
+                  .annotate(total=Count('pk')).values('total'))
+        actual = Coalesce(Subquery(counts), 0)
+        drifted = list(Post.objects.annotate(actual=actual)
+                       .exclude(comments_count=F('actual'))
+                       .values_list('pk', 'comments_count', 'actual'))
+        for pk, stored, real in drifted:
+            self.stdout.write(f'Пост {pk}: {stored} -> {real}')
+        if not options['dry_run']:
+            ids = [pk for pk, _, _ in drifted]
+            for start in range(0, len(ids), BATCH_SIZE):
+                Post.objects.filter(
+                    pk__in=ids[start:start + BATCH_SIZE]
+                ).update(comments_count=actual)
+        self.stdout.write(self.style.SUCCESS(
+            f'Расхождений: {len(drifted)}'))
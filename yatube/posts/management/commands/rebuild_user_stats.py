@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import USER_STATS_COUNTERS, User, UserStats
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Сверяет UserStats с данными и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправлять')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        missing = list(User.objects.filter(stats__isnull=True)
+                       .values_list('pk', flat=True))
+        if missing and not dry_run:
+            UserStats.objects.bulk_create(
+                [UserStats(user_id=pk) for pk in missing],
+                batch_size=BATCH_SIZE)
+        drifted = list(UserStats.objects.drifted())
+        for stats in drifted:
+            changes = ', '.join(
+                f'{field} {getattr(stats, field)} -> '
+                f'{getattr(stats, f"actual_{field}")}'
+                for field in USER_STATS_COUNTERS
+                if getattr(stats, field) != getattr(stats, f'actual_{field}'))
+            self.stdout.write(f'Пользователь {stats.pk}: {changes}')
+        if not dry_run:
+            ids = missing + [stats.pk for stats in drifted]
+            for start in range(0, len(ids), BATCH_SIZE):
+                UserStats.objects.filter(
+                    pk__in=ids[start:start + BATCH_SIZE]).recount()
+        self.stdout.write(self.style.SUCCESS(
+            f'Без статистики: {len(missing)}, расхождений: {len(drifted)}'))
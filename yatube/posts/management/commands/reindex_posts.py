@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Строит полнотекстовый индекс постов пачками. '
+            'Прерванный запуск продолжается с непроиндексированных постов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Очистить индекс и построить его заново')
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Полнотекстовый индекс требует SQLite FTS5')
+        table = search.FTS_TABLE
+        with connection.cursor() as cursor:
+            if options['rebuild']:
+                cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(f'DELETE FROM {table} WHERE rowid NOT IN '
+                           f'(SELECT id FROM {Post._meta.db_table})')
+        last_pk = 0
+        indexed = 0
+        while True:
+            pending = search.only_unindexed(
+                Post.objects.filter(pk__gt=last_pk))
+            batch = list(pending.order_by('pk')
+                         .only('pk', 'theme', 'text')
+                         [:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                search.index_posts(batch)
+            last_pk = batch[-1].pk
+            indexed += len(batch)
+            self.stdout.write(f'Проиндексировано {indexed}, '
+                              f'последний id {last_pk}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, добавлено в индекс: {indexed}'))
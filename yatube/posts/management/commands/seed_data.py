@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from posts import seeding
+
+
+class Command(BaseCommand):
+    help = ('Наполняет базу пользователями, группами, постами '
+            'с картинками, комментариями и подписками для замеров. '
+            'Данные зависят только от --seed. Пароль всех созданных '
+            f'пользователей — «{seeding.PASSWORD}».')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=3,
+                            help='Комментариев на пост в среднем')
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок на пользователя')
+        parser.add_argument('--images', type=int, default=20,
+                            help='Разных картинок на все посты')
+        parser.add_argument('--image-share', type=float, default=0.3,
+                            help='Доля постов с картинкой')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        created = seeding.seed(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['follows'], images=options['images'],
+            image_share=options['image_share'], seed=options['seed'])
+        self.stdout.write(self.style.SUCCESS(', '.join(
+            f'{name}: {count}' for name, count in created.items())))
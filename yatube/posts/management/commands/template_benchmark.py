@@ -0,0 +1,91 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core.management.commands.benchmark_views import percentile
+from posts.models import Follow
+
+ENGINES = ('django', 'jinja2')
+# Адрес страницы каждого view из POSTS_TEMPLATE_ENGINES.
+VIEW_URLS = {
+    'index': ('posts:index', None),
+    'group_posts': ('posts:group_list', 'slug'),
+    'profile': ('posts:profile', 'username'),
+    'follow_index': ('posts:follow_index', None),
+    'post_detail': ('posts:post_detail', 'post_id'),
+}
+# Каждый запрос рендерит страницу заново.
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+# Маскированный CSRF-токен у каждого рендера свой.
+CSRF_VALUE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*')
+SERVER_TIMING = re.compile(r'(\w+);dur=([\d.]+)')
+
+
+def same_html(first, second):
+    """Совпадают ли страницы с точностью до CSRF-токена."""
+    return CSRF_VALUE.sub(rb'\1', first) == CSRF_VALUE.sub(rb'\1', second)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает шаблоны Django и Jinja2 страниц лент и поста: '
+            'p50 отрисовки и всего запроса по Server-Timing и совпадение '
+            'HTML. Страницы не кэшируются. Базу заранее наполняет '
+            'seed_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Замеров на страницу и движок')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Запросов перед замерами')
+
+    def handle(self, *args, **options):
+        follow = (Follow.objects.filter(author__posts__group__isnull=False)
+                  .select_related('user', 'author').first())
+        if follow is None:
+            raise CommandError('В базе нет подписок, сначала seed_data')
+        post = (follow.author.posts.filter(group__isnull=False)
+                .select_related('group').order_by('-comments_count').first())
+        kwargs = {'slug': post.group.slug, 'username': post.author.username,
+                  'post_id': post.pk}
+        client = Client()
+        client.force_login(follow.user)
+        with override_settings(
+                DEBUG=False, CACHES=BENCHMARK_CACHES,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                SERVER_TIMING_SAMPLE_RATE=1, SERVER_TIMING_HEADER=True,
+                SERVER_TIMING_LOG=False):
+            self.stdout.write(f'{"view":<14} {"движок":<7} '
+                              f'{"шаблоны":>9} {"запрос":>9} {"HTML":>6}')
+            for view_name, (url_name, argument) in VIEW_URLS.items():
+                url = reverse(url_name, kwargs=(
+                    {argument: kwargs[argument]} if argument else None))
+                self.compare(client, view_name, url, options)
+
+    def compare(self, client, view_name, url, options):
+        contents = {}
+        for engine in ENGINES:
+            engines = {**settings.POSTS_TEMPLATE_ENGINES, view_name: engine}
+            with override_settings(POSTS_TEMPLATE_ENGINES=engines):
+                for _ in range(options['warmup']):
+                    client.get(url)
+                templates, totals = [], []
+                for _ in range(options['requests']):
+                    response = client.get(url)
+                    durations = dict(SERVER_TIMING.findall(
+                        response['Server-Timing']))
+                    templates.append(float(durations['tpl']))
+                    totals.append(float(durations['total']))
+            contents[engine] = response.content
+            same = same_html(contents[ENGINES[0]], response.content)
+            self.stdout.write(
+                f'{view_name:<14} {engine:<7} '
+                f'{percentile(sorted(templates), 50):>7.2f}мс '
+                f'{percentile(sorted(totals), 50):>7.2f}мс '
+                f'{"да" if same else "НЕТ":>6}')
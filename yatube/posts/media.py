@@ -0,0 +1,80 @@
+import logging
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from . import variants
+from .models import MediaFile
+from .storage import is_hashed, post_images
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name, count=1):
+    """Добавляет count ссылок на файл.
+
+    Считаются только файлы с адресацией по содержимому: старые пути
+    могут быть общими с чем угодно, и удалять их нельзя.
+    """
+    if not name or not is_hashed(name):
+        return
+    updated = (MediaFile.objects.filter(name=name)
+               .update(refcount=F('refcount') + count))
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            MediaFile.objects.create(name=name, refcount=count)
+    except IntegrityError:
+        MediaFile.objects.filter(name=name).update(
+            refcount=F('refcount') + count)
+
+
+def release(name):
+    """Убирает ссылку на файл; последняя удаляет его после коммита."""
+    if not name or not is_hashed(name):
+        return
+    released = (MediaFile.objects.filter(name=name, refcount__gt=0)
+                .update(refcount=F('refcount') - 1))
+    if released:
+        transaction.on_commit(lambda: reclaim(name))
+
+
+def replace(previous, current, pinned=None):
+    """Переводит ссылку поста с previous на current.
+
+    pinned — файл, ссылку на который при сохранении уже взяло
+    хранилище: для current она и становится ссылкой поста,
+    в остальных случаях снимается.
+    """
+    if current != previous:
+        if pinned == current:
+            pinned = None
+        else:
+            acquire(current)
+        release(previous)
+    release(pinned)
+
+
+def reclaim(name):
+    """Удаляет файл, его варианты и миниатюры, если ссылок не осталось.
+
+    Запись удаляется условием refcount=0: если кто-то успел снова
+    сослаться на файл, удалять нечего. Файлы удаляются в той же
+    транзакции: acquire того же имени в хранилище дождётся её конца
+    и запишет файл заново.
+    """
+    with transaction.atomic():
+        deleted, _ = MediaFile.objects.filter(name=name,
+                                              refcount=0).delete()
+        if not deleted:
+            return
+        try:
+            default.kvstore.delete(ImageFile(name, default.storage))
+            variants.delete(name)
+            post_images.delete(name)
+        except (OSError, SuspiciousFileOperation):
+            logger.exception('Не удалось удалить файл %s', name)
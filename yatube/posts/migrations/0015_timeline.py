@@ -0,0 +1,74 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:23
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Значения на момент миграции, см. posts/timeline.py.
+FANOUT_FOLLOWERS_LIMIT = 1000
+FANOUT_BATCH_SIZE = 500
+
+
+def fill_timelines(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    PulledAuthor = apps.get_model('posts', 'PulledAuthor')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    crowded = (Follow.objects.values('author')
+               .annotate(followers=models.Count('user'))
+               .filter(followers__gt=FANOUT_FOLLOWERS_LIMIT)
+               .values_list('author', flat=True))
+    PulledAuthor.objects.bulk_create(
+        [PulledAuthor(author_id=author_id) for author_id in crowded])
+    edges = (Post.objects
+             .filter(author__following__isnull=False)
+             .exclude(author__pulled__isnull=False)
+             .values_list('author__following__user', 'id')
+             .iterator())
+    while True:
+        batch = [TimelineEntry(user_id=user_id, post_id=post_id)
+                 for user_id, post_id in islice(edges, FANOUT_BATCH_SIZE)]
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_auto_20221023_1839'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post', verbose_name='Пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Читатель')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.CreateModel(
+            name='PulledAuthor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pulled', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Автор без рассылки',
+                'verbose_name_plural': 'Авторы без рассылки',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:27
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    Post = apps.get_model('posts', 'Post')
+    counts = (Comment.objects.filter(post=models.OuterRef('pk'))
+              .order_by().values('post')
+              .annotate(total=models.Count('pk')).values('total'))
+    Post.objects.update(comments_count=Coalesce(models.Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Поддерживается сигналами Comment', verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+COUNTERS = {
+    'followers_count': ('Follow', 'author'),
+    'followings_count': ('Follow', 'user'),
+    'posts_count': ('Post', 'author'),
+    'comments_count': ('Comment', 'author'),
+}
+
+
+def fill_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk)
+         for pk in User.objects.values_list('pk', flat=True)],
+        batch_size=500)
+    actual = {}
+    for field, (model_name, owner) in COUNTERS.items():
+        model = apps.get_model('posts', model_name)
+        counts = (model.objects.filter(**{owner: models.OuterRef('user')})
+                  .order_by().values(owner)
+                  .annotate(total=models.Count('pk')).values('total'))
+        actual[field] = Coalesce(models.Subquery(counts), 0)
+    UserStats.objects.update(**actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0016_post_comments_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('followings_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Постов')),
+                ('comments_count', models.PositiveIntegerField(default=0, verbose_name='Комментариев')),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя',
+                'verbose_name_plural': 'Статистика пользователей',
+            },
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
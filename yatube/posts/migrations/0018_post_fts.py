@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# Схема на момент миграции, см. posts/search.py.
+CREATE_SQL = ('CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts '
+              'USING fts5(theme, text, tokenize="unicode61")')
+DROP_SQL = 'DROP TABLE IF EXISTS posts_post_fts'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_SQL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_userstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
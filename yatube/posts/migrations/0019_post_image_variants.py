@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.CharField(blank=True, editable=False, help_text='Форматы и ширины, см. posts.variants', max_length=100, verbose_name='Варианты картинки'),
+        ),
+    ]
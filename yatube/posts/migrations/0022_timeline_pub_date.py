@@ -0,0 +1,33 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def copy_pub_dates(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    pub_date = Post.objects.filter(pk=models.OuterRef('post')).values(
+        'pub_date')
+    TimelineEntry.objects.update(pub_date=models.Subquery(pub_date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата публикации'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_pub_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_pub_date_idx'),
+        ),
+    ]
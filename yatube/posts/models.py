@@ -1,9 +1,15 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models.functions import Coalesce
+
+from .storage import PinnedImageFieldFile, post_images
 
 User = get_user_model()
 
 MAX_LENGHT_OF_POST_STR = 15
+POST_COUNTER_FIELDS = ('comments_count',)
+# Пишутся только сигналами, Post.save их не перезаписывает.
+POST_DERIVED_FIELDS = POST_COUNTER_FIELDS + ('image_variants',)
 
 
 class Post(models.Model):
@@ -18,11 +24,13 @@ class Post(models.Model):
                                     verbose_name='Дата публикации',
                                     help_text='Дата публикации поста',
                                     db_index=True)
+    # Индексы по автору и группе — составные, см. Meta.indexes.
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
         on_delete=models.CASCADE,
         related_name='posts',
+        db_index=False,
     )
     group = models.ForeignKey(
         'Group',
@@ -31,17 +39,52 @@ class Post(models.Model):
         blank=True,
         null=True,
         related_name='posts',
-        help_text='Группа, к которой будет относиться пост')
-    image = models.ImageField('Картинка', upload_to='posts/', blank=True)
+        help_text='Группа, к которой будет относиться пост',
+        db_index=False)
+    image = models.ImageField('Картинка', upload_to='posts/', blank=True,
+                              storage=post_images, db_index=True)
+    # Класс поля остаётся ImageField, меняется только класс файла.
+    image.attr_class = PinnedImageFieldFile
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        help_text='Поддерживается сигналами Comment',
+        default=0,
+        editable=False)
+    image_variants = models.CharField(
+        verbose_name='Варианты картинки',
+        help_text='Форматы и ширины, см. posts.variants',
+        max_length=100,
+        blank=True,
+        editable=False)
 
     class Meta:
         ordering = ('-pub_date',)
+        # Ленты группы и автора: фильтр и сортировка по одному индексу.
+        # id в SQLite и так замыкает любой индекс (rowid), поэтому
+        # индекс, пройденный в обратную сторону, даёт и порядок
+        # курсорной пагинации (-pub_date, -id).
+        indexes = [
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
     def __str__(self):
         return f'Post{self.text[:MAX_LENGHT_OF_POST_STR]}'
 
+    def save(self, *args, **kwargs):
+        """Не перезаписывает поля, которые ведут сигналы."""
+        if not self._state.adding and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in POST_DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200,
@@ -72,7 +115,8 @@ class Comment(models.Model):
                              on_delete=models.CASCADE,
                              related_name="comments",
                              null=True,
-                             blank=True)
+                             blank=True,
+                             db_index=False)
     created = models.DateTimeField(verbose_name="Дата публикации",
                                    auto_now_add=True)
 
@@ -81,6 +125,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
         verbose_name = 'комментарий'
         verbose_name_plural = 'комментарии'
 
@@ -93,7 +141,8 @@ class Follow(models.Model):
     author = models.ForeignKey(User,
                                verbose_name='На кого подписываются',
                                related_name='following',
-                               on_delete=models.CASCADE)
+                               on_delete=models.CASCADE,
+                               db_index=False)
 
     def __str__(self):
         return self.user
@@ -103,5 +152,141 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_follow')
         ]
+        # Подписчики автора читаются только из индекса.
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(User,
+                             verbose_name='Читатель',
+                             related_name='timeline',
+                             on_delete=models.CASCADE)
+    post = models.ForeignKey(Post,
+                             verbose_name='Пост',
+                             related_name='timeline_entries',
+                             on_delete=models.CASCADE)
+    # Копия Post.pub_date: страница ленты читается из индекса
+    # без соединения с постами и сортировки.
+    pub_date = models.DateTimeField('Дата публикации')
+
+    def __str__(self):
+        return f'{self.user_id}:{self.post_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_entry')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+
+class PulledAuthor(models.Model):
+    """Автор со слишком большим числом подписчиков.
+
+    Его посты не раскладываются по лентам при публикации,
+    а подмешиваются в ленту подписок при чтении.
+    """
+    author = models.OneToOneField(User,
+                                  verbose_name='Автор',
+                                  related_name='pulled',
+                                  on_delete=models.CASCADE)
+
+    def __str__(self):
+        return str(self.author)
+
+    class Meta:
+        verbose_name = 'Автор без рассылки'
+        verbose_name_plural = 'Авторы без рассылки'
+
+
+class MediaFile(models.Model):
+    """Файл в хранилище с адресацией по содержимому и число ссылок на него.
+
+    Поддерживается сигналами Post. Файлы без записи (по старым путям,
+    до migrate_media_paths) никогда не удаляются автоматически.
+    """
+    name = models.CharField('Путь в хранилище', max_length=255, unique=True)
+    refcount = models.PositiveIntegerField('Ссылок', default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+
+USER_STATS_COUNTERS = {
+    'followers_count': (Follow, 'author'),
+    'followings_count': (Follow, 'user'),
+    'posts_count': (Post, 'author'),
+    'comments_count': (Comment, 'author'),
+}
+
+
+class UserStatsQuerySet(models.QuerySet):
+
+    @staticmethod
+    def actual(field):
+        """Выражение с фактическим значением счётчика field."""
+        model, owner = USER_STATS_COUNTERS[field]
+        counts = (model.objects.filter(**{owner: models.OuterRef('user')})
+                  .order_by().values(owner)
+                  .annotate(total=models.Count('pk')).values('total'))
+        return Coalesce(models.Subquery(counts), 0)
+
+    def with_actual(self):
+        return self.annotate(**{
+            f'actual_{field}': self.actual(field)
+            for field in USER_STATS_COUNTERS
+        })
+
+    def drifted(self):
+        mismatch = models.Q()
+        for field in USER_STATS_COUNTERS:
+            mismatch |= ~models.Q(**{field: models.F(f'actual_{field}')})
+        return self.with_actual().filter(mismatch)
+
+    def recount(self):
+        return self.update(**{
+            field: self.actual(field) for field in USER_STATS_COUNTERS
+        })
+
+    def rebuild_for(self, user):
+        """Создаёт или пересчитывает статистику одного пользователя."""
+        self.get_or_create(user=user)
+        self.filter(user=user).recount()
+        return self.get(user=user)
+
+
+class UserStats(models.Model):
+    """Счётчики профиля, обновляются сигналами через F()."""
+    user = models.OneToOneField(User,
+                                verbose_name='Пользователь',
+                                related_name='stats',
+                                primary_key=True,
+                                on_delete=models.CASCADE)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    followings_count = models.PositiveIntegerField('Подписок', default=0)
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+
+    objects = UserStatsQuerySet.as_manager()
+
+    def __str__(self):
+        return str(self.user_id)
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
@@ -0,0 +1,124 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return f'd{value.isoformat()}'
+    return f'f{value!r}'
+
+
+def _load(raw):
+    kind, value = raw[:1], raw[1:]
+    if kind == 'd':
+        return parse_datetime(value)
+    if kind == 'f':
+        return float(value)
+    return None
+
+
+def encode_cursor(direction, value, pk):
+    """Упаковывает позицию (значение ключа, id) в непрозрачную строку.
+
+    Ключом может быть дата или число (например, ранг поиска).
+    """
+    raw = f'{direction}|{_dump(value)}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор. Для битого или пустого курсора — None."""
+    if not cursor:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+        direction, value, pk = raw.split('|')
+        value = _load(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or value is None:
+        return None
+    return direction, value, pk
+
+
+class CursorPaginator(Paginator):
+    """Пагинация по ключу (field, id), по умолчанию по убыванию.
+
+    Не выполняет COUNT и OFFSET: каждая страница — один запрос
+    с условием по границе соседней страницы и LIMIT per_page + 1.
+    Возвращает обычный Page; номер страницы и num_pages лишь
+    отражают наличие соседей, а ссылки на них лежат в next_cursor
+    и previous_cursor.
+    """
+    cursor_based = True
+
+    def __init__(self, object_list, per_page, field='pub_date',
+                 descending=True):
+        self.field = field
+        self.descending = descending
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._num_pages = 1
+        super().__init__(object_list, per_page)
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    def _ordered(self, backwards=False):
+        sign = '-' if self.descending != backwards else ''
+        return self.object_list.order_by(f'{sign}{self.field}', f'{sign}id')
+
+    def _beyond(self, value, pk, backwards=False):
+        lookup = 'lt' if self.descending != backwards else 'gt'
+        return (Q(**{f'{self.field}__{lookup}': value})
+                | Q(**{self.field: value, f'pk__{lookup}': pk}))
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(direction, getattr(obj, self.field), obj.pk)
+
+    def _page(self, rows, has_next, has_previous):
+        number = 2 if has_previous else 1
+        self._num_pages = number + 1 if has_next else number
+        self.next_cursor = self._cursor(NEXT, rows[-1]) if has_next else None
+        self.previous_cursor = (self._cursor(PREVIOUS, rows[0])
+                                if has_previous else None)
+        return Page(rows, number, self)
+
+    def _rows(self, limit, position=None, backwards=False):
+        """До limit объектов за позицией (value, pk) в порядке обхода."""
+        queryset = self._ordered(backwards)
+        if position is not None:
+            queryset = queryset.filter(self._beyond(*position, backwards))
+        return list(queryset[:limit])
+
+    def first_page(self):
+        rows = self._rows(self.per_page + 1)
+        return self._page(rows[:self.per_page],
+                          has_next=len(rows) > self.per_page,
+                          has_previous=False)
+
+    def get_page(self, cursor):
+        position = decode_cursor(cursor)
+        if position is None:
+            return self.first_page()
+        direction, value, pk = position
+        backwards = direction == PREVIOUS
+        rows = self._rows(self.per_page + 1, (value, pk), backwards)
+        if not rows:
+            return self.first_page()
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == NEXT:
+            return self._page(rows, has_next=more, has_previous=True)
+        return self._page(rows[::-1], has_next=True, has_previous=more)
@@ -0,0 +1,89 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+MAX_TERMS = 10
+
+WORD = re.compile(r'\w+')
+
+
+def is_available():
+    """Полнотекстовый индекс есть только в SQLite (FTS5)."""
+    return connection.vendor == 'sqlite'
+
+
+def build_match(query):
+    """Превращает ввод пользователя в безопасное выражение MATCH.
+
+    Каждое слово ищется как префикс, слова объединяются через AND.
+    Пустая строка — если слов нет.
+    """
+    terms = WORD.findall(query.lower())[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index_posts(posts):
+    """Добавляет или обновляет посты в индексе."""
+    if not is_available():
+        return
+    rows = [(post.pk, post.theme, post.text) for post in posts]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(pk,) for pk, _, _ in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, theme, text) '
+            f'VALUES (%s, %s, %s)', rows)
+
+
+def unindex_posts(post_ids):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(pk,) for pk in post_ids])
+
+
+def only_matching(queryset, match):
+    """Оставляет в queryset постов только подходящие под MATCH."""
+    return queryset.extra(
+        where=[f'{Post._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+               f'WHERE {FTS_TABLE} MATCH %s)'],
+        params=[match])
+
+
+def only_unindexed(queryset):
+    """Оставляет в queryset постов только отсутствующие в индексе."""
+    return queryset.extra(
+        where=[f'{Post._meta.db_table}.id NOT IN '
+               f'(SELECT rowid FROM {FTS_TABLE})'])
+
+
+def search(query, queryset=None):
+    """Посты, подходящие под запрос, с рангом в поле rank.
+
+    Чем меньше rank, тем выше пост в выдаче (bm25 во FTS5).
+    Без FTS5 ищет через LIKE, а rank у всех постов одинаковый.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    match = build_match(query)
+    no_rank = RawSQL('0.0', (), output_field=FloatField())
+    if not match:
+        return queryset.none().annotate(rank=no_rank)
+    if not is_available():
+        words = Q()
+        for term in WORD.findall(query)[:MAX_TERMS]:
+            words &= Q(text__icontains=term) | Q(theme__icontains=term)
+        return queryset.filter(words).annotate(rank=no_rank)
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {Post._meta.db_table}.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+    ).annotate(rank=RawSQL(f'{FTS_TABLE}.rank', (),
+                           output_field=FloatField()))
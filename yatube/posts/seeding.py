@@ -0,0 +1,143 @@
+"""Наполнение базы данными для замеров производительности.
+
+Всё пишется пачками через bulk_create, поэтому сигналы не работают:
+счётчики, статистика, ленты подписок, поисковый индекс и ссылки
+на файлы достраиваются после вставки теми же функциями и командами,
+что чинят их в рабочей базе.
+"""
+import io
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from . import timeline
+from .models import (Comment, Follow, Group, MediaFile, Post, PulledAuthor,
+                     User)
+from .storage import post_images
+
+BATCH_SIZE = 500
+# Пароль всех созданных пользователей: под ними можно войти.
+PASSWORD = 'benchmark'
+# За сколько дней до сейчас разбросаны даты постов.
+HISTORY_DAYS = 365
+IMAGE_SIZE = (1200, 800)
+# Имя при загрузке; хранилище всё равно назовёт файл по содержимому.
+IMAGE_NAME = 'posts/seed.jpg'
+
+
+def make_image(generator):
+    """JPEG одного случайного цвета с полосой: файлы различаются."""
+    color = tuple(generator.randrange(256) for _ in range(3))
+    image = Image.new('RGB', IMAGE_SIZE, color)
+    stripe = generator.randrange(IMAGE_SIZE[1])
+    image.paste((255, 255, 255), (0, stripe, IMAGE_SIZE[0], stripe + 20))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return ContentFile(buffer.getvalue())
+
+
+def seed(users=100, groups=10, posts=2000, comments=3, follows=10,
+         images=20, image_share=0.3, seed=0):
+    """Создаёт данные и возвращает число созданных объектов по видам.
+
+    comments — комментариев на пост в среднем, follows — подписок
+    на пользователя, images — разных картинок на все посты,
+    image_share — доля постов с картинкой.
+    """
+    generator = random.Random(seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    now = timezone.now()
+    first_user = User.objects.count()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        (User(username=f'{fake.user_name()}{first_user + number}',
+              first_name=fake.first_name(), last_name=fake.last_name(),
+              password=password)
+         for number in range(users)), batch_size=BATCH_SIZE)
+    first_group = Group.objects.count()
+    Group.objects.bulk_create(
+        (Group(title=fake.sentence(nb_words=3)[:200],
+               slug=f'group-{first_group + number}',
+               description=fake.paragraph())
+         for number in range(groups)), batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    group_ids = list(Group.objects.values_list('pk', flat=True))
+    image_names = [post_images.save(IMAGE_NAME, make_image(generator))
+                   for _ in range(images)]
+
+    def image_name():
+        if image_names and generator.random() < image_share:
+            return generator.choice(image_names)
+        return ''
+
+    last_post = Post.objects.order_by('-pk').values_list('pk', flat=True)
+    last_post = last_post.first() or 0
+    Post.objects.bulk_create(
+        (Post(author_id=generator.choice(user_ids),
+              group_id=generator.choice(group_ids + [None]),
+              theme=fake.sentence(nb_words=4)[:50],
+              text=fake.text(max_nb_chars=600),
+              image=image_name())
+         for _ in range(posts)), batch_size=BATCH_SIZE)
+    # auto_now_add не даёт задать даты при вставке.
+    new_posts = list(Post.objects.filter(pk__gt=last_post).only('pk'))
+    for post in new_posts:
+        post.pub_date = now - timedelta(
+            seconds=generator.randrange(HISTORY_DAYS * 24 * 3600))
+    Post.objects.bulk_update(new_posts, ['pub_date'],
+                             batch_size=BATCH_SIZE)
+    post_ids = [post.pk for post in new_posts]
+    Comment.objects.bulk_create(
+        (Comment(post_id=generator.choice(post_ids),
+                 author_id=generator.choice(user_ids),
+                 text=fake.sentence(nb_words=12))
+         for _ in range(len(post_ids) * comments)), batch_size=BATCH_SIZE)
+    edges = {
+        (user, author) for user in user_ids
+        for author in generator.sample(user_ids,
+                                       min(follows, len(user_ids)))
+        if user != author
+    }
+    Follow.objects.bulk_create(
+        (Follow(user_id=user, author_id=author) for user, author in edges),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+    with transaction.atomic():
+        materialize_timelines({author for _, author in edges})
+        count_media()
+    for command in ('rebuild_comment_counts', 'rebuild_user_stats',
+                    'reindex_posts'):
+        call_command(command, stdout=io.StringIO())
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return {'users': users, 'groups': groups, 'posts': posts,
+            'comments': len(post_ids) * comments, 'follows': len(edges),
+            'images': len(image_names)}
+
+
+def materialize_timelines(authors):
+    """Ленты подписок так, как их разложили бы сигналы Follow."""
+    for author_id in authors:
+        followers = Follow.objects.filter(author_id=author_id).count()
+        if followers > timeline.FANOUT_FOLLOWERS_LIMIT:
+            PulledAuthor.objects.get_or_create(author_id=author_id)
+        else:
+            timeline.fan_out_author(author_id)
+
+
+def count_media():
+    """Число ссылок на файлы картинок, как его ведёт posts.media."""
+    counts = Counter(Post.objects.exclude(image='')
+                     .values_list('image', flat=True))
+    for name, refcount in counts.items():
+        MediaFile.objects.update_or_create(
+            name=name, defaults={'refcount': refcount})
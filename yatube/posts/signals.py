@@ -0,0 +1,159 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, media, search, thumbnails, timeline, variants
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def shift_counter(queryset, field, delta):
+    """Атомарно сдвигает счётчик, не опуская его ниже нуля."""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def shift_stats(user_id, field, delta):
+    shift_counter(UserStats.objects.filter(pk=user_id), field, delta)
+
+
+# Поля пользователя, которые видны на страницах.
+USER_NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, update_fields=None, **kwargs):
+    """Запоминает имена пользователя до сохранения.
+
+    Сохранения без этих полей (last_login при входе) пропускаются.
+    """
+    instance._previous_names = None
+    if instance.pk is None or (update_fields is not None and not set(
+            update_fields) & set(USER_NAME_FIELDS)):
+        return
+    instance._previous_names = (User.objects.filter(pk=instance.pk)
+                                .values_list(*USER_NAME_FIELDS).first())
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    previous = getattr(instance, '_previous_names', None)
+    names = tuple(getattr(instance, field) for field in USER_NAME_FIELDS)
+    if previous is not None and previous != names:
+        caching.bump(*caching.user_scopes(instance),
+                     caching.PROFILE.format(username=previous[0]))
+        if previous[0] != instance.username:
+            caching.forget_post_authors(
+                instance.posts.order_by().values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, **kwargs):
+    """Запоминает группу и картинку поста до сохранения."""
+    instance._previous_group_slug = None
+    instance._previous_image = ''
+    if instance.pk is not None:
+        instance._previous_group_slug, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group__slug', 'image').first() or (None, ''))
+
+
+@receiver(post_save, sender=Post)
+def post_published(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+        shift_stats(instance.author_id, 'posts_count', 1)
+    search.index_posts([instance])
+    previous_image = getattr(instance, '_previous_image', '')
+    pinned = instance.__dict__.pop('_pinned_image', None)
+    if instance.image.name != previous_image:
+        variants.refresh(instance)
+    if instance.image.name != previous_image or pinned:
+        media.replace(previous_image, instance.image.name, pinned)
+    if instance.image and not instance.image_variants:
+        name = instance.image.name
+        transaction.on_commit(lambda: thumbnails.schedule(name))
+    scopes = caching.post_scopes(instance)
+    previous_slug = getattr(instance, '_previous_group_slug', None)
+    if previous_slug is not None:
+        scopes.append(caching.GROUP.format(slug=previous_slug))
+    caching.bump(*scopes)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    shift_stats(instance.author_id, 'posts_count', -1)
+    search.unindex_posts([instance.pk])
+    media.release(instance.image.name)
+    caching.bump(*caching.post_scopes(instance))
+    caching.forget_post_authors([instance.pk])
+
+
+def comment_changed(comment):
+    post = (Post.objects.select_related('author', 'group')
+            .filter(pk=comment.post_id).first())
+    if post is not None:
+        caching.bump(*caching.post_scopes(post))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(Post.objects.filter(pk=instance.post_id),
+                      'comments_count', 1)
+        shift_stats(instance.author_id, 'comments_count', 1)
+    comment_changed(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    shift_counter(Post.objects.filter(pk=instance.post_id),
+                  'comments_count', -1)
+    shift_stats(instance.author_id, 'comments_count', -1)
+    comment_changed(instance)
+
+
+@receiver(pre_save, sender=Group)
+def group_changing(sender, instance, **kwargs):
+    """Запоминает адрес группы до сохранения."""
+    instance._previous_slug = None
+    if instance.pk is not None:
+        instance._previous_slug = (Group.objects.filter(pk=instance.pk)
+                                   .values_list('slug', flat=True).first())
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance, created, **kwargs):
+    if created:
+        caching.bump(caching.GROUP.format(slug=instance.slug))
+        return
+    scopes = caching.group_scopes(instance)
+    previous_slug = getattr(instance, '_previous_slug', None)
+    if previous_slug is not None:
+        scopes.append(caching.GROUP.format(slug=previous_slug))
+    caching.bump(*scopes)
+
+
+def follow_scopes(follow):
+    return (caching.PROFILE.format(username=follow.user.username),
+            caching.PROFILE.format(username=follow.author.username))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.on_follow(instance.user_id, instance.author_id)
+        shift_stats(instance.author_id, 'followers_count', 1)
+        shift_stats(instance.user_id, 'followings_count', 1)
+    caching.bump(*follow_scopes(instance))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.on_unfollow(instance.user_id, instance.author_id)
+    shift_stats(instance.author_id, 'followers_count', -1)
+    shift_stats(instance.user_id, 'followings_count', -1)
+    caching.bump(*follow_scopes(instance))
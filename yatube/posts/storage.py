@@ -0,0 +1,104 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models.fields.files import ImageFieldFile
+
+from core import metrics
+
+# Уровней вложенности и символов хэша на уровень: posts/3f/a2/3fa2….jpg
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+HASHED_NAME = re.compile(r'(^|/)([0-9a-f]{2}/){%d}[0-9a-f]{64}(\.\w+)?$'
+                         % SHARD_DEPTH)
+
+
+def is_hashed(name):
+    """Лежит ли файл уже по адресу своего содержимого."""
+    return bool(HASHED_NAME.search(name))
+
+
+def hashed_name(folder, digest, ext):
+    shards = [digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+              for level in range(SHARD_DEPTH)]
+    return posixpath.join(folder, *shards, f'{digest}{ext}')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы называются sha256 содержимого и раскладываются по шардам.
+
+    От имени загрузки остаются только папка (upload_to) и расширение.
+    Одинаковые загрузки дают одно имя и один файл на диске, поэтому
+    удалять файл можно, только когда на него не осталось ссылок
+    (posts.media). Ссылку на сохранённый файл берёт само хранилище,
+    её забирает себе пост, см. PinnedImageFieldFile.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Имя всё равно выбирает _save по содержимому.
+        return name
+
+    def _digest(self, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _save(self, name, content):
+        metrics.UPLOAD_SIZE.observe(content.size)
+        folder, filename = posixpath.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = hashed_name(folder, self._digest(content), ext)
+        # media импортирует это хранилище.
+        from . import media
+        # Ссылка берётся до проверки: иначе файл, с которого только что
+        # сняли последнюю ссылку, может удалить reclaim уже после того,
+        # как здесь решили его не записывать.
+        media.acquire(name)
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        # Пишем во временный файл и переименовываем: параллельная
+        # загрузка того же содержимого получит тот же файл целиком.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    temp.write(chunk)
+            # mkstemp создаёт файл с правами 0600.
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            media.release(name)
+            raise
+        return name
+
+
+class PinnedImageFieldFile(ImageFieldFile):
+    """Отмечает у модели, что ссылку на новый файл взяло хранилище.
+
+    Сигнал post_save отдаёт эту ссылку посту вместо новой,
+    см. posts.media.replace.
+    """
+
+    def save(self, name, content, save=True):
+        super().save(name, content, save=False)
+        self.instance._pinned_image = self.name
+        if save:
+            self.instance.save()
+
+
+post_images = ContentAddressedStorage()
@@ -0,0 +1,19 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import fragments
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def fragment(context, name, **kwargs):
+    """Часть страницы, зависящая от пользователя.
+
+    В общей странице из кэша — метка, которую заполнит
+    fragments.fill, в остальных — сразу отрендеренный фрагмент.
+    """
+    request = context.get('request')
+    if request is not None and fragments.is_shared(request):
+        return mark_safe(fragments.marker(name, **kwargs))
+    return mark_safe(fragments.render(request, name, **kwargs))
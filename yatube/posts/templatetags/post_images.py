@@ -0,0 +1,30 @@
+from django import template
+
+from posts import thumbnails, variants
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(image, kind):
+    """Готовая миниатюра картинки поста или None.
+
+    Картинку не декодирует: недостающие миниатюры ставятся
+    в очередь воркеров, а шаблон пока показывает оригинал.
+    Если view уже вызвал thumbnails.prefetch, хранилище не трогает.
+    """
+    if not image:
+        return None
+    found, thumbnail = thumbnails.prefetched(image, kind)
+    if not found:
+        thumbnail = thumbnails.lookup(image, kind)
+    if thumbnail is None:
+        thumbnails.schedule(image.name)
+    return thumbnail
+
+
+@register.inclusion_tag('includes/picture.html')
+def picture(image):
+    """<picture> с вариантами картинки поста разной ширины и формата."""
+    sources, src = variants.srcsets(image, image.instance.image_variants)
+    return {'sources': sources, 'src': src, 'sizes': variants.SIZES}
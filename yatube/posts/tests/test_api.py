@@ -0,0 +1,119 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .. import api
+from ..models import Comment, Follow, Group, Post, User
+
+POSTS_COUNT = 15
+
+
+class ApiTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Writer')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(title='Котики', slug='cats',
+                                         description='Про котиков')
+        cls.posts = [
+            Post.objects.create(text=f'Пост {number}', author=cls.author,
+                                group=cls.group if number % 2 else None)
+            for number in range(POSTS_COUNT)
+        ]
+        cls.post = cls.posts[-1]
+        for number in range(3):
+            Comment.objects.create(post=cls.post, author=cls.reader,
+                                   text=f'Комментарий {number}')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client_reader = Client()
+        self.client_reader.force_login(self.reader)
+
+    def get(self, name, params=None, client=None, **kwargs):
+        response = (client or self.client).get(
+            reverse(f'api:{name}', kwargs=kwargs), params or {})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response
+
+    def test_feed_walks_by_cursor(self):
+        """Лента листается курсорами без пропусков и повторов"""
+        ids = []
+        params = {'limit': 4}
+        while True:
+            data = self.get('posts', params).json()
+            ids += [post['id'] for post in data['results']]
+            if data['next'] is None:
+                break
+            params['cursor'] = data['next']
+        self.assertEqual(ids, [post.pk for post in reversed(self.posts)])
+
+    def test_limit_is_bounded(self):
+        """Размер страницы ограничен сверху и снизу"""
+        self.assertEqual(len(self.get('posts', {'limit': 0})
+                             .json()['results']), 1)
+        self.assertEqual(len(self.get('posts', {'limit': 'x'})
+                             .json()['results']), api.DEFAULT_LIMIT)
+        for number in range(api.MAX_LIMIT):
+            Post.objects.create(text='Ещё', author=self.reader)
+        self.assertEqual(len(self.get('posts', {'limit': 1000})
+                             .json()['results']), api.MAX_LIMIT)
+
+    def test_group_and_author_feeds(self):
+        """Ленты группы и автора отфильтрованы, неизвестные — 404"""
+        data = self.get('group_posts', slug='cats').json()
+        self.assertEqual(data['group']['title'], 'Котики')
+        self.assertTrue(all(post['group'] == 'cats'
+                            for post in data['results']))
+        data = self.get('author_posts', username='Writer').json()
+        self.assertEqual(data['results'][0]['author'], 'Writer')
+        self.assertEqual(self.get('group_posts', slug='dogs').status_code,
+                         404)
+        self.assertEqual(
+            self.get('author_posts', username='Nobody').status_code, 404)
+
+    def test_post_detail_and_comments(self):
+        """Пост и его комментарии в порядке написания"""
+        data = self.get('post_detail', post_id=self.post.pk).json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertEqual(data['comments_count'], 3)
+        data = self.get('comments', {'limit': 2},
+                        post_id=self.post.pk).json()
+        self.assertEqual([comment['text'] for comment in data['results']],
+                         ['Комментарий 0', 'Комментарий 1'])
+        data = self.get('comments', {'cursor': data['next']},
+                        post_id=self.post.pk).json()
+        self.assertEqual([comment['text'] for comment in data['results']],
+                         ['Комментарий 2'])
+        self.assertEqual(self.get('comments', post_id=0).status_code, 404)
+
+    def test_follow_feed_requires_login(self):
+        """Лента подписок только для авторизованных"""
+        self.assertEqual(self.get('follow_posts').status_code, 401)
+        data = self.get('follow_posts', client=self.client_reader).json()
+        self.assertEqual(len(data['results']), api.DEFAULT_LIMIT)
+
+    def test_etag_not_modified(self):
+        """Повтор с ETag получает 304 без запросов, правка меняет ETag"""
+        url = reverse('api:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Ещё один')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['comments_count'], 4)
+        url = reverse('api:follow_posts')
+        etag = self.client_reader.get(url)['ETag']
+        self.assertEqual(self.client_reader.get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_read_only(self):
+        """Изменять данные через API нельзя"""
+        response = self.client.post(reverse('api:posts'), {'text': 'x'})
+        self.assertEqual(response.status_code, 405)
@@ -1,15 +1,21 @@
 import shutil
 import tempfile
+from hashlib import sha256
 from http import HTTPStatus
+from io import BytesIO
 
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from .. import variants
 from ..forms import PostForm
 from ..models import Comment, Group, Post, User
+from ..storage import hashed_name
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -73,7 +79,38 @@ class PostFormsTests(TestCase):
         self.assertEqual(post.group, self.group)
         self.assertEqual(post.text, form_data["text"])
         self.assertEqual(post.author, self.user)
-        self.assertTrue(Post.objects.filter(image='posts/small.gif').exists())
+        stored = hashed_name('posts', sha256(small_gif).hexdigest(), '.gif')
+        self.assertEqual(post.image.name, stored)
+
+    def test_create_post_form_builds_variants(self):
+        """Загрузка картинки создаёт варианты по ширинам без EXIF"""
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера автора'
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 500), 'blue').save(buffer, 'JPEG',
+                                                   exif=exif.tobytes())
+        uploaded = SimpleUploadedFile(name='photo.jpg',
+                                      content=buffer.getvalue(),
+                                      content_type='image/jpeg')
+        self.authorized_client.post(reverse('posts:post_create'),
+                                    data={'text': 'С фото', 'image': uploaded})
+        post = Post.objects.get(text='С фото')
+        exts, widths = variants.parse(post.image_variants)
+        self.assertEqual(widths, [320, 640, 960, 1000])
+        self.assertIn('jpg', exts)
+        for width in widths:
+            name = variants.variant_name(post.image.name, width, 'jpg')
+            with self.subTest(width=width), default_storage.open(name) as f:
+                variant = Image.open(f)
+                self.assertEqual(variant.width, width)
+                self.assertNotIn('exif', variant.info)
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+        urls = [settings.MEDIA_URL + variants.variant_name(
+            post.image.name, width, 'jpg') for width in widths]
+        srcset = ', '.join(
+            f'{url} {width}w' for url, width in zip(urls, widths))
+        self.assertContains(response, f'srcset="{srcset}"')
 
     def test_create_post_form_status_code(self):
         """Проверка статус кодов для формы поста"""
@@ -145,3 +182,25 @@ class PostFormsTests(TestCase):
                                        kwargs={'post_id': self.post.id}),
                                data=comment_data)
         self.assertEqual(comments_count, 0)
+
+    def test_comments_count_follows_add_and_delete(self):
+        """Счётчик комментариев растёт и убывает вместе с ними"""
+        self.authorized_client.post(reverse('posts:add_comment',
+                                            kwargs={'post_id': self.post.id}),
+                                    data={'text': 'Считай меня'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        comment = Comment.objects.get(text='Считай меня')
+        self.authorized_client.get(reverse('posts:comment_delete',
+                                           kwargs={'comment_id': comment.id}))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_post_edit_keeps_comments_count(self):
+        """Редактирование поста не затирает счётчик комментариев"""
+        stale_post = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author=self.user, text='Раз')
+        stale_post.text = 'Правка'
+        stale_post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
@@ -1,7 +1,26 @@
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.core.cache import cache
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from sorl.thumbnail import default
 
-from ..models import Group, Post, User
+from .. import caching, search, seeding, thumbnails
+from ..kvstore import LRUCache
+from ..management.commands.explain_queries import problems
+from ..models import (Comment, Follow, Group, MediaFile, Post,
+                      TimelineEntry, User, UserStats)
+from ..storage import is_hashed, post_images
 
 
 class PostModelTest(TestCase):
@@ -58,3 +77,283 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     test_field._meta.get_field(field).help_text,
                     expected_value)
+
+    def test_rebuild_comment_counts_fixes_drift(self):
+        """Команда rebuild_comment_counts находит и чинит расхождения"""
+        Comment.objects.create(post=self.post, author=self.user, text='1')
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5)
+        out = StringIO()
+        call_command('rebuild_comment_counts', '--dry-run', stdout=out)
+        self.assertIn(f'Пост {self.post.pk}: 5 -> 1', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 5)
+        call_command('rebuild_comment_counts', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_rebuild_user_stats_fixes_drift(self):
+        """Команда rebuild_user_stats создаёт и чинит статистику"""
+        UserStats.objects.filter(user=self.user).update(posts_count=7)
+        lost = User.objects.create_user(username='lost')
+        Post.objects.create(author=lost, text='Пост без статистики')
+        UserStats.objects.filter(user=lost).delete()
+        out = StringIO()
+        call_command('rebuild_user_stats', stdout=out)
+        self.assertIn('posts_count 7 -> 1', out.getvalue())
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 1)
+        self.assertEqual(UserStats.objects.get(user=lost).posts_count, 1)
+
+    def test_reindex_posts_resumes(self):
+        """reindex_posts дописывает в индекс только недостающие посты"""
+        posts = Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пакетный пост {number}')
+            for number in range(5))
+        match = search.build_match('пакетный')
+        self.assertFalse(
+            search.only_matching(Post.objects.all(), match).exists())
+        out = StringIO()
+        call_command('reindex_posts', '--batch-size', '2', stdout=out)
+        self.assertIn('добавлено в индекс: 5', out.getvalue())
+        self.assertEqual(
+            search.only_matching(Post.objects.all(), match).count(),
+            len(posts))
+        call_command('reindex_posts', stdout=out)
+        self.assertIn('добавлено в индекс: 0', out.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {search.FTS_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], Post.objects.count())
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='painter')
+        self.post = self.create_post('red')
+        default.kvstore.lru.clear()
+        cache.clear()
+
+    def create_post(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+        post = Post(author=self.user, text='Пост с картинкой')
+        post.image.save(f'{color}.jpg', ContentFile(buffer.getvalue()),
+                        save=False)
+        Post.objects.bulk_create([post])
+        return post
+
+    def test_build_creates_all_geometries(self):
+        """lookup не генерирует миниатюру, build создаёт все размеры"""
+        name = self.post.image.name
+        for kind in thumbnails.GEOMETRIES:
+            self.assertIsNone(thumbnails.lookup(name, kind))
+        self.assertTrue(thumbnails.build(name))
+        for kind in thumbnails.GEOMETRIES:
+            with self.subTest(kind=kind):
+                self.assertIsNotNone(thumbnails.lookup(name, kind))
+        self.assertTrue(thumbnails.is_built(name))
+
+    def test_build_invalidates_post_pages(self):
+        """Готовые миниатюры сбрасывают страницы с картинкой"""
+        post = Post.objects.get(image=self.post.image.name)
+        scope = caching.POST.format(post_id=post.pk)
+        before, _ = caching.get_versions([scope])
+        thumbnails.build(self.post.image.name)
+        after, _ = caching.get_versions([scope])
+        self.assertNotEqual(after, before)
+
+    def test_prebuild_thumbnails_skips_ready(self):
+        """prebuild_thumbnails создаёт недостающее и пропускает готовое"""
+        out = StringIO()
+        call_command('prebuild_thumbnails', '--workers', '0', stdout=out)
+        self.assertIn('Создано: 1', out.getvalue())
+        self.assertTrue(thumbnails.is_built(self.post.image.name))
+        call_command('prebuild_thumbnails', '--workers', '0', stdout=out)
+        self.assertIn('Создано: 0', out.getvalue())
+
+    def test_prefetch_uses_one_query_then_lru(self):
+        """prefetch ищет миниатюры страницы одним запросом, потом в LRU"""
+        posts = [self.post, self.create_post('blue'),
+                 self.create_post('green')]
+        for post in posts[:2]:
+            thumbnails.build(post.image.name)
+        default.kvstore.lru.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            thumbnails.prefetch(posts, 'card')
+        self.assertEqual(len(queries), 1)
+        found = [thumbnails.prefetched(post.image, 'card') for post in posts]
+        self.assertTrue(all(hit for hit, _ in found))
+        self.assertEqual([im is not None for _, im in found],
+                         [True, True, False])
+        with CaptureQueriesContext(connection) as queries:
+            thumbnails.prefetch(Post.objects.order_by('pk')[:2], 'card')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(default.kvstore.lru.stats()['hits'], 2)
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        """LRUCache вытесняет самую давнюю запись и считает обращения"""
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(lru.stats(),
+                         {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_entries_expire(self):
+        """Запись LRUCache истекает через timeout секунд"""
+        lru = LRUCache(2, timeout=30)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        later = time.monotonic() + 31
+        with mock.patch('posts.kvstore.time.monotonic', return_value=later):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.stats()['size'], 0)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaFilesTest(TransactionTestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='photographer')
+        buffer = BytesIO()
+        Image.new('RGB', (30, 20), 'green').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def create_post(self):
+        post = Post(author=self.user, text='Пост с картинкой')
+        post.image.save('photo.png', ContentFile(self.content), save=False)
+        post.save()
+        return post
+
+    def test_identical_uploads_share_file_until_last_delete(self):
+        """Одинаковые картинки хранятся одним файлом со счётчиком ссылок"""
+        first, second = self.create_post(), self.create_post()
+        name = first.image.name
+        self.assertTrue(is_hashed(name))
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 2)
+        first.delete()
+        self.assertTrue(post_images.exists(name))
+        second.delete()
+        self.assertFalse(post_images.exists(name))
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+
+    def test_upload_during_last_release_keeps_file(self):
+        """Загрузка той же картинки во время удаления не теряет файл"""
+        first = self.create_post()
+        name = first.image.name
+        post = Post(author=self.user, text='Та же картинка')
+        with transaction.atomic():
+            first.delete()
+            # Файл ещё на месте: хранилище его не пишет, а reclaim
+            # выполнится после коммита, до сохранения нового поста.
+            post.image.save('photo.png', ContentFile(self.content),
+                            save=False)
+        post.save()
+        self.assertEqual(post.image.name, name)
+        self.assertTrue(post_images.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 1)
+        post.delete()
+        self.assertFalse(post_images.exists(name))
+
+    def test_migrate_media_paths_moves_old_files(self):
+        """migrate_media_paths переносит старые пути и пропускает новые"""
+        old_name = default_storage.save(
+            'posts/old.png', ContentFile(self.content))
+        posts = [Post.objects.create(author=self.user, text=f'Старый {n}')
+                 for n in range(2)]
+        Post.objects.filter(pk__in=[post.pk for post in posts]).update(
+            image=old_name)
+        out = StringIO()
+        call_command('migrate_media_paths', '--batch-size', '1', stdout=out)
+        self.assertIn('Перенесено файлов: 1', out.getvalue())
+        names = set(Post.objects.filter(pk__in=[post.pk for post in posts])
+                    .values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_hashed(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 2)
+        self.assertFalse(default_storage.exists(old_name))
+        call_command('migrate_media_paths', stdout=out)
+        self.assertIn('Перенесено файлов: 0', out.getvalue())
+
+
+class QueryPlanTest(TestCase):
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feeds_use_composite_indexes(self):
+        """Ленты и комментарии читаются по индексу без сортировки"""
+        querysets = {
+            'group': Post.objects.filter(group_id=1).order_by(
+                '-pub_date', '-id')[:11],
+            'author': Post.objects.filter(author_id=1).order_by(
+                '-pub_date', '-id')[:11],
+            'comments': Comment.objects.filter(post_id=1).order_by(
+                'created', 'id'),
+            'followers': Follow.objects.filter(author_id=1).values('user'),
+        }
+        for name, queryset in querysets.items():
+            with self.subTest(query=name):
+                plan = self.plan(queryset)
+                self.assertEqual(problems(plan), [], plan)
+                self.assertIn('INDEX', ' '.join(plan))
+
+    def test_problems_flag_scans_and_sorts(self):
+        """Полный проход и сортировка отмечаются, проход индекса — нет"""
+        self.assertEqual(
+            problems(['SCAN posts_post', 'SCAN posts_post USING INDEX x',
+                      'USE TEMP B-TREE FOR ORDER BY']),
+            ['SCAN posts_post', 'USE TEMP B-TREE FOR ORDER BY'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class SeedingTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_seed_builds_derived_data(self):
+        """Наполнение достраивает то, что обычно ведут сигналы"""
+        created = seeding.seed(users=8, groups=2, posts=40, comments=2,
+                               follows=3, images=2, image_share=0.5)
+        self.assertEqual(Post.objects.count(), created['posts'])
+        self.assertEqual(Comment.objects.count(), 80)
+        self.assertEqual(
+            sum(Post.objects.values_list('comments_count', flat=True)), 80)
+        self.assertEqual(UserStats.objects.count(), 8)
+        self.assertFalse(UserStats.objects.drifted().exists())
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.assertEqual(
+            sum(MediaFile.objects.values_list('refcount', flat=True)),
+            Post.objects.exclude(image='').count())
+        word = Post.objects.first().text.split()[0]
+        self.assertTrue(search.search(word, Post.objects.all()).exists())
+        self.assertEqual(len(set(
+            Post.objects.values_list('pub_date', flat=True))), 40)
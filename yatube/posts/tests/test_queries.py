@@ -0,0 +1,93 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+from .utils import QueryBudgetMixin
+
+POSTS_COUNT = 15
+
+# Запросов на одну страницу. Не должны зависеть от числа постов.
+# В каждом бюджете один запрос к хранилищу миниатюр sorl.
+# Лента подписок ещё ищет подмешанных авторов (и по запросу на каждого),
+# страница поста с пустым кэшем — имя автора, см. post_author_scopes.
+QUERY_BUDGETS = {
+    'posts:index': 4,
+    'posts:group_list': 5,
+    'posts:profile': 6,
+    'posts:post_detail': 6,
+    'posts:follow_index': 5,
+}
+# JSON API: ровно столько запросов, включая сессию и пользователя
+# для ленты подписок.
+API_QUERIES = {
+    'api:posts': 1,
+    'api:group_posts': 2,
+    'api:author_posts': 2,
+    'api:post_detail': 1,
+    'api:comments': 2,
+    'api:follow_posts': 4,
+}
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        for number in range(POSTS_COUNT):
+            author = User.objects.create_user(username=f'author{number}')
+            group = Group.objects.create(title=f'Группа {number}',
+                                         slug=f'group-{number}',
+                                         description='Описание')
+            post = Post.objects.create(text=f'Пост {number}',
+                                       author=author, group=group,
+                                       image=f'posts/{number}.jpg')
+            Comment.objects.create(post=post, author=cls.reader,
+                                   text='Комментарий')
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = post
+        cls.urls = {
+            'posts:index': reverse('posts:index'),
+            'posts:group_list': reverse('posts:group_list',
+                                        kwargs={'slug': group.slug}),
+            'posts:profile': reverse('posts:profile',
+                                     kwargs={'username': author.username}),
+            'posts:post_detail': reverse('posts:post_detail',
+                                         kwargs={'post_id': post.pk}),
+            'posts:follow_index': reverse('posts:follow_index'),
+            'api:posts': reverse('api:posts'),
+            'api:group_posts': reverse('api:group_posts',
+                                       kwargs={'slug': group.slug}),
+            'api:author_posts': reverse(
+                'api:author_posts', kwargs={'username': author.username}),
+            'api:post_detail': reverse('api:post_detail',
+                                       kwargs={'post_id': post.pk}),
+            'api:comments': reverse('api:comments',
+                                    kwargs={'post_id': post.pk}),
+            'api:follow_posts': reverse('api:follow_posts'),
+        }
+
+    def setUp(self):
+        self.client_reader = Client()
+        self.client_reader.force_login(self.reader)
+
+    def test_views_fit_query_budget(self):
+        """Страницы укладываются в заявленный бюджет запросов"""
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(view=name):
+                cache.clear()
+                with self.assertQueryBudget(budget, name):
+                    response = self.client_reader.get(self.urls[name])
+                self.assertEqual(response.status_code, 200)
+
+    def test_api_runs_fixed_number_of_queries(self):
+        """Ответы API делают одно и то же число запросов"""
+        for name, expected in API_QUERIES.items():
+            with self.subTest(view=name):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = self.client_reader.get(
+                        self.urls[name], {'limit': POSTS_COUNT})
+                self.assertEqual(response.status_code, 200)
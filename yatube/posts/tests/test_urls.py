@@ -27,6 +27,9 @@ class PostURLTests(TestCase):
         )
         cache.clear()
 
+    def setUp(self):
+        cache.clear()
+
     def test_urls_exist_at_desired_locations(self):
         """Проверка доступности адресов для всех пользователей"""
         test_codes_urls = {
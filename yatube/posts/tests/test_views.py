@@ -1,11 +1,17 @@
 import datetime as dt
+from unittest import mock
 
 from django import forms
+from django.conf import settings
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from ..models import Comment, Follow, Group, Post, User
+from .. import caching, timeline
+from ..management.commands.template_benchmark import same_html
+from ..models import (Comment, Follow, Group, Post, PulledAuthor,
+                      TimelineEntry, User, UserStats)
+from ..views import CACHE_TIME_SEC
 
 POST_PER_PAGE = 10
 
@@ -175,6 +181,37 @@ class PostViewsTest(TestCase):
                 self.assertEqual(len(response_page.context['page_obj']), 10)
                 self.assertEqual(len(response_page_1.context['page_obj']), 1)
 
+    def test_cursor_pagination_walks_feed(self):
+        """Курсоры обходят ленту без пропусков и повторов в обе стороны"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост {i}', group=self.group)
+            for i in range(POST_PER_PAGE * 2)
+        )
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        first = self.authorized_client.get(url).context['page_obj']
+        self.assertFalse(first.has_previous())
+        second = self.authorized_client.get(
+            url, {'cursor': first.paginator.next_cursor}).context['page_obj']
+        third = self.authorized_client.get(
+            url, {'cursor': second.paginator.next_cursor}).context['page_obj']
+        self.assertFalse(third.has_next())
+        seen = [post.pk for page in (first, second, third) for post in page]
+        expected = list(Post.objects.filter(group=self.group)
+                        .order_by('-pub_date', '-id')
+                        .values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        back = self.authorized_client.get(
+            url,
+            {'cursor': third.paginator.previous_cursor}).context['page_obj']
+        self.assertEqual(list(back), list(second))
+
+    def test_cursor_pagination_ignores_broken_cursor(self):
+        """Битый курсор открывает первую страницу"""
+        response = self.authorized_client.get(reverse('posts:index'),
+                                              {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'][0], self.post)
+
     def test_cache_index(self):
         """Проверка кэширования постов"""
         test_post = Post.objects.create(text='some text',
@@ -188,6 +225,192 @@ class PostViewsTest(TestCase):
         count_posts = Post.objects.count()
         self.assertEqual(count_posts, 1)
 
+    def test_post_create_invalidates_only_its_pages(self):
+        """Новый пост сбрасывает кэш только своих страниц"""
+        group_url = reverse('posts:group_list',
+                            kwargs={'slug': self.group.slug})
+        other_url = reverse('posts:group_list',
+                            kwargs={'slug': self.group2.slug})
+        self.guest_client.get(group_url)
+        other_before = self.guest_client.get(other_url).content
+        Group.objects.filter(pk=self.group2.pk).update(title='Без сигнала')
+        Post.objects.create(text='Свежий пост', author=self.user,
+                            group=self.group)
+        self.assertContains(self.guest_client.get(group_url), 'Свежий пост')
+        self.assertContains(self.guest_client.get(reverse('posts:index')),
+                            'Свежий пост')
+        self.assertEqual(self.guest_client.get(other_url).content,
+                         other_before)
+
+    def test_missing_pages_leave_no_versions(self):
+        """Адреса, которых нет, не оставляют версий в кэше"""
+        urls = [reverse('posts:group_list', kwargs={'slug': 'no-such'}),
+                reverse('posts:profile', kwargs={'username': 'nobody'}),
+                reverse('posts:post_detail', kwargs={'post_id': 10 ** 6}),
+                reverse('api:group_posts', kwargs={'slug': 'no-such'})]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.guest_client.get(url).status_code,
+                                 404)
+        scopes = [caching.GROUP.format(slug='no-such'),
+                  caching.PROFILE.format(username='nobody'),
+                  caching.POST.format(post_id=10 ** 6)]
+        self.assertEqual(cache.get_many(
+            [caching._version_key(scope) for scope in scopes]), {})
+        self.guest_client.get(reverse('posts:group_list',
+                                      kwargs={'slug': self.group.slug}))
+        _, created = caching.get_versions(
+            [caching.GROUP.format(slug=self.group.slug)])
+        self.assertEqual(created, [])
+
+    def test_stale_page_served_while_refreshing(self):
+        """Устаревшую страницу отдают, пока её перестраивает другой запрос"""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        self.guest_client.get(url)
+        Post.objects.bulk_create([Post(text='Пост без сигнала',
+                                       author=self.user, group=self.group)])
+        with mock.patch.object(caching, '_needs_refresh', return_value=True):
+            with mock.patch.object(caching.cache, 'add', return_value=False):
+                stale = self.guest_client.get(url)
+            fresh = self.guest_client.get(url)
+        self.assertNotContains(stale, 'Пост без сигнала')
+        self.assertContains(fresh, 'Пост без сигнала')
+        self.assertContains(self.guest_client.get(url), 'Пост без сигнала')
+
+    def test_page_refresh_is_probabilistic_before_expiry(self):
+        """Долго строящуюся страницу начинают обновлять до срока"""
+        now = dt.datetime.now().timestamp()
+        self.assertFalse(caching._needs_refresh(now + 3600, 0.0))
+        self.assertTrue(caching._needs_refresh(now - 1, 0.0))
+        with mock.patch.object(caching.random, 'random',
+                               return_value=0.999):
+            self.assertTrue(caching._needs_refresh(now + 5, 1.0))
+
+    def test_cached_page_shared_with_personal_fragments(self):
+        """Страница в кэше общая, личные части у каждого свои"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        guest = self.guest_client.get(url)
+        self.assertNotContains(guest, 'Редактировать')
+        self.assertNotContains(guest, 'csrfmiddlewaretoken')
+        author = self.authorized_client.get(url)
+        self.assertTemplateNotUsed(author, 'posts/post_detail.html')
+        self.assertContains(author, 'Редактировать')
+        self.assertContains(author, 'csrfmiddlewaretoken')
+        self.assertContains(author, self.user.username)
+        self.assertIn('Cookie', author['Vary'])
+        reader = Client()
+        reader.force_login(self.user2)
+        response = reader.get(url)
+        self.assertNotContains(response, 'Редактировать')
+        self.assertContains(response, 'Удалить', count=1)
+        self.assertContains(self.guest_client.get(url), 'Войти')
+
+    def test_cached_profile_follow_button(self):
+        """Кнопка подписки на общей странице профиля личная"""
+        url = reverse('posts:profile', kwargs={'username': self.user})
+        self.assertContains(self.guest_client.get(url), 'Подписаться')
+        reader = Client()
+        reader.force_login(self.user2)
+        self.assertContains(reader.get(url), 'Отписаться')
+
+    def test_fragment_markers_cannot_be_forged(self):
+        """Метка фрагмента в тексте поста не подставляется"""
+        Post.objects.create(text='<!--fragment:header?-->',
+                            author=self.user2)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, '&lt;!--fragment:header?--&gt;')
+        self.assertContains(response, '<header>', count=1)
+
+    def test_conditional_get_not_modified(self):
+        """Неизменившаяся страница отвечает 304 без запросов к БД"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        client = Client()
+        client.force_login(self.user)
+        etag = client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Last-Modified', self.guest_client.get(url))
+
+    def test_conditional_get_expires_with_page(self):
+        """ETag живёт не дольше страницы в кэше"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        etag = self.guest_client.get(url)['ETag']
+        later = dt.datetime.now().timestamp() + 2 * CACHE_TIME_SEC
+        with mock.patch.object(caching.time, 'time', return_value=later):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_and_user_names_invalidate_pages(self):
+        """Новые названия группы и имя автора видны на страницах сразу"""
+        index = reverse('posts:index')
+        detail = reverse('posts:post_detail',
+                         kwargs={'post_id': self.post.id})
+        etag = self.guest_client.get(detail)['ETag']
+        self.guest_client.get(index)
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(self.guest_client.get(index), 'Новое название')
+        self.assertEqual(self.guest_client.get(
+            detail, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Лесли'
+        user.save()
+        self.assertContains(self.guest_client.get(index), 'Лесли')
+        self.assertContains(self.guest_client.get(detail), 'Лесли')
+
+    def test_conditional_get_changes_with_page_and_user(self):
+        """ETag меняется после комментария и у другого пользователя"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        etag = self.authorized_client.get(url)['ETag']
+        self.assertEqual(self.guest_client.get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Comment.objects.create(post=self.post, author=self.user2,
+                               text='Новый комментарий')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Новый комментарий')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_changes_with_author_posts(self):
+        """Новый пост автора меняет ETag страниц его других постов"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        etag = self.authorized_client.get(url)['ETag']
+        Post.objects.create(text='Ещё пост', author=self.post.author)
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comment_invalidates_post_detail(self):
+        """Новый комментарий виден на странице поста сразу"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.guest_client.get(url)
+        Comment.objects.create(post=self.post, author=self.user2,
+                               text='Свежий комментарий')
+        self.assertContains(self.guest_client.get(url), 'Свежий комментарий')
+
+    def test_new_post_updates_author_count_on_post_page(self):
+        """Страница поста сразу показывает новое число постов автора"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.guest_client.get(url)
+        Post.objects.create(text='Ещё пост', author=self.post.author)
+        count = UserStats.objects.get(user=self.post.author).posts_count
+        self.assertContains(self.guest_client.get(url),
+                            f'<span >{count}</span>')
+
+    def test_renamed_author_count_on_post_page(self):
+        """После переименования автора страница поста следит за новым"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.guest_client.get(url)
+        author = User.objects.get(pk=self.post.author_id)
+        author.username = 'Leslie'
+        author.save()
+        self.guest_client.get(url)
+        Post.objects.create(text='Ещё пост', author=author)
+        count = UserStats.objects.get(user=author).posts_count
+        self.assertContains(self.guest_client.get(url),
+                            f'<span >{count}</span>')
+
     def test_follow_another_user(self):
         """Follow на другого пользователя работает корректно"""
         self.authorized_client.get(
@@ -207,6 +430,25 @@ class PostViewsTest(TestCase):
                                              author=self.user2).exists()
         self.assertEqual(False, follow_exist)
 
+    def test_profile_stats_follow_views(self):
+        """Подписка, отписка и посты меняют статистику профиля"""
+        self.authorized_client.get(
+            reverse('posts:profile_follow', kwargs={'username': self.user3}))
+        Post.objects.create(text='Ещё пост', author=self.user)
+        response = self.authorized_client.get(
+            reverse('posts:profile', kwargs={'username': self.user}))
+        stats = response.context['stats']
+        self.assertEqual(
+            (stats.followers_count, stats.followings_count,
+             stats.posts_count, stats.comments_count),
+            (1, 1, 2, 1))
+        self.assertEqual(
+            UserStats.objects.get(user=self.user3).followers_count, 1)
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow', kwargs={'username': self.user3}))
+        self.assertEqual(
+            UserStats.objects.get(user=self.user3).followers_count, 0)
+
     def test_post_follow_index_correct_context(self):
         """Follow index сформирован с правильным контекстом"""
         self.authorized_client.get(
@@ -230,3 +472,229 @@ class PostViewsTest(TestCase):
 
         response = self.authorized_client.get(reverse('posts:follow_index'))
         self.assertFalse(len(response.context.get('page_obj').object_list))
+
+
+class FollowTimelineTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.author = User.objects.create_user(username='Writer')
+        cls.client_reader = Client()
+        cls.client_reader.force_login(cls.reader)
+
+    def setUp(self):
+        cache.clear()
+
+    def feed(self):
+        response = self.client_reader.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_post_is_fanned_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Для ленты', author=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertEqual(self.feed(), [post])
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка дополняет ленту, отписка её очищает"""
+        post = Post.objects.create(text='Старый пост', author=self.author)
+        self.client_reader.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}))
+        self.assertEqual(self.feed(), [post])
+        self.client_reader.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}))
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    def test_post_delete_removes_entries(self):
+        """Удаление поста убирает его из лент"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Удалю', author=self.author)
+        post.delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @mock.patch.object(timeline, 'FANOUT_FOLLOWERS_LIMIT', 0)
+    def test_crowded_author_is_pulled_on_read(self):
+        """Посты популярного автора подмешиваются при чтении"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertTrue(PulledAuthor.objects.filter(
+            author=self.author).exists())
+        post = Post.objects.create(text='Популярный', author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertEqual(self.feed(), [post])
+
+    @mock.patch.object(timeline, 'FANOUT_FOLLOWERS_LIMIT', 2)
+    @mock.patch.object(timeline.transaction, 'on_commit',
+                       lambda func: func())
+    def test_author_returns_to_fan_out(self):
+        """Автор возвращается к рассылке заметно ниже порога"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        others = [User.objects.create_user(username=f'Other{number}')
+                  for number in range(2)]
+        for other in others:
+            Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(text='Без рассылки', author=self.author)
+        Follow.objects.filter(user=others[0]).delete()
+        self.assertTrue(PulledAuthor.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        Follow.objects.filter(user=others[1]).delete()
+        self.assertFalse(PulledAuthor.objects.exists())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+
+    def test_feed_pages_merge_pulled_authors(self):
+        """Курсоры ленты сливают записи ленты и подмешанных авторов"""
+        pulled = User.objects.create_user(username='Pulled')
+        Follow.objects.create(user=self.reader, author=self.author)
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWERS_LIMIT', 0):
+            Follow.objects.create(user=self.reader, author=pulled)
+        for i in range(7):
+            Post.objects.create(text=f'Пост {i}',
+                                author=pulled if i % 3 else self.author)
+        expected = list(timeline.feed(self.reader).order_by('-pub_date',
+                                                            '-id'))
+        paginator = timeline.FeedPaginator(self.reader, 3)
+        pages = [list(paginator.first_page())]
+        while paginator.next_cursor:
+            pages.append(list(paginator.get_page(paginator.next_cursor)))
+        self.assertEqual([post for page in pages for post in page],
+                         expected)
+        self.assertEqual(list(paginator.get_page(paginator.previous_cursor)),
+                         pages[-2])
+
+    def test_feed_page_reads_index_without_sorting(self):
+        """Страница ленты и автора читаются по индексам, без сортировки"""
+        paginator = timeline.FeedPaginator(self.reader, POST_PER_PAGE)
+        position = (dt.datetime.now(dt.timezone.utc), 1)
+        plans = {
+            'timeline': paginator._entries(position)[:POST_PER_PAGE].explain(),
+            'author': paginator._author_posts(
+                self.author.pk, position)[:POST_PER_PAGE].explain(),
+        }
+        self.assertIn('timeline_user_pub_date_idx', plans['timeline'])
+        self.assertIn('post_author_pub_date_idx', plans['author'])
+        for name, plan in plans.items():
+            with self.subTest(query=name):
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class PostSearchTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Searcher')
+        cls.other = User.objects.create_user(username='Other')
+        cls.group = Group.objects.create(title='Котики', slug='cats',
+                                         description='Про котиков')
+        cls.best = Post.objects.create(
+            author=cls.user, group=cls.group, theme='Котики',
+            text='Котики, котики и ещё раз котики')
+        cls.weak = Post.objects.create(
+            author=cls.other,
+            text='Длинный рассказ о погоде, где однажды упомянуты котики '
+                 'и очень много других слов про дождь и ветер')
+        cls.unrelated = Post.objects.create(author=cls.user,
+                                            text='Про собак')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        response = self.client.get(reverse('posts:search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def test_search_ranks_results(self):
+        """Поиск находит посты по префиксу и сортирует по релевантности"""
+        self.assertEqual(list(self.search(q='котик')),
+                         [self.best, self.weak])
+
+    def test_search_filters_by_group_and_author(self):
+        """Поиск фильтруется по группе и автору"""
+        self.assertEqual(list(self.search(q='котики', group='cats')),
+                         [self.best])
+        self.assertEqual(list(self.search(q='котики', author='Other')),
+                         [self.weak])
+
+    def test_search_follows_edits_and_deletes(self):
+        """Индекс обновляется при правке и удалении поста"""
+        self.unrelated.text = 'Про собак и котиков'
+        self.unrelated.save()
+        self.assertIn(self.unrelated, list(self.search(q='котиков')))
+        self.unrelated.delete()
+        self.assertEqual(list(self.search(q='собак')), [])
+
+    def test_search_paginates_by_cursor(self):
+        """Выдача листается курсорами без повторов"""
+        for number in range(POST_PER_PAGE + 5):
+            Post.objects.create(author=self.other,
+                                text=f'Попугай номер {number}')
+        first = self.search(q='попугай')
+        second = self.search(q='попугай',
+                             cursor=first.paginator.next_cursor)
+        found = [post.pk for post in first] + [post.pk for post in second]
+        self.assertEqual(len(found), POST_PER_PAGE + 5)
+        self.assertEqual(len(set(found)), len(found))
+
+    def test_search_ignores_query_syntax(self):
+        """Спецсимволы FTS в запросе не ломают поиск"""
+        self.assertEqual(list(self.search(q='"котики*) ^')),
+                         [self.best, self.weak])
+        self.assertEqual(list(self.search(q='***')), [])
+
+
+class TemplateEnginesTest(TestCase):
+    """Шаблоны Jinja2 дают тот же HTML, что и шаблоны Django."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', first_name="Д'Артаньян", last_name='& Ко')
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.group = Group.objects.create(title='Группа <b>', slug='group',
+                                         description='Описание & "цитата"')
+        for number in range(POST_PER_PAGE + 2):
+            cls.post = Post.objects.create(
+                author=cls.author, group=cls.group, theme=f'Тема {number}',
+                text=f"Пост {number}\nс 'кавычками' & <тегом>")
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий <i>')
+
+    def render(self, client, url, engine):
+        cache.clear()
+        engines = dict.fromkeys(settings.POSTS_TEMPLATE_ENGINES, engine)
+        with override_settings(POSTS_TEMPLATE_ENGINES=engines):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_engines_render_same_html(self):
+        reader = Client()
+        reader.force_login(self.reader)
+        author = Client()
+        author.force_login(self.author)
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:index') + '?page=2',
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        for client in (Client(), reader, author):
+            for url in urls:
+                with self.subTest(url=url):
+                    django_html = self.render(client, url, 'django')
+                    jinja_html = self.render(client, url, 'jinja2')
+                    self.assertTrue(same_html(django_html, jinja_html))
+        url = reverse('posts:follow_index')
+        self.assertTrue(same_html(self.render(reader, url, 'django'),
+                                  self.render(reader, url, 'jinja2')))
+        self.assertContains(reader.get(url), 'Пост 11<br>с &#39;кавычками'
+                                             '&#39; &amp; &lt;тегом&gt;')
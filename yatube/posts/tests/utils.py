@@ -0,0 +1,21 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Проверка бюджета SQL-запросов для TestCase."""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, label=''):
+        """Падает, если в блоке выполнено больше budget запросов."""
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}'
+                for number, query in enumerate(context.captured_queries, 1))
+            self.fail(f'{label}: {executed} запросов при бюджете {budget}'
+                      f'\n{queries}')
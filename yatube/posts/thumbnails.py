@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import connections
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import ImageFile
+
+from core import metrics
+
+from . import caching, workers
+
+logger = logging.getLogger(__name__)
+
+# Все размеры, которые используют шаблоны. Меняются только вместе.
+GEOMETRIES = {
+    'card': ('960x360', {'crop': 'center', 'upscale': True}),
+    'detail': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+PREBUILD_WORKERS = workers.WORKERS
+PREFETCHED_ATTR = '_prefetched_thumbnails'
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _options(source, options):
+    """Опции так же, как их дополняет ThumbnailBackend.get_thumbnail."""
+    backend = default.backend
+    options = dict(options)
+    if settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _thumbnail_file(image, kind):
+    geometry, options = GEOMETRIES[kind]
+    # Ключ sorl зависит от хранилища: источник всегда берётся по имени
+    # из хранилища по умолчанию, как его открывает build.
+    source = ImageFile(getattr(image, 'name', image))
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, _options(source, options))
+    return ImageFile(name, default.storage)
+
+
+def lookup(image, kind):
+    """Готовая миниатюра из хранилища sorl или None, без генерации."""
+    if not image:
+        return None
+    return default.kvstore.get(_thumbnail_file(image, kind))
+
+
+def prefetch(posts, kind):
+    """Ищет миниатюры всех постов страницы одним обращением к хранилищу.
+
+    Результат кладётся в пост, его берёт тег ready_thumbnail.
+    """
+    posts = [post for post in posts
+             if post.image and not post.image_variants]
+    if not posts:
+        return
+    found = default.kvstore.get_many(
+        [_thumbnail_file(post.image, kind) for post in posts])
+    for post, thumbnail in zip(posts, found):
+        post.__dict__.setdefault(PREFETCHED_ATTR, {})[kind] = thumbnail
+
+
+def prefetched(image, kind):
+    """(найдено ли в prefetch, миниатюра) для картинки поста."""
+    cache = getattr(image.instance, PREFETCHED_ATTR, {})
+    return kind in cache, cache.get(kind)
+
+
+def is_built(name):
+    return all(lookup(name, kind) is not None for kind in GEOMETRIES)
+
+
+def build(name):
+    """Создаёт недостающие миниатюры картинки. True, если всё готово.
+
+    Страницы с картинкой после этого сбрасываются: на них оригинал
+    сменится миниатюрой.
+    """
+    created = False
+    try:
+        for kind, (geometry, options) in GEOMETRIES.items():
+            if lookup(name, kind) is None:
+                started = time.perf_counter()
+                get_thumbnail(name, geometry, **options)
+                created = True
+                metrics.THUMBNAIL_TIME.observe(
+                    time.perf_counter() - started, kind=kind)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+        return False
+    finally:
+        if created:
+            caching.bump(*caching.image_scopes(name))
+    return True
+
+
+def build_in_worker(name):
+    """build для потока пула: закрывает за собой соединения с БД."""
+    try:
+        return build(name)
+    finally:
+        with _pending_lock:
+            _pending.discard(name)
+        connections.close_all()
+
+
+def schedule(name):
+    """Ставит картинку в очередь воркеров, если её там ещё нет."""
+    if not name or not workers.enabled():
+        return
+    try:
+        if not default_storage.exists(name):
+            return
+    except SuspiciousFileOperation:
+        return
+    with _pending_lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    workers.submit(build_in_worker, name)
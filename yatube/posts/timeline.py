@@ -0,0 +1,177 @@
+import heapq
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import workers
+from .models import Follow, Post, PulledAuthor, TimelineEntry
+from .pagination import CursorPaginator
+
+# Автор с большим числом подписчиков подмешивается в ленты при чтении.
+# Обратно к рассылке он возвращается, только когда подписчиков стало
+# меньше этой доли от лимита: иначе каждая отписка у порога
+# раскладывала бы все его посты заново.
+FANOUT_FOLLOWERS_LIMIT = 1000
+FANOUT_RESUME_SHARE = 0.9
+FANOUT_BATCH_SIZE = 500
+
+
+def _insert(entries):
+    """Сохраняет записи ленты пачками по FANOUT_BATCH_SIZE."""
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, FANOUT_BATCH_SIZE))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def is_pulled(author_id):
+    return PulledAuthor.objects.filter(author_id=author_id).exists()
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_pulled(post.author_id):
+        return
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True).iterator())
+    _insert(TimelineEntry(user_id=user_id, post_id=post.pk,
+                          pub_date=post.pub_date)
+            for user_id in followers)
+
+
+def fan_out_author(author_id, since=None):
+    """Раскладывает посты автора по лентам всех его подписчиков.
+
+    since — только посты, опубликованные не раньше.
+    """
+    posts = Post.objects.filter(author_id=author_id,
+                                author__following__isnull=False)
+    if since is not None:
+        posts = posts.filter(pub_date__gte=since)
+    edges = (posts.values_list('author__following__user', 'id', 'pub_date')
+             .iterator())
+    _insert(TimelineEntry(user_id=user_id, post_id=post_id,
+                          pub_date=pub_date)
+            for user_id, post_id, pub_date in edges)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    posts = (Post.objects.filter(author_id=author_id)
+             .values_list('id', 'pub_date').iterator())
+    _insert(TimelineEntry(user_id=user_id, post_id=post_id,
+                          pub_date=pub_date)
+            for post_id, pub_date in posts)
+
+
+def prune(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+
+
+def on_follow(user_id, author_id):
+    followers = Follow.objects.filter(author_id=author_id).count()
+    if followers > FANOUT_FOLLOWERS_LIMIT:
+        PulledAuthor.objects.get_or_create(author_id=author_id)
+        return
+    backfill(user_id, author_id)
+
+
+def on_unfollow(user_id, author_id):
+    prune(user_id, author_id)
+    if not is_pulled(author_id):
+        return
+    followers = Follow.objects.filter(author_id=author_id).count()
+    if followers < FANOUT_FOLLOWERS_LIMIT * FANOUT_RESUME_SHARE:
+        transaction.on_commit(
+            lambda: workers.submit(resume_fan_out, author_id))
+
+
+def resume_fan_out(author_id):
+    """Возвращает автора к рассылке, не задерживая запрос.
+
+    Пока посты раскладываются, автор ещё подмешивается при чтении.
+    Посты, вышедшие за это время, рассылка пропустила: они
+    раскладываются вторым, коротким проходом.
+    """
+    started = timezone.now()
+    fan_out_author(author_id)
+    PulledAuthor.objects.filter(author_id=author_id).delete()
+    fan_out_author(author_id, since=started)
+
+
+def pulled_authors(user):
+    return PulledAuthor.objects.filter(
+        author__following__user=user).values_list('author', flat=True)
+
+
+def feed(user):
+    """Посты ленты подписок: материализованные и подмешанные.
+
+    Для постраничной навигации (?page=), которой нужны COUNT и OFFSET;
+    курсорные страницы собирает FeedPaginator.
+    """
+    materialized = TimelineEntry.objects.filter(user=user).values('post')
+    return Post.objects.filter(Q(pk__in=materialized)
+                               | Q(author__in=pulled_authors(user)))
+
+
+class FeedPaginator(CursorPaginator):
+    """Курсорные страницы ленты подписок пользователя.
+
+    Страница записей ленты читается по timeline_user_pub_date_idx,
+    посты каждого подмешанного автора — отдельным запросом
+    с тем же LIMIT по post_author_pub_date_idx. Списки уже упорядочены
+    и сливаются без сортировки всей ленты.
+    """
+
+    def __init__(self, user, per_page):
+        self.user = user
+        super().__init__(TimelineEntry.objects.filter(user=user)
+                         .order_by('-pub_date', '-post_id'), per_page)
+
+    def _entries(self, position=None, backwards=False):
+        sign = '' if backwards else '-'
+        entries = (self.object_list
+                   .select_related('post__author', 'post__group')
+                   .order_by(f'{sign}pub_date', f'{sign}post_id'))
+        if position is None:
+            return entries
+        value, pk = position
+        lookup = 'gt' if backwards else 'lt'
+        return entries.filter(
+            Q(**{f'pub_date__{lookup}': value})
+            | Q(pub_date=value, **{f'post_id__{lookup}': pk}))
+
+    def _author_posts(self, author_id, position=None, backwards=False):
+        sign = '' if backwards else '-'
+        posts = (Post.objects.filter(author_id=author_id)
+                 .select_related('author', 'group')
+                 .order_by(f'{sign}pub_date', f'{sign}id'))
+        if position is None:
+            return posts
+        return posts.filter(self._beyond(*position, backwards))
+
+    def _rows(self, limit, position=None, backwards=False):
+        sources = [[entry.post for entry in
+                    self._entries(position, backwards)[:limit]]]
+        for author_id in pulled_authors(self.user):
+            sources.append(list(self._author_posts(
+                author_id, position, backwards)[:limit]))
+        rows = []
+        seen = set()
+        for post in heapq.merge(*sources, reverse=not backwards,
+                                key=lambda post: (post.pub_date, post.pk)):
+            # Пост мог остаться в ленте и после того, как автор
+            # перестал рассылать.
+            if post.pk not in seen:
+                seen.add(post.pk)
+                rows.append(post)
+                if len(rows) == limit:
+                    break
+        return rows
@@ -10,6 +10,7 @@ urlpatterns = [
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
     path('', views.index, name='index'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('search/', views.post_search, name='search'),
     path('create/', views.post_create, name="post_create"),
     path('posts/<post_id>/edit/', views.post_edit, name='post_edit'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
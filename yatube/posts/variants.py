@@ -0,0 +1,157 @@
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Ширины вариантов. Картинка уже самой большой ширины получает
+# ещё и вариант в свою ширину, крупнее оригинала вариантов нет.
+WIDTHS = (320, 640, 960, 1280)
+QUALITY = 80
+# Формат в порядке предпочтения: расширение, формат PIL, MIME-тип.
+# JPEG — запасной, он же идёт в src; WebP — если Pillow собран с ним.
+FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+FALLBACK_EXT = 'jpg'
+FOLDER = 'variants'
+# Карточка и пост занимают колонку col-md-9.
+SIZES = '(min-width: 768px) 75vw, 100vw'
+
+
+def supported_formats():
+    return [
+        (ext, pil_format, mime) for ext, pil_format, mime in FORMATS
+        if pil_format != 'WEBP' or features.check('webp')
+    ]
+
+
+def variant_name(name, width, ext):
+    """posts/cat.png -> posts/variants/cat.png.640w.jpg
+
+    В variants/ загрузки не попадают, а полное имя оригинала
+    не даёт совпасть вариантам cat.png и cat.jpg.
+    """
+    folder, filename = posixpath.split(name)
+    return posixpath.join(folder, FOLDER, f'{filename}.{width}w.{ext}')
+
+
+def dump(exts, widths):
+    """Описание вариантов для Post.image_variants: 'webp,jpg:320,640'."""
+    return f'{",".join(exts)}:{",".join(map(str, widths))}'
+
+
+def parse(value):
+    """(расширения, ширины) из Post.image_variants."""
+    if not value:
+        return [], []
+    exts, widths = value.split(':')
+    return exts.split(','), [int(width) for width in widths.split(',')]
+
+
+def _widths(original_width):
+    widths = [width for width in WIDTHS if width < original_width]
+    widths.append(min(original_width, WIDTHS[-1]))
+    return widths
+
+
+def _open(name):
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        # JPEG сразу декодируется в уменьшенном масштабе.
+        image.draft(None, (WIDTHS[-1], WIDTHS[-1]))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    has_alpha = (image.mode in ('RGBA', 'LA')
+                 or 'transparency' in image.info)
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def _flatten(image):
+    """JPEG не умеет прозрачность: подкладывает белый фон."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def generate(name):
+    """Создаёт варианты картинки из хранилища без EXIF.
+
+    Поворот из EXIF применяется к пикселям до того, как метаданные
+    отбрасываются. Возвращает значение для Post.image_variants.
+    """
+    image = _open(name)
+    formats = supported_formats()
+    widths = _widths(image.width)
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image
+        if width != image.width:
+            resized = image.resize((width, height), Image.LANCZOS)
+        for ext, pil_format, _ in formats:
+            frame = resized if pil_format == 'WEBP' else _flatten(resized)
+            buffer = BytesIO()
+            frame.save(buffer, pil_format, quality=QUALITY, exif=b'')
+            path = variant_name(name, width, ext)
+            default_storage.delete(path)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+    return dump([ext for ext, _, _ in formats], widths)
+
+
+def delete(name):
+    """Удаляет все варианты картинки."""
+    folder, filename = posixpath.split(name)
+    variants_folder = posixpath.join(folder, FOLDER)
+    if not default_storage.exists(variants_folder):
+        return
+    _, files = default_storage.listdir(variants_folder)
+    for file in files:
+        if file.startswith(f'{filename}.'):
+            default_storage.delete(posixpath.join(variants_folder, file))
+
+
+def refresh(post):
+    """Пересоздаёт варианты картинки поста и сохраняет их описание.
+
+    Если та же картинка (одинаковое содержимое — одно имя) уже есть
+    у другого поста, его варианты переиспользуются. Картинку, которую
+    PIL не открыл, пост показывает как раньше.
+    """
+    model = type(post)
+    value = ''
+    if post.image:
+        value = (model.objects.filter(image=post.image.name)
+                 .exclude(pk=post.pk).exclude(image_variants='')
+                 .values_list('image_variants', flat=True).first())
+    if post.image and not value:
+        try:
+            value = generate(post.image.name)
+        except (OSError, ValueError, SuspiciousFileOperation):
+            logger.exception('Не удалось создать варианты для %s',
+                             post.image.name)
+    value = value or ''
+    model.objects.filter(pk=post.pk).update(image_variants=value)
+    post.image_variants = value
+    return value
+
+
+def srcsets(image, value):
+    """[(MIME-тип, srcset)] по форматам и запасной URL для src."""
+    exts, widths = parse(value)
+    sources = [
+        (mime, ', '.join(
+            f'{default_storage.url(variant_name(image.name, width, ext))} '
+            f'{width}w' for width in widths))
+        for ext, _, mime in FORMATS if ext in exts
+    ]
+    src = default_storage.url(
+        variant_name(image.name, widths[-1], FALLBACK_EXT))
+    return sources, src
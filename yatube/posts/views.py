@@ -1,12 +1,14 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
-from django.core.cache import cache
 
+from . import caching, search, thumbnails, timeline
 from .forms import CommentForm, PostForm
-from .models import Group, Post, Follow, Comment
+from .models import Group, Post, Follow, Comment, UserStats
+from .pagination import CursorPaginator
 
 User = get_user_model()
 
@@ -14,13 +16,36 @@ POSTS_PER_PAGE = 10
 CACHE_TIME_SEC = 20
 
 
-def get_page(request, post_list):
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
+def get_page(request, post_list, cursor_paginator=None):
+    """Курсорная пагинация, а с параметром ?page= — постраничная.
+
+    Автор и группа подгружаются тем же запросом, что и посты:
+    карточка в includes/article.html обращается к обоим.
+    Миниатюры карточек страницы ищутся одним обращением.
+    cursor_paginator заменяет CursorPaginator по post_list, если
+    курсорные страницы собираются иначе (лента подписок).
+    """
+    post_list = post_list.select_related('author', 'group')
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        paginator = Paginator(post_list, POSTS_PER_PAGE)
+        page = paginator.get_page(page_number)
+    else:
+        paginator = (cursor_paginator
+                     or CursorPaginator(post_list, POSTS_PER_PAGE))
+        page = paginator.get_page(request.GET.get('cursor'))
+    page.object_list = list(page.object_list)
+    thumbnails.prefetch(page.object_list, 'card')
+    return page
+
 
+def render_page(request, view_name, template, context):
+    """render движком из настройки POSTS_TEMPLATE_ENGINES."""
+    return render(request, template, context,
+                  using=settings.POSTS_TEMPLATE_ENGINES.get(view_name))
 
-@cache_page(CACHE_TIME_SEC, key_prefix='index_page')
+
+@caching.versioned_cache_page(CACHE_TIME_SEC, caching.INDEX)
 def index(request):
     template = 'posts/index.html'
     title = "Это главная страница проекта Yatube."
@@ -28,9 +53,10 @@ def index(request):
     post_list = Post.objects.all()
     page_obj = get_page(request, post_list)
     context = {'title': title, 'text': text, 'page_obj': page_obj}
-    return render(request, template, context)
+    return render_page(request, 'index', template, context)
 
 
+@caching.versioned_cache_page(CACHE_TIME_SEC, caching.GROUP)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
@@ -38,40 +64,69 @@ def group_posts(request, slug):
     post_list = Post.objects.filter(group=group)
     page_obj = get_page(request, post_list)
     context = {'group': group, 'title': title, 'page_obj': page_obj}
-    return render(request, template, context)
+    return render_page(request, 'group_posts', template, context)
 
 
+@caching.versioned_cache_page(CACHE_TIME_SEC, caching.PROFILE)
 def profile(request, username):
     template = 'posts/profile.html'
     title = 'Профайл пользователя'
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    try:
+        stats = author.stats
+    except UserStats.DoesNotExist:
+        stats = UserStats.objects.rebuild_for(author)
     posts = author.posts.all()
     page_obj = get_page(request, posts)
-    following = Follow.objects.filter(user__username=request.user,
-                                      author=author)
-    followers_count = Follow.objects.filter(author=author).count()
-    followings_count = Follow.objects.filter(user=author).count()
     context = {
-        'followers_count': followers_count,
-        'followings_count': followings_count,
+        'followers_count': stats.followers_count,
+        'followings_count': stats.followings_count,
+        'stats': stats,
         'page_obj': page_obj,
         'author': author,
-        'following': following,
         'posts': posts,
         'title': title,
     }
-    return render(request, template, context)
+    return render_page(request, 'profile', template, context)
 
 
+@caching.versioned_cache_page(CACHE_TIME_SEC, caching.POST,
+                              caching.post_author_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post.objects.select_related('author', 'group'),
-                             id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
     template = 'posts/post_detail.html'
-    form = CommentForm(request.POST or None)
-    comments = post.comments.all()
-
-    context = {'form': form, 'comments': comments, 'post': post}
-
+    comments = post.comments.select_related('author')
+
+    context = {'comments': comments, 'post': post}
+
+    return render_page(request, 'post_detail', template, context)
+
+
+def post_search(request):
+    template = 'posts/search.html'
+    title = 'Поиск'
+    query = request.GET.get('q', '').strip()
+    post_list = Post.objects.select_related('author', 'group')
+    group_slug = request.GET.get('group')
+    if group_slug:
+        post_list = post_list.filter(group__slug=group_slug)
+    author_name = request.GET.get('author')
+    if author_name:
+        post_list = post_list.filter(author__username=author_name)
+    paginator = CursorPaginator(search.search(query, post_list),
+                                POSTS_PER_PAGE, field='rank',
+                                descending=False)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    thumbnails.prefetch(page_obj.object_list, 'card')
+    context = {
+        'title': title,
+        'query': query,
+        'group_slug': group_slug or '',
+        'author_name': author_name or '',
+        'page_obj': page_obj,
+    }
     return render(request, template, context)
 
 
@@ -85,7 +140,6 @@ def post_create(request):
         post.author = request.user
         post.save()
         return redirect('posts:profile', username=post.author.username)
-    cache.clear()
     return render(request, 'posts/create.html', {'form': form, 'title': title})
 
 
@@ -118,7 +172,8 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
@@ -127,10 +182,11 @@ def follow_index(request):
     template = 'posts/follow.html'
     title = 'Избранные авторы'
     text = 'Страница избранных авторов'
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page(request, post_list)
+    post_list = timeline.feed(request.user)
+    page_obj = get_page(request, post_list, timeline.FeedPaginator(
+        request.user, POSTS_PER_PAGE))
     context = {'title': title, 'text': text, 'page_obj': page_obj}
-    return render(request, template, context)
+    return render_page(request, 'follow_index', template, context)
 
 
 @login_required
@@ -156,7 +212,8 @@ def comment_delete(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
     post_id = comment.post_id
     if request.user.username == comment.author.username:
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
     return redirect('posts:post_detail', post_id=post_id)
 
 
@@ -165,5 +222,4 @@ def post_delete(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if request.user.username == post.author.username:
         post.delete()
-    cache.clear()
     return redirect(request.META['HTTP_REFERER'])
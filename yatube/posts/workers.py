@@ -0,0 +1,52 @@
+"""Фоновые потоки процесса: миниатюры (thumbnails) и рассылка
+постов по лентам (timeline).
+
+Работа ставится в пул после коммита и не задерживает ответ.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS,
+                                           thread_name_prefix='posts')
+        return _executor
+
+
+def enabled():
+    """Воркерам нужна своя связь с БД.
+
+    SQLite в памяти (тестовая база) делится между потоками через
+    shared cache, где блокировки таблиц не ждут, а сразу падают.
+    """
+    return not (connection.vendor == 'sqlite'
+                and connection.is_in_memory_db())
+
+
+def _run(func, args):
+    try:
+        return func(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s%r упала', func.__name__, args)
+    finally:
+        connections.close_all()
+
+
+def submit(func, *args):
+    """Выполняет func(*args) в пуле, а без воркеров — сразу."""
+    if not enabled():
+        return func(*args)
+    return _get_executor().submit(_run, func, args)
@@ -48,10 +48,13 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'sorl.thumbnail',
-    'debug_toolbar',
     ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SlowRequestMiddleware',
+    'core.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,14 +62,22 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.middleware.ViewTimingMiddleware',
 ]
 
+# debug_toolbar только для разработки: на боевом сервере время
+# запросов показывает Server-Timing (core.middleware).
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(-1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+JINJA2_DIR = os.path.join(BASE_DIR, 'jinja2')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.timing.DjangoTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,6 +90,21 @@ TEMPLATES = [
             ],
         },
     },
+    # Копии шаблонов лент и поста на Jinja2 с той же разметкой,
+    # см. POSTS_TEMPLATE_ENGINES.
+    {
+        'BACKEND': 'core.timing.Jinja2',
+        'NAME': 'jinja2',
+        'DIRS': [JINJA2_DIR],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            'environment': 'posts.jinja.environment',
+            'context_processors': [
+                'django.contrib.auth.context_processors.auth',
+                'core.context_processors.year.year',
+            ],
+        },
+    },
 ]
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
@@ -148,12 +174,76 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Один кэш на все процессы сервера: страницы и ключи sorl не
+# дублируются по воркерам. Для одного процесса подходит и
+# core.cache.SizedLocMemCache (лимит MAX_BYTES, сжатие, TinyLFU).
+# Сравнение с LocMemCache: manage.py cache_benchmark.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
     }
 }
 
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+
+# Движок шаблонов страниц posts.views: 'django' или 'jinja2'.
+# HTML одинаковый, Jinja2 рендерит быстрее; сравнение на данных
+# seed_data — manage.py template_benchmark.
+POSTS_TEMPLATE_ENGINES = {
+    'index': 'django',
+    'group_posts': 'django',
+    'profile': 'django',
+    'follow_index': 'django',
+    'post_detail': 'django',
+}
+
+# Замер запросов (core.middleware): доля запросов с записью в лог
+# core.middleware (уровень INFO, поля в атрибуте timing), обёртка
+# запросов к БД и заголовок Server-Timing — только для персонала
+# и INTERNAL_IPS.
+SERVER_TIMING_SAMPLE_RATE = 0.1
+SERVER_TIMING_SQL = True
+SERVER_TIMING_HEADER = True
+SERVER_TIMING_LOG = True
+
+# Замер каждого шаблона, тега и фильтра (core.template_profile):
+# дорого, только для поиска узких мест. Отчёт — /__templates__/
+# для персонала или manage.py profile_templates.
+TEMPLATE_PROFILING = False
+
+# Поиск N+1 (core.nplusone): при разработке повторы одного SELECT
+# больше порога пишутся в лог core.nplusone. В pytest проверка
+# включена всегда и роняет тест, см. core.pytest_plugin.
+NPLUSONE_ENABLED = DEBUG
+NPLUSONE_THRESHOLD = 3
+
+# Метрики Prometheus (core.metrics) на /metrics/: файл, общий для
+# воркеров, как часто воркер сбрасывает в него накопленное
+# и Bearer-токен сборщика (без токена метрики видит только персонал).
+# В тестах выключено, см. core.test_runner.
+METRICS_ENABLED = True
+METRICS_PATH = os.path.join(BASE_DIR, 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Журнал медленных запросов (core.slowlog): запросы дольше порога
+# и случайная доля остальных, с SQL, кэшем и временем шаблонов.
+# Пока он включён, запросы к БД замеряются и при SERVER_TIMING_SQL=False.
+# В тестах выключено, см. core.test_runner.
+SLOW_REQUEST_ENABLED = True
+SLOW_REQUEST_THRESHOLD_MS = 500
+SLOW_REQUEST_SAMPLE_RATE = 0.01
+# Каждый процесс пишет свой файл: slow_requests.<pid>.jsonl.
+SLOW_REQUEST_PATH = os.path.join(BASE_DIR, 'slow_requests.jsonl')
+SLOW_REQUEST_MAX_BYTES = 10 * 1024 ** 2
+SLOW_REQUEST_BACKUP_COUNT = 5
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
\ No newline at end of file
@@ -2,20 +2,26 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import metrics, template_profile
 from yatube import settings
 
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
+    path('api/v1/', include('posts.api_urls', namespace='api')),
     path('auth/', include('users.urls', namespace='users')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
-    path('admin/', admin.site.urls)
+    path('admin/', admin.site.urls),
+    path('metrics/', metrics, name='metrics'),
 ]
 
 handler404 = 'core.views.page_not_found'
 handler500 = 'core.views.server_error'
 handler403 = 'core.views.permission_denied'
 
+if settings.TEMPLATE_PROFILING:
+    urlpatterns += (path('__templates__/', template_profile,
+                         name='template_profile'),)
 
 if settings.DEBUG:
     import debug_toolbar